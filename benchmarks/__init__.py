@@ -0,0 +1,127 @@
+'''Performance benchmarks for Stango
+
+Each benchmark module has a run(site, options) function that measures
+a synthetic site created by benchmarks.site and returns a dict of
+results. run() runs the selected benchmarks and returns the results in
+a form that can be dumped as JSON and compared between versions.
+'''
+
+import contextlib
+import os
+import platform
+import sys
+import time
+
+from stango.stats import percentile
+
+BENCHMARKS = ['config', 'generate', 'server']
+
+
+class Options(object):
+    '''Parameters of a benchmark run, see run-benchmarks.py'''
+
+    def __init__(self, pages=1000, static_files=1000, tar_members=1000,
+                 file_size=4096, repeat=3, jobs=4, requests=500,
+                 concurrency=8):
+        self.pages = pages
+        self.static_files = static_files
+        self.tar_members = tar_members
+        self.file_size = file_size
+        self.repeat = repeat
+        self.jobs = jobs
+        self.requests = requests
+        self.concurrency = concurrency
+
+    def as_dict(self):
+        return dict(self.__dict__)
+
+
+def summary(samples):
+    '''Summarize a list of durations in seconds'''
+    samples = sorted(samples)
+    return {
+        'runs': len(samples),
+        'min': samples[0],
+        'median': percentile(samples, 50),
+        'mean': sum(samples) / len(samples),
+        'max': samples[-1],
+    }
+
+
+def measure(func, repeat, setup=None):
+    '''Call func repeat times and summarize the durations
+
+    setup is called before each call and is not included in the
+    timing.
+    '''
+    samples = []
+    for i in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return summary(samples)
+
+
+@contextlib.contextmanager
+def chdir(path):
+    saved = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(saved)
+
+
+@contextlib.contextmanager
+def environ(name, value):
+    saved = os.environ.get(name)
+    os.environ[name] = value
+    try:
+        yield
+    finally:
+        if saved is None:
+            del os.environ[name]
+        else:
+            os.environ[name] = saved
+
+
+def run(names, options, workdir):
+    from benchmarks import site
+
+    site_path = os.path.abspath(os.path.join(workdir, 'site'))
+    site.make_site(site_path, options)
+
+    # The tar indexes of the temporary site are written to the workdir
+    # instead of the user's cache directory
+    results = {}
+    cache_home = os.path.abspath(os.path.join(workdir, 'cache'))
+    with environ('XDG_CACHE_HOME', cache_home):
+        for name in names:
+            module = __import__('benchmarks.' + name, fromlist=['run'])
+            with chdir(site_path):
+                results[name] = module.run(site_path, options)
+
+    return {
+        'python': sys.version.split()[0],
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'options': options.as_dict(),
+        'results': results,
+    }
+
+
+def compare(old, new, prefix=''):
+    '''Yield (name, old, new) for the numeric results of both runs'''
+    for key in sorted(new):
+        if key not in old:
+            continue
+        name = prefix + key
+        if isinstance(new[key], dict) and isinstance(old[key], dict):
+            for item in compare(old[key], new[key], name + '.'):
+                yield item
+        elif isinstance(new[key], (int, float)) and \
+             isinstance(old[key], (int, float)):
+            yield name, old[key], new[key]
@@ -0,0 +1,28 @@
+'''Time loading conf.py and creating the manager'''
+
+import os
+
+import stango.main
+from benchmarks import measure
+from stango.tar import default_index_path
+
+
+def load():
+    return stango.main.make_manager(stango.main.load_config())
+
+
+def remove_tar_index():
+    try:
+        os.remove(default_index_path('archive.tar'))
+    except OSError:
+        pass
+
+
+def run(site, options):
+    manager = load()
+    return {
+        'files': sum(1 for filespec in manager.files.iter_all()),
+        # The tar archive is scanned and its index written
+        'cold': measure(load, options.repeat, setup=remove_tar_index),
+        'warm': measure(load, options.repeat),
+    }
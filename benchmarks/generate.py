@@ -0,0 +1,39 @@
+'''Time Stango.generate with different settings'''
+
+import os
+
+import stango.main
+from benchmarks import measure
+
+
+def run(site, options):
+    manager = stango.main.make_manager(stango.main.load_config())
+    files = sum(1 for filespec in manager.files.iter_all())
+    outdir = os.path.join(site, 'out')
+
+    def generate():
+        manager.generate(outdir)
+
+    results = {'files': files}
+
+    manager.generate_jobs = 1
+    results['serial'] = measure(generate, options.repeat)
+
+    if options.jobs > 1:
+        manager.generate_jobs = options.jobs
+        results['parallel'] = measure(generate, options.repeat)
+        results['parallel']['jobs'] = options.jobs
+
+    # Nothing has changed since the first build, so only the manifest
+    # is checked
+    manager.generate_jobs = 1
+    manager.incremental = True
+    manager.generate(outdir)
+    results['incremental_noop'] = measure(generate, options.repeat)
+
+    for name in ['serial', 'parallel']:
+        if name in results:
+            results[name]['files_per_second'] = \
+                files / results[name]['median']
+
+    return results
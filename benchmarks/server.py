@@ -0,0 +1,98 @@
+'''Time requests to the development server'''
+
+from http.client import HTTPConnection
+import itertools
+import threading
+import time
+
+import stango.main
+from benchmarks import site as site_module
+from stango.stats import percentile
+
+
+def request(port, path):
+    conn = HTTPConnection('127.0.0.1', port)
+    try:
+        conn.request('GET', path)
+        response = conn.getresponse()
+        response.read()
+        if response.status != 200:
+            raise RuntimeError('GET %s: %d' % (path, response.status))
+    finally:
+        conn.close()
+
+
+def latency(port, paths, count):
+    samples = []
+    for path in itertools.islice(itertools.cycle(paths), count):
+        start = time.perf_counter()
+        request(port, path)
+        samples.append(time.perf_counter() - start)
+
+    samples.sort()
+    return {
+        'requests': len(samples),
+        'p50': percentile(samples, 50),
+        'p90': percentile(samples, 90),
+        'p99': percentile(samples, 99),
+        'max': samples[-1],
+    }
+
+
+def throughput(port, paths, count, concurrency):
+    paths = itertools.islice(itertools.cycle(paths), count)
+    lock = threading.Lock()
+    errors = []
+
+    def client():
+        while True:
+            with lock:
+                path = next(paths, None)
+            if path is None:
+                return
+            try:
+                request(port, path)
+            except Exception as exc:
+                errors.append(exc)
+                return
+
+    threads = [threading.Thread(target=client) for i in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    if errors:
+        raise errors[0]
+    return {
+        'requests': count,
+        'concurrency': concurrency,
+        'seconds': elapsed,
+        'requests_per_second': count / elapsed,
+    }
+
+
+def run(site, options):
+    manager = stango.main.make_manager(stango.main.load_config())
+    httpd = manager.make_server('127.0.0.1', 0, verbose=False)
+    port = httpd.server_address[1]
+    thread = threading.Thread(target=httpd.serve_forever)
+    thread.start()
+
+    try:
+        results = {}
+        all_paths = []
+        for kind, paths in sorted(site_module.request_paths(options).items()):
+            if paths:
+                results[kind] = latency(port, paths, options.requests)
+                all_paths.extend(paths)
+
+        results['throughput'] = throughput(
+            port, all_paths, options.requests, options.concurrency)
+        return results
+    finally:
+        httpd.shutdown()
+        thread.join()
+        httpd.server_close()
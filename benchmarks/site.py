@@ -0,0 +1,121 @@
+'''Create a synthetic site for the benchmarks
+
+The site has template pages rendered by a view, a directory of static
+files served by files_from_dir and a tar archive served by
+files_from_tar. Its size is controlled by benchmarks.Options.
+'''
+
+import os
+import shutil
+import tarfile
+
+CONF = '''\
+from stango import Files
+from stango.files import files_from_dir, files_from_tar
+import bench_views
+
+index_file = 'index.html'
+
+files = Files(
+    ('', bench_views.index, {'pages': %(pages)d}),
+    [('page/%%d/' %% i, bench_views.page, {'number': i})
+     for i in range(%(pages)d)],
+)
+files += files_from_dir('static', 'static', strip=1)
+files += files_from_tar('archive', 'archive.tar', strip=1)
+'''
+
+VIEWS = '''\
+def index(context, pages):
+    return context.render_template('index.html', pages=range(pages))
+
+def page(context, number):
+    items = [{'title': 'Item %d' % i, 'value': i * number} for i in range(20)]
+    return context.render_template('page.html', number=number, items=items)
+'''
+
+BASE_TEMPLATE = '''\
+<!DOCTYPE html>
+<html>
+  <head><title>{% block title %}{% endblock %}</title></head>
+  <body>
+    <div id="content">{% block content %}{% endblock %}</div>
+  </body>
+</html>
+'''
+
+INDEX_TEMPLATE = '''\
+{% extends "base.html" %}
+{% block title %}Index{% endblock %}
+{% block content %}
+<ul>
+{% for page in pages %}  <li><a href="page/{{ page }}/">Page {{ page }}</a></li>
+{% endfor %}</ul>
+{% endblock %}
+'''
+
+PAGE_TEMPLATE = '''\
+{% extends "base.html" %}
+{% block title %}Page {{ number }}{% endblock %}
+{% block content %}
+<h1>Page {{ number }}</h1>
+<table>
+{% for item in items %}  <tr><td>{{ item.title|e }}</td><td>{{ item.value }}</td></tr>
+{% endfor %}</table>
+{% endblock %}
+'''
+
+
+def _write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    mode = 'wb' if isinstance(data, bytes) else 'w'
+    with open(path, mode) as fobj:
+        fobj.write(data)
+
+
+def _static_name(index):
+    # Spread the files over nested directories, 100 files in each
+    return 'dir%d/sub%d/file%d.txt' % (index // 1000, index // 100 % 10, index)
+
+
+def _content(index, size):
+    line = ('%d ' % index).encode('ascii') * 16 + b'\n'
+    return (line * (size // len(line) + 1))[:size]
+
+
+def make_site(path, options):
+    '''Create a site to path, replacing an existing one'''
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.makedirs(path)
+
+    _write(os.path.join(path, 'conf.py'), CONF % {'pages': options.pages})
+    _write(os.path.join(path, 'bench_views.py'), VIEWS)
+    _write(os.path.join(path, 'templates', 'base.html'), BASE_TEMPLATE)
+    _write(os.path.join(path, 'templates', 'index.html'), INDEX_TEMPLATE)
+    _write(os.path.join(path, 'templates', 'page.html'), PAGE_TEMPLATE)
+
+    os.makedirs(os.path.join(path, 'static'))
+    for i in range(options.static_files):
+        _write(os.path.join(path, 'static', _static_name(i)),
+               _content(i, options.file_size))
+
+    members = os.path.join(path, 'members')
+    for i in range(options.tar_members):
+        _write(os.path.join(members, _static_name(i)),
+               _content(i, options.file_size))
+    with tarfile.open(os.path.join(path, 'archive.tar'), 'w') as tar:
+        if options.tar_members:
+            tar.add(members, 'archive')
+    shutil.rmtree(members, ignore_errors=True)
+
+
+def request_paths(options):
+    '''Return a sample of the served paths of each kind'''
+    return {
+        'page': ['/page/%d/' % i for i in range(options.pages)],
+        'static': ['/static/' + _static_name(i)
+                   for i in range(options.static_files)],
+        'tar': ['/archive/' + _static_name(i)
+                for i in range(options.tar_members)],
+    }
@@ -0,0 +1,76 @@
+import json
+import sys
+import tempfile
+from optparse import OptionParser
+
+import benchmarks
+
+parser = OptionParser(usage='%prog [options] [BENCHMARK...]',
+                      description='Available benchmarks: ' +
+                      ', '.join(benchmarks.BENCHMARKS))
+defaults = benchmarks.Options()
+parser.add_option('-p', '--pages', type='int', default=defaults.pages,
+                  help='Number of template pages (default: %default)')
+parser.add_option('-s', '--static-files', type='int',
+                  default=defaults.static_files,
+                  help='Number of static files (default: %default)')
+parser.add_option('-t', '--tar-members', type='int',
+                  default=defaults.tar_members,
+                  help='Number of files in the tar archive (default: %default)')
+parser.add_option('--file-size', type='int', default=defaults.file_size,
+                  help='Size of static files in bytes (default: %default)')
+parser.add_option('-r', '--repeat', type='int', default=defaults.repeat,
+                  help='Number of timed runs (default: %default)')
+parser.add_option('-j', '--jobs', type='int', default=defaults.jobs,
+                  help='generate_jobs of the parallel run (default: %default)')
+parser.add_option('-n', '--requests', type='int', default=defaults.requests,
+                  help='Number of requests per measurement (default: %default)')
+parser.add_option('-c', '--concurrency', type='int',
+                  default=defaults.concurrency,
+                  help='Concurrent clients for throughput (default: %default)')
+parser.add_option('-o', '--output', metavar='FILE',
+                  help='Write the results as JSON to FILE (default: stdout)')
+parser.add_option('--compare', metavar='FILE',
+                  help='Compare the results to an earlier output FILE')
+parser.add_option('-d', '--workdir', metavar='DIR',
+                  help='Create the site to DIR (default: a temporary directory)')
+
+options, args = parser.parse_args()
+for name in args:
+    if name not in benchmarks.BENCHMARKS:
+        parser.error('unknown benchmark: %s' % name)
+
+bench_options = benchmarks.Options(
+    pages=options.pages,
+    static_files=options.static_files,
+    tar_members=options.tar_members,
+    file_size=options.file_size,
+    repeat=options.repeat,
+    jobs=options.jobs,
+    requests=options.requests,
+    concurrency=options.concurrency,
+)
+
+if options.workdir:
+    result = benchmarks.run(args or benchmarks.BENCHMARKS, bench_options,
+                            options.workdir)
+else:
+    with tempfile.TemporaryDirectory(prefix='stango-bench-') as workdir:
+        result = benchmarks.run(args or benchmarks.BENCHMARKS, bench_options,
+                                workdir)
+
+if options.output:
+    with open(options.output, 'w') as fobj:
+        json.dump(result, fobj, indent=2, sort_keys=True)
+else:
+    json.dump(result, sys.stdout, indent=2, sort_keys=True)
+    print()
+
+if options.compare:
+    with open(options.compare) as fobj:
+        old = json.load(fobj)
+    for name, old_value, new_value in benchmarks.compare(old['results'],
+                                                         result['results']):
+        change = (new_value / old_value - 1) * 100 if old_value else 0
+        print('%-40s %12.6g %12.6g %+7.1f%%' %
+              (name, old_value, new_value, change), file=sys.stderr)
@@ -1,13 +1,55 @@
+import asyncio
 import collections
 import errno
+import inspect
+import io
+import itertools
+import multiprocessing
 import os
+import pickle
 import shutil
+import stat
+import threading
+import time
+import traceback
+from stango.compress import MIN_SIZE, SUFFIXES, Compressors, \
+    check_encodings, is_compressible, tee
 from stango.context import Context
-from stango.decorators import cached_property
+from stango.decorators import locked_cached_property
 from stango.files import Files
+from stango.manifest import Manifest, filespec_key
+from stango.profile import BuildReport, Timer, view_name
 
 STANGO_TEMPLATE_DIR = os.path.join(os.path.dirname(__file__), 'templates')
 
+# Streamed view results are read and written in chunks of this size
+CHUNK_SIZE = 64 * 1024
+
+
+def _default_hook(context, data):
+    return data
+
+# A streaming hook is passed streamed results as an iterator of bytes,
+# and returns an iterable of bytes for them. Other hooks always get
+# the whole result as bytes.
+_default_hook.streaming = True
+
+
+class GenerateError(Exception):
+    '''An error of a parallel generate worker that can't be pickled
+
+    The error is raised in the main process instead, with the formatted
+    traceback of the original error.
+    '''
+
+    def __init__(self, path, traceback):
+        super(GenerateError, self).__init__(path, traceback)
+        self.path = path
+        self.traceback = traceback
+
+    def __str__(self):
+        return 'Generating %r failed:\n%s' % (self.path, self.traceback)
+
 
 class Stango(object):
     HOOK_NAMES = ['post_render_hook']
@@ -17,68 +59,303 @@ class Stango(object):
         self.index_file = None
         self.jinja_extensions = []
         self.template_dirs = [STANGO_TEMPLATE_DIR]
+        self.generate_jobs = 1
+
+        # The maximum number of async or io_bound views that generate
+        # renders concurrently, see stango.views.io_bound
+        self.generate_concurrency = 8
+        self.incremental = False
+        self.server_threads = 16
+
+        # 'threading' serves each connection in its own thread,
+        # 'asyncio' serves them all in an event loop, with keep-alive
+        # and pipelining, and awaits async views in it
+        self.server_engine = 'threading'
+        self.response_cache_size = 0
+        self.template_cache_dir = None
+        self.template_cache_size = 64 * 1024 * 1024
+
+        # Called with a dict describing each request to the server
+        self.request_hook = None
+
+        # Serve request statistics at /_stango/stats
+        self.server_stats = False
+
+        # Keep the outputs of the previous build whose content didn't
+        # change, instead of clearing the output directory
+        self.skip_unchanged = False
+
+        # Write precompressed siblings with these encodings ('gzip',
+        # 'br') of compressible outputs, and compress the responses of
+        # the development server with them
+        self.precompress = []
+
+        # Glob patterns of the paths of assets that are served under a
+        # content-hashed name, see Context.asset()
+        self.fingerprint = []
+
+        # Record per-page timings to build_report when generating
+        self.profile = False
+        self.build_report = None
 
         # By default, all hooks return the data unmodified
-        default_hook = lambda context, data: data
-        self.hooks = {hook_name: default_hook for hook_name in self.HOOK_NAMES}
+        self.hooks = {hook_name: _default_hook for hook_name in self.HOOK_NAMES}
 
-    @cached_property
+    @locked_cached_property
     def jinja_env(self):
-        from jinja2 import Environment, FileSystemLoader
+        from jinja2 import FileSystemLoader
+        from stango.jinja import BytecodeCache, Environment
         loader = FileSystemLoader(self.template_dirs)
-        return Environment(loader=loader, extensions=self.jinja_extensions)
+        bytecode_cache = None
+        if self.template_cache_dir:
+            bytecode_cache = BytecodeCache(self.template_cache_dir,
+                                           self.template_cache_size)
+        return Environment(loader=loader, extensions=self.jinja_extensions,
+                           bytecode_cache=bytecode_cache)
+
+    def compile_templates(self):
+        '''Compile all the templates of template_dirs up front
+
+        The compiled templates are kept in the template cache of
+        jinja_env, and written to the bytecode cache of
+        template_cache_dir, if any, for later runs. Processes forked
+        after this share them instead of compiling every template
+        again. Templates that fail to compile are skipped, they raise
+        their error when rendered. Return the number of templates.
+
+        The template cache is enlarged to hold all the templates if
+        needed, as otherwise the last ones would evict the first ones.
+        '''
+        from jinja2 import TemplateSyntaxError
+        env = self.jinja_env
+        names = env.list_templates()
+        # Only the LRU cache of a positive cache_size has a capacity
+        if getattr(env.cache, 'capacity', len(names)) < len(names):
+            env.cache.capacity = len(names)
+
+        count = 0
+        for name in names:
+            try:
+                env.get_template(name)
+            except (TemplateSyntaxError, UnicodeDecodeError):
+                continue
+            count += 1
+        return count
+
+    def clear_template_cache(self):
+        env = self.__dict__.get('jinja_env')
+        if env is not None and env.cache is not None:
+            env.cache.clear()
+
+    @locked_cached_property
+    def assets(self):
+        from stango.assets import AssetManifest
+        return AssetManifest(self)
+
+    @locked_cached_property
+    def response_cache(self):
+        if self.response_cache_size <= 0:
+            return None
+        from stango.cache import ResponseCache
+        return ResponseCache(self.response_cache_size)
 
     def view(self, filespec, mode):
+        result = self.stream(filespec, mode)
+        if is_file_result(result):
+            with result:
+                result = result.read()
+        elif not isinstance(result, (bytes, bytearray)):
+            result = b''.join(result)
+        return result
+
+    def stream(self, filespec, mode):
+        '''Like view(), but return streamed results as an iterator of bytes
+
+        If the view returns a regular file opened in binary mode and there's
+        no post_render_hook, the file object itself is returned so that it
+        can be copied without reading it to memory (see is_file_result()).
+        '''
+        return self._stream(filespec, mode)[0]
+
+    def _stream(self, filespec, mode):
+        # Return (result, cache), where cache is 'hit' or 'miss' if the
+        # response cache was used
+        result = self._cache_get(filespec, mode)
+        if result is not None:
+            return result, 'hit'
+
+        context, result = self.render(filespec, mode)
+        return result, self._cache_put(filespec, mode, context, result)
+
+    async def _stream_async(self, filespec, mode):
+        # Like _stream(), but async views are awaited in the running
+        # event loop, and other views are run in its default executor
+        if not inspect.iscoroutinefunction(filespec.view):
+            loop = asyncio.get_event_loop()
+            return await loop.run_in_executor(None, self._stream, filespec,
+                                              mode)
+
+        result = self._cache_get(filespec, mode)
+        if result is not None:
+            return result, 'hit'
+
+        context, result = await self.render_async(filespec, mode)
+        return result, self._cache_put(filespec, mode, context, result)
+
+    def _cache_get(self, filespec, mode):
+        if mode != 'serving':
+            return None
+
+        if self.fingerprint and self.assets.is_asset(filespec.path):
+            # Assets are rendered when they're hashed
+            rendered = self.assets.rendered(filespec)
+            if rendered is not None:
+                return rendered[1]
+
+        cache = self.response_cache
+        if cache is None:
+            return None
+        return cache.get(filespec.realpath(self.index_file))
+
+    def _cache_put(self, filespec, mode, context, result):
+        cache = self.response_cache if mode == 'serving' else None
+        if cache is None:
+            return None
+        if isinstance(result, (bytes, bytearray)):
+            cache.put(context.realpath, result, context.dependencies,
+                      context.started)
+        return 'miss'
+
+    def render(self, filespec, mode):
+        '''Like stream(), but return the Context of the view, too
+
+        The coroutine of an async view is run to completion in an event
+        loop of the calling thread.
+        '''
+        context = self._context(filespec, mode)
+        with Timer(context.timings, 'view'):
+            view_result = filespec.view(context, **filespec.kwargs)
+            if inspect.iscoroutine(view_result):
+                view_result = _run_coroutine(view_result)
+        return context, self._result(context, filespec, view_result)
+
+    async def render_async(self, filespec, mode):
+        '''Like render(), but await the coroutine of an async view'''
+        context = self._context(filespec, mode)
+        with Timer(context.timings, 'view'):
+            view_result = filespec.view(context, **filespec.kwargs)
+            if inspect.iscoroutine(view_result):
+                view_result = await view_result
+        return context, self._result(context, filespec, view_result)
+
+    def _context(self, filespec, mode):
         assert mode in ('generating', 'serving')
 
         context = Context(self, mode, filespec)
-        view_result = filespec.view(context, **filespec.kwargs)
+        if context.timings is not None:
+            context.timings['function'] = view_name(filespec.view)
+        return context
 
+    def _result(self, context, filespec, view_result):
+        # Convert the return value of a view to the result, and pass it
+        # through post_render_hook
         if isinstance(view_result, str):
-            byte_result = view_result.encode('utf-8')
+            result = view_result.encode('utf-8')
         elif isinstance(view_result, (bytes, bytearray)):
-            byte_result = view_result
+            result = view_result
+        elif (is_file_result(view_result) and
+              self.hooks['post_render_hook'] is _default_hook):
+            return view_result
         elif (hasattr(view_result, 'read') and
               isinstance(view_result.read, collections.Callable)):
-            file_contents = view_result.read()
-            if isinstance(file_contents, str):
-                byte_result = file_contents.encode('utf-8')
-            elif isinstance(file_contents, (bytes, bytearray)):
-                byte_result = file_contents
-            else:
-                raise ValueError('Contents of the file-like object, returned by view %r for path %r, is not a str, bytes or bytearray instance' % (filespec.view.__name__, filespec.path))
+            error = 'Contents of the file-like object, returned by view %r for path %r, is not a str, bytes or bytearray instance' % (filespec.view.__name__, filespec.path)
+            result = Stream(_read_chunks(view_result, error),
+                            getattr(view_result, 'size', None),
+                            getattr(view_result, 'mtime', None),
+                            view_result)
+        elif isinstance(view_result, collections.Iterable):
+            error = 'A chunk of the iterable, returned by view %r for path %r, is not a str, bytes or bytearray instance' % (filespec.view.__name__, filespec.path)
+            result = Stream(_iter_bytes(view_result, error))
         else:
             raise ValueError('The result of view %r for path %r is not a str, bytes or bytearray instance or a file-like object' % (filespec.view.__name__, filespec.path))
 
-        result = self.hooks['post_render_hook'](context, byte_result)
-        if not isinstance(result, (bytes, bytearray)):
-            raise ValueError('The result of post_render_hook is not a bytes or bytearray instance for %s' % context.realpath)
+        hook = self.hooks['post_render_hook']
+        error = 'The result of post_render_hook is not a bytes or bytearray instance for %s' % context.realpath
+        if not getattr(hook, 'streaming', False) and \
+           not isinstance(result, (bytes, bytearray)):
+            result = b''.join(result)
+
+        with Timer(context.timings, 'hook'):
+            result = hook(context, result)
+        # A Stream that is passed through keeps its size and mtime
+        if not isinstance(result, (bytes, bytearray, Stream)):
+            if not getattr(hook, 'streaming', False) or \
+               not isinstance(result, collections.Iterable) or \
+               isinstance(result, str):
+                raise ValueError(error)
+            result = Stream(_iter_bytes(result, error))
 
         return result
 
     def make_server(self, host, port, verbose=False):
-        from stango.http import StangoHTTPServer
+        if self.server_engine == 'asyncio':
+            from stango.asyncserver import AsyncHTTPServer as server_class
+        elif self.server_engine == 'threading':
+            from stango.http import StangoHTTPServer as server_class
+        else:
+            raise ValueError('Invalid server engine %r' % self.server_engine)
 
         if port < 0 or port > 65535:
             raise ValueError('Invalid port %r' % port)
 
-        httpd = StangoHTTPServer((host, port), self)
+        httpd = server_class((host, port), self)
         httpd.verbose = verbose
 
         return httpd
 
     def generate(self, outdir):
-        if os.path.exists(outdir):
-            if os.path.isdir(outdir):
-                # Delete the contents outdir, not outdir itself
-                for entry in os.listdir(outdir):
-                    path = os.path.join(outdir, entry)
-                    if os.path.isdir(path):
-                        shutil.rmtree(path)
-                    else:
-                        os.remove(path)
-            else:
-                raise ValueError('%r is not a directory' % outdir)
+        if os.path.exists(outdir) and not os.path.isdir(outdir):
+            raise ValueError('%r is not a directory' % outdir)
+
+        check_encodings(self.precompress)
+
+        assets = None
+        if self.fingerprint:
+            # Load the asset hashes of the previous build
+            from stango.assets import AssetManifest
+            assets = self.assets = AssetManifest(self, outdir)
+            assets.load()
+
+        try:
+            self._generate(outdir, assets)
+        finally:
+            self.__dict__.pop('assets', None)
+
+    def _generate(self, outdir, assets):
+        manifest = None
+        loaded = False
+        if self.incremental:
+            # Changing these changes the set of files written, the
+            # URLs of the assets in every page, or how every template
+            # is rendered
+            manifest = Manifest(outdir, {
+                'precompress': list(self.precompress),
+                'fingerprint': list(self.fingerprint),
+                'index_file': self.index_file,
+                'template_dirs': list(self.template_dirs),
+                'jinja_extensions': [
+                    ext if isinstance(ext, str) else view_name(ext)
+                    for ext in self.jinja_extensions
+                ],
+            })
+            loaded = manifest.load()
+
+        # Without a manifest, the outputs of the previous build are
+        # either cleared up front, or kept and compared to the new ones
+        # and the leftovers removed afterwards
+        if not loaded and not self.skip_unchanged:
+            self._clear_outdir(outdir)
+        sweep = not loaded and self.skip_unchanged
 
         try:
             os.mkdir(outdir)
@@ -86,15 +363,223 @@ class Stango(object):
             if err.errno != errno.EEXIST:
                 raise
 
-        for filespec in self.files:
-            path = os.path.join(outdir, filespec.realpath(self.index_file))
+        if assets is not None:
+            # Pages refer to the assets by their hashed names, so they
+            # must be known before rendering anything
+            assets.resolve_all()
+
+        # realpath -> path of the Filespecs, filled in as they're
+        # iterated over
+        realpaths = {}
+        filespecs = _collect_realpaths(self.files.iter_all(),
+                                       self._output_path, realpaths)
+        if manifest is not None:
+            # Otherwise, mounted sources are iterated lazily, and their
+            # Filespecs are never all in memory at the same time
+            filespecs = list(filespecs)
+            manifest.remove_stale(realpaths)
+            outputs = {path: realpath for realpath, path in realpaths.items()}
+
+            hook = self.hooks['post_render_hook']
+            keys = {f.path: filespec_key(f, hook) for f in filespecs}
+            filespecs = [
+                f for f in filespecs
+                if not manifest.is_fresh(outputs[f.path], keys[f.path][0])
+            ]
+
+        report = BuildReport() if self.profile else None
+        start = time.perf_counter()
+
+        if self.generate_jobs > 1 and _can_fork and \
+           (not isinstance(filespecs, list) or len(filespecs) > 1):
+            results = self._generate_parallel(outdir, filespecs)
+        elif self.generate_concurrency > 1:
+            results = self._generate_concurrent(outdir, filespecs)
+        else:
+            results = (
+                (filespec.path, self._generate_file(outdir, filespec))
+                for filespec in filespecs
+            )
+
+        for path, (dependencies, timings) in results:
+            if report is not None:
+                report.add(path, timings)
+            if manifest is not None:
+                key, sources = keys[path]
+                manifest.entries[outputs[path]] = \
+                    manifest.make_entry(key, dependencies.union(sources))
+
+        if sweep:
+            self._remove_stale(outdir, realpaths)
+
+        if manifest is not None:
+            manifest.save()
+
+        if assets is not None:
+            assets.save()
+
+        if report is not None:
+            report.elapsed = time.perf_counter() - start
+            self.build_report = report
+
+    def _clear_outdir(self, outdir):
+        if os.path.isdir(outdir):
+            # Delete the contents outdir, not outdir itself
+            for entry in os.listdir(outdir):
+                path = os.path.join(outdir, entry)
+                if os.path.isdir(path):
+                    shutil.rmtree(path)
+                else:
+                    os.remove(path)
+
+    def _remove_stale(self, outdir, realpaths):
+        # Delete the files that were not generated by this build, and
+        # the directories left empty
+        suffixes = set(SUFFIXES[encoding] for encoding in self.precompress)
+        for dirpath, dirnames, filenames in os.walk(outdir, topdown=False):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                realpath = os.path.relpath(path, outdir)
+                base, ext = os.path.splitext(realpath)
+                if realpath not in realpaths and \
+                   not (ext in suffixes and base in realpaths):
+                    os.remove(path)
+            if dirpath != outdir:
+                try:
+                    os.rmdir(dirpath)
+                except OSError:
+                    pass
+
+    def _output_path(self, filespec):
+        # The path of filespec in the output directory
+        if self.fingerprint and self.assets.is_asset(filespec.path):
+            return self.assets.resolve(filespec)['path']
+        return filespec.realpath(self.index_file)
+
+    def _generate_file(self, outdir, filespec, rendered=None):
+        # rendered is the (context, result) of a view that was rendered
+        # ahead of time
+        realpath = self._output_path(filespec)
+        path = os.path.join(outdir, realpath)
+        _make_parent_dirs(outdir, realpath)
+
+        if rendered is None and self.fingerprint and \
+           self.assets.is_asset(filespec.path):
+            # Assets are rendered when they're hashed
+            rendered = self.assets.rendered(filespec)
+        if rendered is None:
+            rendered = self.render(filespec, mode='generating')
+        context, result = rendered
+
+        compressors = None
+        if self.precompress and is_compressible(realpath):
+            # Buffered and streamed results are compressed while they're
+            # in memory, files are compressed after copying them
+            compressors = Compressors(self.precompress)
+            if isinstance(result, (bytes, bytearray)):
+                compressors.update(result)
+            elif not is_file_result(result):
+                result = tee(result, compressors)
+
+        with Timer(context.timings, 'write'):
+            is_file = is_file_result(result)
+            written = write_file(path, result, self.skip_unchanged)
+            if compressors is not None:
+                self._write_compressed(path, compressors, is_file, written)
+            elif self.skip_unchanged or self.incremental:
+                # Remove the siblings of a previous build
+                self._write_compressed(path, None, False, written)
+        if context.timings is not None:
+            context.timings['bytes'] = written
+
+        return context.dependencies, context.timings
+
+    def _write_compressed(self, path, compressors, is_file, written):
+        if is_file:
+            siblings = [path + SUFFIXES[e] for e in compressors.encodings]
+            if written == 0 and all(_is_newer(s, path) for s in siblings):
+                # The file and its siblings are up to date
+                return
+            with open(path, 'rb') as fobj:
+                for chunk in iter(lambda: fobj.read(CHUNK_SIZE), b''):
+                    compressors.update(chunk)
+
+        compressed = compressors.finish() if compressors is not None else {}
+        for encoding, suffix in SUFFIXES.items():
+            sibling = path + suffix
+            data = compressed.get(encoding)
+            if data is not None and compressors.size >= MIN_SIZE and \
+               len(data) < compressors.size:
+                write_file(sibling, data, self.skip_unchanged)
+            else:
+                try:
+                    os.remove(sibling)
+                except FileNotFoundError:
+                    pass
+
+    def _generate_concurrent(self, outdir, filespecs):
+        # The views that are async or marked io_bound are rendered ahead
+        # in a pool of generate_concurrency threads, while the other
+        # views are rendered here. The outputs are still written one by
+        # one, in order, so the first failing file is the one whose
+        # error is raised, just like when all the views run serially.
+        from concurrent.futures import ThreadPoolExecutor
+
+        limit = self.generate_concurrency
+        filespecs = iter(filespecs)
+        pending = collections.deque()
+        with ThreadPoolExecutor(limit) as executor:
+            try:
+                while True:
+                    # Render at most 2 * limit files ahead
+                    for filespec in itertools.islice(
+                            filespecs, 2 * limit - len(pending)):
+                        future = None
+                        if _is_concurrent(filespec.view):
+                            future = executor.submit(self.render, filespec,
+                                                     'generating')
+                        pending.append((filespec, future))
+                    if not pending:
+                        break
 
-            if not os.path.exists(os.path.dirname(path)):
-                os.makedirs(os.path.dirname(path))
+                    filespec, future = pending.popleft()
+                    rendered = None if future is None else future.result()
+                    yield filespec.path, \
+                        self._generate_file(outdir, filespec, rendered)
+            finally:
+                # Close the results that won't be written
+                for filespec, future in pending:
+                    if future is not None and not future.cancel() and \
+                       future.exception() is None:
+                        _close_result(future.result()[1])
 
-            with open(path, 'wb') as fobj:
-                data = self.view(filespec, mode='generating')
-                fobj.write(data)
+    def _generate_parallel(self, outdir, filespecs):
+        # Workers are forked, so they inherit the manager and its files
+        # and only the paths of the files to render need to be sent
+        # over. Views and their kwargs don't have to be picklable.
+        global _generating
+        _generating = (self, outdir)
+
+        # Otherwise, each worker would compile every template again.
+        # Without any templates, Jinja isn't needed at all.
+        if 'jinja_env' in self.__dict__ or \
+           any(os.path.isdir(d) for d in self.template_dirs):
+            self.compile_templates()
+        try:
+            context = multiprocessing.get_context('fork')
+            jobs = self.generate_jobs
+            if isinstance(filespecs, list):
+                chunksize = max(1, len(filespecs) // (jobs * 4))
+            else:
+                chunksize = 32
+            paths = (filespec.path for filespec in filespecs)
+            with context.Pool(jobs) as pool:
+                # imap() yields in order, so the first failing file is
+                # the one whose error is raised, just like in serial mode
+                for result in pool.imap(_generate_worker, paths, chunksize):
+                    yield result
+        finally:
+            _generating = None
 
     def add_hook(self, hook_name, hook_func):
         if hook_name not in self.HOOK_NAMES:
@@ -104,3 +589,326 @@ class Stango(object):
             raise TypeError('hook_func must be callable')
 
         self.hooks[hook_name] = hook_func
+
+
+def _to_bytes(chunk, error):
+    if isinstance(chunk, str):
+        return chunk.encode('utf-8')
+    elif isinstance(chunk, (bytes, bytearray)):
+        return chunk
+    raise ValueError(error)
+
+
+def _iter_bytes(chunks, error):
+    for chunk in chunks:
+        yield _to_bytes(chunk, error)
+
+
+def _read_chunks(fobj, error):
+    try:
+        try:
+            chunk = fobj.read(CHUNK_SIZE)
+        except TypeError:
+            # A read() that doesn't take a size
+            yield _to_bytes(fobj.read(), error)
+            return
+
+        while chunk:
+            yield _to_bytes(chunk, error)
+            chunk = fobj.read(CHUNK_SIZE)
+    finally:
+        close = getattr(fobj, 'close', None)
+        if close is not None:
+            close()
+
+
+class Stream(object):
+    '''A streamed view result, an iterator over chunks of bytes
+
+    size and mtime are the length and modification time of the content
+    if they're known without reading it, otherwise None. A file-like
+    view result can provide them as attributes of the same names.
+
+    fobj is the file-like object that chunks reads, if any. If it can
+    be seeked and the size is known, a part of the content can be read
+    with slice().
+    '''
+
+    def __init__(self, chunks, size=None, mtime=None, fobj=None):
+        self.size = size if isinstance(size, int) else None
+        self.mtime = mtime if isinstance(mtime, (int, float)) else None
+        self._chunks = iter(chunks)
+
+        self._fobj = None
+        if hasattr(fobj, 'seek') and hasattr(fobj, 'tell'):
+            try:
+                # The content starts from the current position
+                self._origin = fobj.tell()
+                self._fobj = fobj
+            except (OSError, ValueError):
+                pass
+
+        # Run the view up to its first chunk, so that errors are raised
+        # before anything is written out
+        self._first = next(self._chunks, None)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._first is not None:
+            chunk, self._first = self._first, None
+            return chunk
+        return next(self._chunks)
+
+    def seekable(self):
+        return self._fobj is not None and self.size is not None
+
+    def slice(self, start, length):
+        '''Return a Stream of length bytes of the content from start on
+
+        The file-like object is seeked past the bytes before start, so
+        they're never read. The Stream must not be iterated yet.
+        '''
+        # The chunks read on from the current position of the file
+        self._fobj.seek(self._origin + start)
+        self._first = None
+        return Stream(_take(self._chunks, length), length, self.mtime)
+
+    def close(self):
+        close = getattr(self._chunks, 'close', None)
+        if close is not None:
+            close()
+
+
+def _take(chunks, length):
+    # Yield the first length bytes of chunks
+    try:
+        for chunk in chunks:
+            if len(chunk) >= length:
+                yield chunk[:length]
+                return
+            yield chunk
+            length -= len(chunk)
+    finally:
+        chunks.close()
+
+
+def is_file_result(result):
+    '''Is result a regular file that can be copied as is?'''
+    # Not subclasses, e.g. the file objects of tarfile members are
+    # BufferedReaders too
+    if type(result) not in (io.BufferedReader, io.FileIO):
+        return False
+    try:
+        return stat.S_ISREG(os.fstat(result.fileno()).st_mode)
+    except (OSError, ValueError):
+        return False
+
+
+def _copy_file(src, dst):
+    # Copy in the kernel (or reflink, on filesystems that support it)
+    # with copy_file_range(), and fall back to copying through
+    # userspace when that's not possible
+    offset = src.tell()
+    remaining = os.fstat(src.fileno()).st_size - offset
+    if hasattr(os, 'copy_file_range'):
+        dst.flush()
+        try:
+            while remaining > 0:
+                copied = os.copy_file_range(src.fileno(), dst.fileno(),
+                                            remaining, offset)
+                if copied == 0:
+                    break
+                offset += copied
+                remaining -= copied
+            return
+        except OSError as err:
+            if err.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL,
+                                 errno.EOPNOTSUPP, errno.EBADF):
+                raise
+            src.seek(offset)
+
+    shutil.copyfileobj(src, dst, CHUNK_SIZE)
+
+
+def write_result(fobj, result):
+    '''Write a result of Stango.stream() or render() to fobj'''
+    if isinstance(result, (bytes, bytearray)):
+        fobj.write(result)
+    elif is_file_result(result):
+        with result:
+            _copy_file(result, fobj)
+    else:
+        for chunk in result:
+            fobj.write(chunk)
+
+
+def _same_content(fobj, chunks):
+    for chunk in chunks:
+        if fobj.read(len(chunk)) != chunk:
+            return False
+    return fobj.read(1) == b''
+
+
+def _unchanged(path, result):
+    # Compare a buffered or file result to the contents of path. File
+    # results are rewound for writing if they differ.
+    try:
+        existing = open(path, 'rb')
+    except OSError:
+        return False
+
+    with existing:
+        size = os.fstat(existing.fileno()).st_size
+        if isinstance(result, (bytes, bytearray)):
+            return size == len(result) and existing.read() == result
+
+        start = result.tell()
+        if size != os.fstat(result.fileno()).st_size - start:
+            return False
+        chunks = iter(lambda: result.read(CHUNK_SIZE), b'')
+        if _same_content(existing, chunks):
+            return True
+        result.seek(start)
+        return False
+
+
+def write_file(path, result, skip_unchanged=False):
+    '''Write a result of Stango.render() to path atomically
+
+    The result is written to a temporary file that is renamed to path,
+    so readers never see a partially written file. If skip_unchanged is
+    true and path already has the same contents, it's left untouched
+    to keep its mtime. Return the number of bytes written.
+    '''
+    tmpname = os.path.join(os.path.dirname(path), '.%s.%d.tmp' %
+                           (os.path.basename(path), os.getpid()))
+    streamed = not isinstance(result, (bytes, bytearray)) and \
+        not is_file_result(result)
+
+    if skip_unchanged and not streamed and _unchanged(path, result):
+        _close_result(result)
+        return 0
+
+    existing = None
+    if skip_unchanged and streamed:
+        # A streamed result can only be read once, so it's compared
+        # while writing
+        try:
+            existing = open(path, 'rb')
+        except OSError:
+            pass
+
+    try:
+        with open(tmpname, 'wb') as fobj:
+            if existing is None:
+                write_result(fobj, result)
+            else:
+                with existing:
+                    same = True
+                    for chunk in result:
+                        fobj.write(chunk)
+                        if same and existing.read(len(chunk)) != chunk:
+                            same = False
+                    same = same and existing.read(1) == b''
+                if same:
+                    os.remove(tmpname)
+                    return 0
+            written = fobj.tell()
+        if os.path.isdir(path) and not os.path.islink(path):
+            # A directory of a previous build is in the way
+            shutil.rmtree(path)
+        os.replace(tmpname, path)
+    except:
+        # Don't leave a partially written file behind
+        if os.path.exists(tmpname):
+            os.remove(tmpname)
+        raise
+
+    return written
+
+
+def _is_newer(path, other):
+    try:
+        return os.stat(path).st_mtime_ns >= os.stat(other).st_mtime_ns
+    except OSError:
+        return False
+
+
+def _is_concurrent(view):
+    return inspect.iscoroutinefunction(view) or \
+        getattr(view, 'io_bound', False)
+
+
+class _ThreadLoop(object):
+    # The event loop that runs async views in render(), per thread. The
+    # pid is checked, as a forked process must not use the loop of its
+    # parent. The loop is closed when its thread exits and the
+    # thread-local data is dropped.
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.pid = os.getpid()
+
+    def __del__(self):
+        self.loop.close()
+
+_loops = threading.local()
+
+def _run_coroutine(coro):
+    thread_loop = getattr(_loops, 'loop', None)
+    if thread_loop is None or thread_loop.pid != os.getpid():
+        thread_loop = _loops.loop = _ThreadLoop()
+    return thread_loop.loop.run_until_complete(coro)
+
+
+def _close_result(result):
+    close = getattr(result, 'close', None)
+    if close is not None:
+        close()
+
+
+def _make_parent_dirs(outdir, realpath):
+    dirname = os.path.dirname(realpath)
+    try:
+        os.makedirs(os.path.join(outdir, dirname), exist_ok=True)
+    except (FileExistsError, NotADirectoryError):
+        # A file of a previous build is in place of a directory
+        parent = ''
+        for part in dirname.split('/'):
+            parent = os.path.join(parent, part)
+            path = os.path.join(outdir, parent)
+            if os.path.lexists(path) and not os.path.isdir(path):
+                os.remove(path)
+                break
+        os.makedirs(os.path.join(outdir, dirname), exist_ok=True)
+
+
+def _collect_realpaths(filespecs, output_path, realpaths):
+    # Two Filespecs with the same realpath, like 'a/' and 'a/index.html',
+    # would overwrite each other's output
+    for filespec in filespecs:
+        realpath = output_path(filespec)
+        if realpath in realpaths:
+            raise ValueError('%r: duplicate realpath' % realpath)
+        realpaths[realpath] = filespec.path
+        yield filespec
+
+
+_can_fork = 'fork' in multiprocessing.get_all_start_methods()
+
+# (manager, outdir) of the parallel generate in progress
+_generating = None
+
+def _generate_worker(path):
+    manager, outdir = _generating
+    try:
+        return path, manager._generate_file(outdir, manager.files.get(path))
+    except Exception as exc:
+        # The pool stops working for good if it can't unpickle an
+        # error in the main process
+        try:
+            pickle.loads(pickle.dumps(exc))
+        except Exception:
+            raise GenerateError(path, traceback.format_exc()) from None
+        raise
@@ -0,0 +1,198 @@
+import fnmatch
+import hashlib
+import json
+import os
+import threading
+from stango.manifest import cache_path, file_signature, filespec_key
+
+ASSETS_VERSION = 1
+
+# The number of hex digits of the content hash in fingerprinted names
+HASH_LENGTH = 8
+
+
+def hashed_path(path, digest):
+    '''Insert digest before the extension of path's basename'''
+    dirname, slash, basename = path.rpartition('/')
+    name, ext = os.path.splitext(basename)
+    return '%s%s%s.%s%s' % (dirname, slash, name, digest[:HASH_LENGTH], ext)
+
+
+def _hash_result(result):
+    from stango import CHUNK_SIZE, is_file_result
+
+    digest = hashlib.sha1()
+    if isinstance(result, (bytes, bytearray)):
+        digest.update(result)
+    elif is_file_result(result):
+        with result:
+            for chunk in iter(lambda: result.read(CHUNK_SIZE), b''):
+                digest.update(chunk)
+    else:
+        for chunk in result:
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class AssetManifest(object):
+    '''Content-hashed names of the Filespecs matching manager.fingerprint
+
+    Each entry maps a logical path to its fingerprinted path and
+    records the files its content was rendered from, so the hash is
+    only recomputed when one of them changes. When generating, the
+    entries are stored next to the manifest of outdir in cache_dir()
+    and reused by the next build.
+
+    The content that an asset was rendered to when hashing it is kept,
+    so that writing or serving it doesn't render it again (see
+    rendered()).
+    '''
+
+    def __init__(self, manager, outdir=None):
+        self.manager = manager
+        self.filename = outdir and cache_path(outdir, '.stango-assets')
+        self.mode = 'generating' if outdir else 'serving'
+
+        # logical path -> {'path': ..., 'key': ..., 'deps': {...}}
+        self.entries = {}
+
+        # The entries that are known to be up to date. When generating,
+        # each entry is checked only once per build. When serving,
+        # entries without dependencies are never checked again.
+        self._checked = set()
+
+        # logical path -> (context, content) of the latest rendering,
+        # where content is bytes, or the filename of a file result
+        self._rendered = {}
+        self._lock = threading.RLock()
+
+    def is_asset(self, path):
+        return bool(path) and not path.endswith('/') and \
+            any(fnmatch.fnmatchcase(path, p) for p in self.manager.fingerprint)
+
+    def load(self):
+        try:
+            with open(self.filename, 'r') as fobj:
+                data = json.load(fobj)
+        except (OSError, ValueError):
+            return False
+
+        if not isinstance(data, dict) or \
+           data.get('version') != ASSETS_VERSION:
+            return False
+
+        self.entries = data['assets']
+        return True
+
+    def save(self):
+        tmpname = '%s.%d.tmp' % (self.filename, os.getpid())
+        os.makedirs(os.path.dirname(self.filename), exist_ok=True)
+        with open(tmpname, 'w') as fobj:
+            json.dump({
+                'version': ASSETS_VERSION,
+                'assets': self.entries,
+            }, fobj, sort_keys=True)
+        os.replace(tmpname, self.filename)
+
+    def resolve_all(self):
+        '''Hash all assets, and forget the ones that don't exist anymore'''
+        paths = set()
+        for filespec in self.manager.files.iter_all():
+            if self.is_asset(filespec.path):
+                self.resolve(filespec)
+                paths.add(filespec.path)
+
+        with self._lock:
+            for path in set(self.entries) - paths:
+                del self.entries[path]
+
+    def resolve(self, filespec):
+        '''Return the up to date entry of an asset Filespec'''
+        with self._lock:
+            entry = self.entries.get(filespec.path)
+            if filespec.path in self._checked and entry is not None:
+                return entry
+
+            key, sources = filespec_key(filespec,
+                                        self.manager.hooks['post_render_hook'])
+            if entry is None or not self._is_fresh(entry, key):
+                entry = self._render(filespec, key, sources)
+
+            if self.mode == 'generating' or not entry['deps']:
+                self._checked.add(filespec.path)
+            return entry
+
+    def _render(self, filespec, key, sources):
+        from stango import is_file_result
+
+        context, result = self.manager.render(filespec, self.mode)
+        if is_file_result(result) and isinstance(result.name, str):
+            # Hashing reads the file, so it's opened again when needed
+            content = result.name
+        else:
+            if not isinstance(result, (bytes, bytearray)):
+                result = b''.join(result)
+            content = result
+        digest = _hash_result(result)
+
+        self._rendered[filespec.path] = (context, content)
+        deps = context.dependencies.union(sources)
+        entry = self.entries[filespec.path] = {
+            'path': hashed_path(filespec.path, digest),
+            'key': key,
+            'deps': {f: file_signature(f) for f in deps},
+        }
+        return entry
+
+    def rendered(self, filespec):
+        '''Return the up to date (context, result) of an asset Filespec
+        from when it was hashed, or None if it wasn't rendered
+
+        When generating, it's only returned once, as the asset is
+        written once.
+        '''
+        with self._lock:
+            self.resolve(filespec)
+            if self.mode == 'generating':
+                rendered = self._rendered.pop(filespec.path, None)
+            else:
+                rendered = self._rendered.get(filespec.path)
+
+        if rendered is None:
+            return None
+        context, content = rendered
+        if isinstance(content, str):
+            return context, open(content, 'rb')
+        return context, content
+
+    def _is_fresh(self, entry, key):
+        # Without dependencies there's no way to tell whether the
+        # content has changed
+        if entry['key'] != key or not entry['deps']:
+            return False
+        for filename, signature in entry['deps'].items():
+            if file_signature(filename) != signature:
+                return False
+        return True
+
+    def lookup(self, path):
+        '''Return the entry of the asset whose logical path is path'''
+        filespec = self.manager.files.get(path)
+        if filespec is None or not self.is_asset(path):
+            raise ValueError('%r is not a fingerprinted asset' % path)
+        return self.resolve(filespec)
+
+    def find(self, realpath):
+        '''Return the asset Filespec whose fingerprinted path is realpath'''
+        # Strip the digest from name.digest.ext or name.digest
+        dirname, slash, basename = realpath.rpartition('/')
+        parts = basename.split('.')
+        for index in (len(parts) - 2, len(parts) - 1):
+            if index < 1 or len(parts[index]) != HASH_LENGTH:
+                continue
+            path = dirname + slash + '.'.join(parts[:index] + parts[index + 1:])
+            filespec = self.manager.files.get(path)
+            if filespec is not None and self.is_asset(path) and \
+               self.resolve(filespec)['path'] == realpath:
+                return filespec
+        return None
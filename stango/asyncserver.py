@@ -0,0 +1,250 @@
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import formatdate
+from http import HTTPStatus
+from http.client import parse_headers
+from stango import _close_result, is_file_result
+from stango.http import KEEPALIVE_TIMEOUT, Request, ServerState
+import asyncio
+import io
+import sys
+import threading
+import traceback
+
+# The maximum size of the request line and the headers of a request
+MAX_HEADER_SIZE = 64 * 1024
+
+
+class AsyncHTTPServer(ServerState):
+    '''A development server that serves all connections in an event loop
+
+    Connections are kept alive and pipelined requests are answered in
+    order. Async views are awaited in the event loop. Other views, the
+    iteration of their streamed results, the lookup of Filespecs and
+    compression run in a pool of manager.server_threads threads.
+
+    The interface is that of StangoHTTPServer: serve_forever() runs the
+    server until shutdown() is called from another thread.
+    '''
+
+    def __init__(self, server_address, manager):
+        ServerState.__init__(self, manager)
+        self._loop = asyncio.new_event_loop()
+        self._executor = ThreadPoolExecutor(max(manager.server_threads, 1))
+        self._loop.set_default_executor(self._executor)
+        self._server = self._loop.run_until_complete(asyncio.start_server(
+            self.handle_connection, server_address[0], server_address[1],
+            limit=MAX_HEADER_SIZE, reuse_address=True))
+        self.server_address = self._server.sockets[0].getsockname()[:2]
+
+        self._connections = set()
+        self._stopping = self._loop.create_future()
+        self._stopped = threading.Event()
+
+    def set_manager(self, manager):
+        ServerState.set_manager(self, manager)
+        executor = ThreadPoolExecutor(max(manager.server_threads, 1))
+
+        def switch():
+            # The calls already submitted to the old pool still finish
+            old, self._executor = self._executor, executor
+            self._loop.set_default_executor(executor)
+            old.shutdown(wait=False)
+
+        self._loop.call_soon_threadsafe(switch)
+
+    def serve_forever(self, poll_interval=None):
+        self._stopped.clear()
+        try:
+            self._loop.run_until_complete(self._serve())
+        finally:
+            self._stopped.set()
+
+    async def _serve(self):
+        await self._stopping
+        self._server.close()
+        for task in self._connections:
+            task.cancel()
+        await asyncio.gather(*self._connections, return_exceptions=True)
+        await self._server.wait_closed()
+
+    def shutdown(self):
+        '''Make serve_forever() return, and wait until it has stopped'''
+        def stop():
+            if not self._stopping.done():
+                self._stopping.set_result(None)
+
+        self._loop.call_soon_threadsafe(stop)
+        self._stopped.wait()
+
+    def server_close(self):
+        self._server.close()
+        self._loop.close()
+
+    async def handle_connection(self, reader, writer):
+        task = asyncio.current_task()
+        self._connections.add(task)
+        try:
+            keep_alive = True
+            while keep_alive:
+                try:
+                    head = await asyncio.wait_for(
+                        reader.readuntil(b'\r\n\r\n'), KEEPALIVE_TIMEOUT)
+                except asyncio.LimitOverrunError:
+                    self.send_error(writer, 431)
+                    break
+                except (asyncio.IncompleteReadError, asyncio.TimeoutError):
+                    break
+
+                keep_alive = await self.handle_request(reader, writer, head)
+                await writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            # Open connections are cancelled when the server shuts down
+            pass
+        finally:
+            self._connections.discard(task)
+            writer.close()
+
+    async def handle_request(self, reader, writer, head):
+        '''Answer a request, return True if the connection is kept alive'''
+        request_line, _, header_data = head.partition(b'\r\n')
+        request_line = request_line.decode('latin-1')
+        try:
+            method, path, version = request_line.split()
+            if version not in ('HTTP/1.0', 'HTTP/1.1'):
+                raise ValueError('Unsupported version %r' % version)
+            headers = parse_headers(io.BytesIO(header_data))
+            length = int(headers.get('Content-Length', 0))
+        except Exception:
+            self.send_error(writer, 400)
+            return False
+
+        connection = headers.get('Connection', '').lower()
+        if version == 'HTTP/1.0':
+            keep_alive = connection == 'keep-alive'
+        else:
+            keep_alive = connection != 'close'
+
+        if method not in ('GET', 'HEAD'):
+            self.log_request(writer, request_line, 501)
+            self.send_error(writer, 501)
+            return False
+
+        # A request body is ignored, but it's read past to get to the
+        # next request
+        if headers.get('Transfer-Encoding') is not None:
+            keep_alive = False
+        elif length:
+            await reader.readexactly(length)
+
+        request = Request(self, method, path, headers)
+        body = None
+        sent = 0
+        try:
+            # Finding the Filespec may walk a directory or render an
+            # asset, and finishing may compress the whole body, so they
+            # run in the thread pool like sync views
+            run = self._loop.run_in_executor
+            response = await run(None, request.prepare)
+            if response is None and method == 'HEAD':
+                response = await run(None, request.head)
+            elif response is None:
+                result, cache = await request.manager._stream_async(
+                    request.filespec, 'serving')
+                response = await run(None, request.finish, result, cache)
+            status, response_headers, body = response
+            if method == 'HEAD':
+                _close_result(body)
+                body = None
+
+            chunked = False
+            if body is not None and 'Content-Length' not in response_headers:
+                if version == 'HTTP/1.1':
+                    response_headers['Transfer-Encoding'] = 'chunked'
+                    chunked = True
+                else:
+                    # The end of the body is marked by closing the
+                    # connection
+                    keep_alive = False
+
+            response_headers['Connection'] = \
+                'keep-alive' if keep_alive else 'close'
+            self.write_head(writer, status, response_headers)
+            sent = await self.write_body(writer, body, response_headers,
+                                         chunked)
+            self.log_request(writer, request_line, status)
+
+        except ConnectionError:
+            return False
+
+        except Exception:
+            traceback.print_exc()
+            if request.record['status'] is None:
+                self.log_request(writer, request_line, 500)
+                self.send_error(writer, 500)
+            # Otherwise, the body has been cut short, and closing the
+            # connection is the only way to tell the client
+            return False
+
+        finally:
+            _close_result(body)
+            request.done(sent)
+
+        return keep_alive
+
+    def write_head(self, writer, status, headers):
+        lines = ['HTTP/1.1 %d %s' % (status, HTTPStatus(status).phrase),
+                 'Server: Stango',
+                 'Date: %s' % formatdate(usegmt=True)]
+        lines.extend('%s: %s' % item for item in headers.items())
+        lines.extend(['', ''])
+        writer.write('\r\n'.join(lines).encode('latin-1'))
+
+    async def write_body(self, writer, body, headers, chunked):
+        '''Write a response body, return the number of bytes sent'''
+        if body is None:
+            return 0
+        elif is_file_result(body):
+            # Uses os.sendfile() where available
+            await writer.drain()
+            return await self._loop.sendfile(
+                writer.transport, body, body.tell(),
+                int(headers['Content-Length']))
+        elif isinstance(body, (bytes, bytearray)):
+            writer.write(body)
+            return len(body)
+
+        # Iterating a streamed result may block, so the chunks are
+        # produced in the thread pool
+        sent = 0
+        chunks = iter(body)
+        while True:
+            chunk = await self._loop.run_in_executor(None, next, chunks, None)
+            if chunk is None:
+                break
+            if not chunk:
+                # An empty chunk would end a chunked body
+                continue
+            if chunked:
+                writer.write(b'%x\r\n' % len(chunk))
+                writer.write(chunk)
+                writer.write(b'\r\n')
+            else:
+                writer.write(chunk)
+            sent += len(chunk)
+            await writer.drain()
+
+        if chunked:
+            writer.write(b'0\r\n\r\n')
+        return sent
+
+    def send_error(self, writer, status):
+        self.write_head(writer, status, {
+            'Content-Length': '0',
+            'Connection': 'close',
+        })
+
+    def log_request(self, writer, request_line, status):
+        if self.verbose:
+            host = writer.get_extra_info('peername')[0]
+            sys.stderr.write('%s - - [%s] "%s" %d -\n' % (
+                host, formatdate(localtime=True), request_line, status))
@@ -66,7 +66,7 @@
 # OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
-import glob, itertools, os, sys, time
+import ctypes, ctypes.util, errno, fnmatch, glob, itertools, os, select, struct, sys, time
 
 try:
     import _thread
@@ -83,7 +83,20 @@ except ImportError:
 
 RUN_RELOADER = True
 
-_mtimes = {}
+# Seconds between scans of the polling watcher. The inotify watcher
+# uses it as the interval of refreshing the set of imported modules.
+POLL_INTERVAL = 1
+
+# 'inotify', 'poll' or 'auto' (inotify when available)
+BACKEND = 'auto'
+
+# If set, called with the set of changed files instead of restarting.
+# The process is restarted anyway if it returns False.
+RELOAD_HANDLER = None
+
+# The file patterns that the reloader switches to, see watch()
+_new_filepatterns = None
+
 _win = (sys.platform == "win32")
 
 def code_files():
@@ -103,34 +116,277 @@ def matching_files(patterns):
             for filename in glob.glob(pattern):
                 yield filename
 
-def code_and_files(filepatterns):
-    return itertools.chain(code_files(), matching_files(filepatterns))
-
-
-def files_changed(files):
-    global _mtimes, _win
-    for filename in files:
-        if filename.endswith(".pyc") or filename.endswith(".pyo"):
-            filename = filename[:-1]
-        if not os.path.exists(filename):
-            continue # File might be in an egg, so it can't be reloaded.
-        stat = os.stat(filename)
-        mtime = stat.st_mtime
-        if _win:
-            mtime -= stat.st_ctime
-        if filename not in _mtimes:
-            _mtimes[filename] = mtime
-            continue
-        if mtime != _mtimes[filename]:
-            _mtimes = {}
+def _source_file(filename):
+    if filename.endswith(".pyc") or filename.endswith(".pyo"):
+        filename = filename[:-1]
+    return os.path.abspath(filename)
+
+def changed_modules(changed):
+    result = []
+    for module in list(sys.modules.values()):
+        filename = getattr(module, "__file__", None)
+        if filename and _source_file(filename) in changed:
+            result.append(module)
+    return result
+
+
+class PollingWatcher(object):
+    """Find changed files by comparing their mtimes every POLL_INTERVAL
+    seconds.
+    """
+
+    def __init__(self, filepatterns):
+        self.filepatterns = filepatterns
+        self.mtimes = {}
+        self.scan()
+
+    def scan(self):
+        changed = set()
+        mtimes = {}
+        files = itertools.chain(
+            ((f, True) for f in code_files()),
+            ((f, False) for f in matching_files(self.filepatterns)))
+        for filename, is_code in files:
+            filename = _source_file(filename)
+            try:
+                stat = os.stat(filename)
+            except OSError:
+                continue # File might be in an egg, so it can't be reloaded.
+            mtime = stat.st_mtime
+            if _win:
+                mtime -= stat.st_ctime
+            if filename in self.mtimes:
+                if mtime != self.mtimes[filename]:
+                    changed.add(filename)
+            elif not is_code:
+                # A new file that matches the patterns. Modules that
+                # were imported since the previous scan are not changes.
+                changed.add(filename)
+            mtimes[filename] = mtime
+
+        # Removed files
+        changed.update(set(self.mtimes) - set(mtimes))
+        self.mtimes = mtimes
+        return changed
+
+    def wait(self):
+        """Return the set of files changed since the previous call"""
+        time.sleep(POLL_INTERVAL)
+        return self.scan()
+
+    def close(self):
+        pass
+
+
+# From <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+
+_EVENT_HEADER = struct.Struct('iIII')
+
+def _libc():
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6',
+                           use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = \
+            [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+class InotifyWatcher(object):
+    """Find changed files with Linux inotify.
+
+    Directories are watched instead of files, because many editors save
+    by writing a new file and renaming it over the old one. Directories
+    given in the patterns are watched recursively.
+    """
+
+    MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | \
+        IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+    def __init__(self, filepatterns, libc):
+        self.libc = libc
+        self.fd = libc.inotify_init1(IN_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+
+        self.dirs = {} # wd -> directory
+        self.wds = {} # directory -> wd
+        self.files = set()
+        self.trees = []
+        self.globs = []
+
+        try:
+            self.add_patterns(filepatterns)
+        except OSError:
+            self.close()
+            raise
+
+    def add_patterns(self, filepatterns):
+        for pattern in filepatterns:
+            pattern = os.path.abspath(pattern)
+            if os.path.isdir(pattern):
+                self.trees.append(pattern)
+                self.add_tree(pattern)
+            elif glob.has_magic(pattern):
+                self.globs.append(pattern)
+                for filename in glob.glob(pattern):
+                    self.add_dir(os.path.dirname(filename))
+                if not glob.has_magic(os.path.dirname(pattern)):
+                    self.add_dir(os.path.dirname(pattern))
+            else:
+                self.files.add(pattern)
+                self.add_dir(os.path.dirname(pattern))
+
+        self.add_code_files()
+
+    def add_dir(self, dirname):
+        if dirname in self.wds:
+            return
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(dirname),
+                                         self.MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err in (errno.ENOENT, errno.ENOTDIR):
+                # Nothing to watch (yet)
+                return
+            # E.g. ENOSPC when fs.inotify.max_user_watches is reached.
+            # The changes under dirname would be missed.
+            raise OSError(err, '%s: %s' % (dirname, os.strerror(err)))
+        self.dirs[wd] = dirname
+        self.wds[dirname] = wd
+
+    def add_tree(self, top):
+        for dirpath, dirnames, filenames in os.walk(top):
+            self.add_dir(dirpath)
+
+    def add_code_files(self):
+        # Modules may have been imported since the last call
+        for filename in code_files():
+            filename = _source_file(filename)
+            if filename not in self.files:
+                self.files.add(filename)
+                self.add_dir(os.path.dirname(filename))
+
+    def is_watched(self, path):
+        if path in self.files:
             return True
-    return False
+        for tree in self.trees:
+            if path.startswith(tree + os.sep):
+                return True
+        for pattern in self.globs:
+            if fnmatch.fnmatch(path, pattern):
+                return True
+        return False
+
+    def wait(self):
+        """Return the set of files changed since the previous call
+
+        OSError is raised if a new directory can't be watched.
+        """
+        readable, _, _ = select.select([self.fd], [], [], POLL_INTERVAL)
+        if not readable:
+            self.add_code_files()
+            return set()
+
+        changed = set()
+        data = os.read(self.fd, 64 * 1024)
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = \
+                _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+
+            if mask & IN_Q_OVERFLOW:
+                # Events were lost, so consider the configuration changed
+                changed.add(os.path.abspath('conf.py'))
+                continue
+
+            dirname = self.dirs.get(wd)
+            if dirname is None:
+                continue
+            if mask & IN_IGNORED:
+                del self.dirs[wd]
+                del self.wds[dirname]
+                continue
+
+            path = os.path.join(dirname, os.fsdecode(name))
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO) and self.is_watched(path):
+                    self.add_tree(path)
+                continue
+            if self.is_watched(path):
+                changed.add(path)
+
+        return changed
+
+    def close(self):
+        os.close(self.fd)
+
+
+def make_watcher(filepatterns):
+    if BACKEND != 'poll':
+        libc = _libc()
+        if libc is not None:
+            try:
+                return InotifyWatcher(filepatterns, libc)
+            except OSError as err:
+                if BACKEND == 'inotify':
+                    raise
+                _warn_polling(err)
+        if BACKEND == 'inotify':
+            raise OSError('inotify is not available')
+    return PollingWatcher(filepatterns)
+
+def _warn_polling(err):
+    print('Watching files with inotify failed (%s), polling instead' % err,
+          file=sys.stderr)
+
+def watch(filepatterns):
+    """Make the reloader watch filepatterns instead, e.g. when
+    RELOAD_HANDLER has re-read the configuration. BACKEND is applied,
+    too.
+    """
+    global _new_filepatterns
+    _new_filepatterns = list(filepatterns)
 
 def reloader_thread(filepatterns):
+    global _new_filepatterns
+    watcher = make_watcher(filepatterns)
     while RUN_RELOADER:
-        if files_changed(code_and_files(filepatterns)):
+        try:
+            changed = watcher.wait()
+        except OSError as err:
+            # A new directory couldn't be watched
+            _warn_polling(err)
+            watcher.close()
+            watcher = PollingWatcher(filepatterns)
+            # Changes may have been missed, so consider the
+            # configuration changed
+            changed = {os.path.abspath('conf.py')}
+        if changed and not (RELOAD_HANDLER and RELOAD_HANDLER(changed)):
             sys.exit(3) # force reload
-        time.sleep(1)
+        if _new_filepatterns is not None:
+            filepatterns, _new_filepatterns = _new_filepatterns, None
+            watcher.close()
+            watcher = make_watcher(filepatterns)
 
 def restart_with_reloader():
     while True:
@@ -159,10 +415,10 @@ def python_reloader(main_func, filepatterns, args, kwargs):
 def jython_reloader(main_func, filepatterns, args, kwargs):
     from _systemrestart import SystemRestart
     _thread.start_new_thread(main_func, args)
+    watcher = PollingWatcher(filepatterns)
     while True:
-        if code_changed(filepatterns):
+        if watcher.wait():
             raise SystemRestart
-        time.sleep(1)
 
 
 def main(main_func, filepatterns=[], args=None, kwargs=None):
@@ -0,0 +1,100 @@
+import collections
+import os
+import threading
+import time
+from stango.manifest import file_signature
+
+
+def now_ns():
+    '''Return the current time in the resolution of file mtimes
+
+    Linux sets mtimes from a coarse clock that can lag behind
+    time.time_ns(), so a file modified right after now_ns() could look
+    older than it.
+    '''
+    clock = getattr(time, 'CLOCK_REALTIME_COARSE', None)
+    if clock is not None:
+        return time.clock_gettime_ns(clock)
+    return time.time_ns()
+
+
+class ResponseCache(object):
+    '''LRU cache of rendered responses for serving mode
+
+    Responses are keyed by realpath and store the signatures of the
+    files they were rendered from (see Context.add_dependency). An
+    entry is dropped as soon as one of those files changes. The total
+    size of the cached responses is kept under max_size bytes.
+    '''
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.size = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, realpath):
+        with self._lock:
+            entry = self._entries.get(realpath)
+            if entry is None:
+                return None
+            self._entries.move_to_end(realpath)
+
+        data, signatures = entry
+        for filename, signature in signatures.items():
+            if file_signature(filename) != signature:
+                self.invalidate(realpath)
+                return None
+
+        return data
+
+    def put(self, realpath, data, dependencies, started=None):
+        '''Cache data, rendered from dependencies
+
+        started is the now_ns() when rendering started. The
+        signatures are taken after rendering, so if a dependency was
+        modified since started, data may have been rendered from its
+        old content and is not cached.
+        '''
+        if len(data) > self.max_size:
+            return
+
+        signatures = {f: file_signature(f) for f in dependencies}
+        if started is not None and any(
+                s is not None and s[0] >= started
+                for s in signatures.values()):
+            return
+
+        with self._lock:
+            self._remove(realpath)
+            self._entries[realpath] = (data, signatures)
+            self.size += len(data)
+            while self.size > self.max_size:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate(self, realpath):
+        with self._lock:
+            self._remove(realpath)
+
+    def invalidate_files(self, filenames):
+        '''Drop the responses that depend on any of filenames'''
+        filenames = set(os.path.abspath(f) for f in filenames)
+        with self._lock:
+            for realpath, (data, signatures) in list(self._entries.items()):
+                for filename in signatures:
+                    if os.path.abspath(filename) in filenames:
+                        self._remove(realpath)
+                        break
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def _remove(self, realpath):
+        entry = self._entries.pop(realpath, None)
+        if entry is not None:
+            self.size -= len(entry[0])
@@ -0,0 +1,150 @@
+import mimetypes
+import zlib
+
+# Encoding -> suffix of the precompressed sibling file
+SUFFIXES = {
+    'gzip': '.gz',
+    'br': '.br',
+}
+
+COMPRESSIBLE_TYPES = set([
+    'application/javascript',
+    'application/json',
+    'application/rss+xml',
+    'application/atom+xml',
+    'application/xhtml+xml',
+    'application/xml',
+    'image/svg+xml',
+    'image/x-icon',
+])
+
+# Smaller results are not worth compressing
+MIN_SIZE = 256
+
+# Larger responses are not compressed on the fly by the server
+MAX_DYNAMIC_SIZE = 2 * 1024 * 1024
+
+# Encoding -> compression level. Precompressed files are written once,
+# so they get the best compression. Responses compressed on the fly
+# trade some of it for speed.
+LEVELS = {'gzip': 9, 'br': 11}
+DYNAMIC_LEVELS = {'gzip': 6, 'br': 5}
+
+
+def is_compressible(realpath):
+    '''Return True if the content type of realpath compresses well'''
+    content_type, content_encoding = mimetypes.guess_type(realpath)
+    if content_type is None or content_encoding is not None:
+        return False
+    return content_type.startswith('text/') or \
+        content_type in COMPRESSIBLE_TYPES
+
+
+class _GzipCompressor(object):
+    def __init__(self, level):
+        # wbits=31 produces the gzip format
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def process(self, data):
+        return self._compressor.compress(data)
+
+    def finish(self):
+        return self._compressor.flush()
+
+
+class _BrotliCompressor(object):
+    def __init__(self, level):
+        import brotli
+        self._compressor = brotli.Compressor(quality=level)
+
+    def process(self, data):
+        return self._compressor.process(data)
+
+    def finish(self):
+        return self._compressor.finish()
+
+
+_COMPRESSORS = {
+    'gzip': _GzipCompressor,
+    'br': _BrotliCompressor,
+}
+
+
+def check_encodings(encodings):
+    '''Raise ValueError if an encoding is not supported
+
+    Brotli needs the brotli module, which is imported here so that a
+    missing module is reported before rendering anything.
+    '''
+    for encoding in encodings:
+        if encoding not in _COMPRESSORS:
+            raise ValueError('Unsupported precompress encoding %r' % encoding)
+        if encoding == 'br':
+            import brotli  # noqa: F401
+
+
+class Compressors(object):
+    '''Compress the same data incrementally with many encodings
+
+    levels maps each encoding to its compression level.
+    '''
+
+    def __init__(self, encodings, levels=LEVELS):
+        self.encodings = list(encodings)
+        self._compressors = [_COMPRESSORS[e](levels[e])
+                             for e in self.encodings]
+        self._outputs = [[] for e in self.encodings]
+        self.size = 0
+
+    def update(self, data):
+        self.size += len(data)
+        for compressor, output in zip(self._compressors, self._outputs):
+            output.append(compressor.process(data))
+
+    def finish(self):
+        '''Return a dict of encoding -> compressed bytes'''
+        result = {}
+        for encoding, compressor, output in zip(
+                self.encodings, self._compressors, self._outputs):
+            output.append(compressor.finish())
+            result[encoding] = b''.join(output)
+        return result
+
+
+def compress(data, encoding, levels=LEVELS):
+    compressors = Compressors([encoding], levels)
+    compressors.update(data)
+    return compressors.finish()[encoding]
+
+
+def tee(chunks, compressors):
+    '''Yield chunks, feeding them to compressors on the way'''
+    for chunk in chunks:
+        compressors.update(chunk)
+        yield chunk
+
+
+def accepted_encoding(accept_encoding, encodings):
+    '''Return the first of encodings that accept_encoding allows, or None'''
+    if not accept_encoding:
+        return None
+
+    qualities = {}
+    for item in accept_encoding.split(','):
+        params = item.strip().split(';')
+        coding = params[0].strip().lower()
+        quality = 1.0
+        for param in params[1:]:
+            name, _, value = param.strip().partition('=')
+            if name.strip() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[coding] = quality
+
+    for encoding in encodings:
+        quality = qualities.get(encoding, qualities.get('*', 0.0))
+        if quality > 0:
+            return encoding
+    return None
@@ -1,3 +1,7 @@
+from stango.cache import now_ns
+from stango.profile import Timer
+import threading
+
 def dict_merge(*args):
     result = {}
     for d in args:
@@ -5,13 +9,51 @@ def dict_merge(*args):
     return result
 
 
+# The dependency set of the template being rendered in this thread
+_rendering = threading.local()
+
+def record_dependency(filename):
+    dependencies = getattr(_rendering, 'dependencies', None)
+    if dependencies is not None:
+        dependencies.add(filename)
+
+
 class Context(object):
     def __init__(self, manager, mode, filespec):
         self.manager = manager
         self.mode = mode
         self.path = filespec.path
         self.realpath = filespec.realpath(manager.index_file)
-        self.jinja_env = manager.jinja_env
+        self.dependencies = set()
+
+        # When rendering started, see ResponseCache.put()
+        self.started = now_ns()
+
+        # Phase -> seconds, if the manager is profiling
+        self.timings = {} if manager.profile else None
+
+    @property
+    def jinja_env(self):
+        # The environment is only created for pages that use templates
+        return self.manager.jinja_env
+
+    def add_dependency(self, filename):
+        '''Record that the output depends on the contents of filename'''
+        self.dependencies.add(filename)
+
+    def asset(self, path):
+        '''Return the fingerprinted path of the asset whose path is path
+
+        Paths that don't match the fingerprint patterns of the manager
+        are returned as is. The output depends on the contents of the
+        asset, as its name changes with them.
+        '''
+        manager = self.manager
+        if not manager.fingerprint or not manager.assets.is_asset(path):
+            return path
+        entry = manager.assets.lookup(path)
+        self.dependencies.update(entry['deps'])
+        return entry['path']
 
     def render_template(self, template_name, **kwargs):
         builtin_template_args = {
@@ -19,7 +61,14 @@ class Context(object):
             'serving': self.mode == 'serving',
             'path': self.path,
             'realpath': self.realpath,
+            'asset': self.asset,
         }
 
-        template = self.jinja_env.get_template(template_name)
-        return template.render(dict_merge(builtin_template_args, kwargs))
+        saved = getattr(_rendering, 'dependencies', None)
+        _rendering.dependencies = self.dependencies
+        try:
+            with Timer(self.timings, 'template'):
+                template = self.jinja_env.get_template(template_name)
+                return template.render(dict_merge(builtin_template_args, kwargs))
+        finally:
+            _rendering.dependencies = saved
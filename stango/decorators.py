@@ -1,3 +1,5 @@
+import threading
+
 # From werkzeug.utils
 
 _missing = object()
@@ -42,3 +44,20 @@ class cached_property(object):
             value = self.func(obj)
             obj.__dict__[self.__name__] = value
         return value
+
+
+class locked_cached_property(cached_property):
+    """A :class:`cached_property` that can be safely accessed from
+    multiple threads. The function is called at most once, and the
+    other threads wait for its result.
+    """
+
+    def __init__(self, func, name=None, doc=None):
+        cached_property.__init__(self, func, name, doc)
+        self.lock = threading.RLock()
+
+    def __get__(self, obj, type=None):
+        if obj is None:
+            return self
+        with self.lock:
+            return cached_property.__get__(self, obj, type)
@@ -1,12 +1,17 @@
 from functools import reduce
+from stango.tar import TarArchive
 from stango.views import file_from_tar, static_file
 import collections
+import copy
 import os
-import tarfile
+import sys
+import threading
 
 FilespecBase = collections.namedtuple('Filespec', 'path view kwargs')
 
 class Filespec(FilespecBase):
+    __slots__ = ()
+
     def __new__(cls, path, view, kwargs={}):
         if not isinstance(path, str):
             raise TypeError('path must be a str, not %r' % path)
@@ -36,13 +41,54 @@ class Filespec(FilespecBase):
         return os.path.join(self.path, index_file)
 
 
+class Source(object):
+    '''Base class for sets of Filespecs that are resolved lazily
+
+    A Source is mounted to Files instead of adding its Filespecs one by
+    one. Subclasses implement _entries(), which yields (path, view,
+    kwargs) tuples, and _get(path), which returns the Filespec of path
+    or None.
+    '''
+
+    prefix = ''
+
+    def add_prefix(self, prefix):
+        result = copy.copy(self)
+        result.prefix = prefix + self.prefix
+        return result
+
+    def get(self, path):
+        if not path.startswith(self.prefix):
+            return None
+        return self._get(path[len(self.prefix):])
+
+    def __iter__(self):
+        for path, view, kwargs in self._entries():
+            yield Filespec(self.prefix + path, view, kwargs)
+
+    def __len__(self):
+        return sum(1 for entry in self._entries())
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self.__dict__ == other.__dict__
+
+
 class Files(collections.MutableSequence):
     def __init__(self, *args):
         self._data = []
 
+        # path -> Filespec, for looking up the Filespec of a request
+        self._paths = {}
+
+        self._mounts = []
+
         for arg in args:
             if isinstance(arg, tuple):
                 self.append(arg)
+            elif isinstance(arg, Source):
+                self.mount(arg)
+            elif isinstance(arg, Files):
+                self.extend(arg)
             elif isinstance(arg, collections.Iterable):
                 for item in arg:
                     self.append(item)
@@ -68,25 +114,149 @@ class Files(collections.MutableSequence):
         else:
             raise TypeError('expected a Filespec object or tuple, got %r' % arg)
 
+    def _check_duplicate(self, filespec):
+        if filespec.path in self._paths or \
+           any(source.get(filespec.path) is not None
+               for source in self._mounts):
+            raise ValueError('%r: duplicate path' % filespec.path)
+
     def __len__(self):
         return len(self._data)
 
+    def __iter__(self):
+        return iter(self._data)
+
+    def __reversed__(self):
+        return reversed(self._data)
+
+    def __contains__(self, value):
+        try:
+            filespec = self._verify(value)
+        except TypeError:
+            return False
+        return self._paths.get(filespec.path) == filespec
+
     def __getitem__(self, index):
         return self._data[index]
 
     def __setitem__(self, index, value):
-        self._data[index] = self._verify(value)
+        filespec = self._verify(value)
+        old = self._data[index]
+        if filespec.path != old.path:
+            self._check_duplicate(filespec)
+        self._data[index] = filespec
+        del self._paths[old.path]
+        self._paths[filespec.path] = filespec
 
     def __delitem__(self, index):
+        removed = self._data[index]
         del self._data[index]
+        if not isinstance(index, slice):
+            removed = [removed]
+        for filespec in removed:
+            del self._paths[filespec.path]
 
     def insert(self, index, value):
-        self._data.insert(index, self._verify(value))
+        filespec = self._verify(value)
+        self._check_duplicate(filespec)
+        self._data.insert(index, filespec)
+        self._paths[filespec.path] = filespec
+
+    def extend(self, values):
+        if isinstance(values, Files):
+            for source in values.mounts:
+                self.mount(source)
+            values = values._data
+        collections.MutableSequence.extend(self, values)
+
+    def reverse(self):
+        # The default swaps items one by one, and a swap would be a
+        # duplicate path in between
+        self._data.reverse()
+
+    def clear(self):
+        del self._data[:]
+        self._paths.clear()
+        del self._mounts[:]
+
+    def mount(self, source):
+        '''Add the Filespecs of a Source without materializing them
+
+        Mounted Filespecs are found by get() and find(), iterated over
+        by iter_all() and counted by len_all(). The sequence methods
+        (len(), indexing, iteration, 'in' and the mutating methods) only
+        address the Filespecs that were added one by one.
+
+        A path of source that is already in Files raises ValueError.
+        Duplicates between Sources can't be found without walking them,
+        so they raise ValueError when iterated over.
+        '''
+        for path in self._paths:
+            if source.get(path) is not None:
+                raise ValueError('%r: duplicate path' % path)
+        self._mounts.append(source)
+
+    @property
+    def mounts(self):
+        return list(self._mounts)
+
+    def len_all(self):
+        '''Return the number of Filespecs, including the mounted ones
+
+        Mounted Sources are walked to count them.
+        '''
+        return len(self._data) + sum(len(source) for source in self._mounts)
+
+    def iter_all(self):
+        '''Iterate over all Filespecs, including the mounted ones'''
+        for filespec in self._data:
+            yield filespec
+        for source in self._mounts:
+            for filespec in source:
+                # get() must find the same Filespec, or some other one
+                # would be served in its place
+                if self.get(filespec.path) != filespec:
+                    raise ValueError('%r: duplicate path' % filespec.path)
+                yield filespec
+
+    def get(self, path):
+        '''Return the Filespec of path, or None'''
+        filespec = self._paths.get(path)
+        if filespec is None:
+            for source in self._mounts:
+                filespec = source.get(path)
+                if filespec is not None:
+                    break
+        return filespec
+
+    def find(self, realpath, index_file=None):
+        '''Return the Filespec whose realpath is realpath, or None
+
+        If both a directory Filespec and another one have realpath,
+        ValueError is raised.
+        '''
+        filespec = self.get(realpath)
+        if filespec is not None and filespec.isdir():
+            filespec = None
+
+        # A directory path is served as path + index_file
+        if index_file and realpath.endswith(index_file):
+            dirpath = realpath[:-len(index_file)]
+            if not dirpath or dirpath.endswith('/'):
+                dirspec = self.get(dirpath)
+                if dirspec is not None and filespec is not None:
+                    raise ValueError('%r: duplicate realpath' % realpath)
+                return dirspec or filespec
+
+        return filespec
 
     def __eq__(self, other):
         if len(self) != len(other):
             return False
 
+        if isinstance(other, Files) and self._mounts != other._mounts:
+            return False
+
         for a, b in zip(self, other):
             if a != b:
                 return False
@@ -94,7 +264,23 @@ class Files(collections.MutableSequence):
         return True
 
     def add_prefix(self, prefix):
-        return Files((prefix + f.path, f.view, f.kwargs) for f in self)
+        if not isinstance(prefix, str):
+            raise TypeError('prefix must be a str, not %r' % prefix)
+
+        if prefix.startswith('/'):
+            raise ValueError('%r: path must not start with /' % prefix)
+
+        # The Filespecs are already valid and prefixing doesn't create
+        # duplicates, so they're not verified again
+        result = Files()
+        for filespec in self._data:
+            filespec = Filespec._make(
+                (prefix + filespec.path, filespec.view, filespec.kwargs))
+            result._data.append(filespec)
+            result._paths[filespec.path] = filespec
+        for source in self._mounts:
+            result.mount(source.add_prefix(prefix))
+        return result
 
 
 def _served_path(basepath, filename, strip):
@@ -108,23 +294,213 @@ def _served_path(basepath, filename, strip):
     return os.path.join(basepath, served_name)
 
 
-def files_from_tar(basepath, tarname, strip=0):
-    tar = tarfile.open(tarname, 'r')
+class DirSource(Source):
+    '''The files of a directory, served with the static_file view'''
+
+    def __init__(self, basepath, dir_, strip=0):
+        self.basepath = basepath
+        self.dir = dir_
+        self.strip = strip
+        self._index = None
+
+    def _entries(self):
+        for dirpath, dirnames, filenames in os.walk(self.dir):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                yield (
+                    _served_path(self.basepath, path, self.strip),
+                    static_file,
+                    {'path': path},
+                )
+
+    def _get(self, path):
+        if self.basepath:
+            base = os.path.join(self.basepath, '')
+            if not path.startswith(base):
+                return None
+            path = path[len(base):]
+
+        # The components of self.dir that are part of the served paths
+        dir_parts = os.path.join(self.dir, '').split('/')[:-1]
+        if self.strip > len(dir_parts):
+            # Components inside the directory are stripped, too, so the
+            # file can't be found without walking the directory
+            return self._get_indexed(path)
+
+        kept = '/'.join(dir_parts[self.strip:])
+        if kept:
+            kept += '/'
+            if not path.startswith(kept):
+                return None
+            path = path[len(kept):]
+
+        parts = path.split('/')
+        if any(part in ('', '.', '..') for part in parts):
+            return None
+
+        filename = os.path.join(self.dir, *parts)
+        if not os.path.isfile(filename):
+            return None
+        return Filespec(self.prefix + _served_path(self.basepath, filename,
+                                                   self.strip),
+                        static_file, {'path': filename})
+
+    def _get_indexed(self, path):
+        if self._index is None:
+            index = {}
+            for served, view, kwargs in self._entries():
+                index.setdefault(served, kwargs['path'])
+            self._index = index
+
+        base = os.path.join(self.basepath, '') if self.basepath else ''
+        filename = self._index.get(base + path)
+        if filename is None:
+            return None
+        return Filespec(self.prefix + base + path, static_file,
+                        {'path': filename})
+
+    def __eq__(self, other):
+        return type(self) is type(other) and \
+            (self.prefix, self.basepath, self.dir, self.strip) == \
+            (other.prefix, other.basepath, other.dir, other.strip)
+
+
+class TarSource(Source):
+    '''The files of a tar archive, served with the file_from_tar view'''
+
+    def __init__(self, basepath, archive, strip=0):
+        self.basepath = basepath
+        self.archive = archive
+        self.strip = strip
+        self._index = None
+        self._lock = threading.Lock()
+
+    def _entries(self):
+        for member in self.archive.members:
+            filename = _served_path(self.basepath, member, self.strip)
+            if filename:
+                yield (
+                    filename,
+                    file_from_tar,
+                    {'tar': self.archive, 'member': member},
+                )
+
+    def _get(self, path):
+        if self._index is None:
+            # Only the served path -> member name mapping is built, not
+            # Filespecs
+            with self._lock:
+                if self._index is None:
+                    index = {}
+                    for member in self.archive.members:
+                        filename = _served_path(self.basepath, member,
+                                                self.strip)
+                        if filename:
+                            index.setdefault(filename, member)
+                    self._index = index
+
+        member = self._index.get(path)
+        if member is None:
+            return None
+        return Filespec(self.prefix + path, file_from_tar,
+                        {'tar': self.archive, 'member': member})
+
+    def __eq__(self, other):
+        return type(self) is type(other) and \
+            (self.prefix, self.basepath, self.archive.name, self.strip) == \
+            (other.prefix, other.basepath, other.archive.name, other.strip)
+
+
+class ViewSource(Source):
+    '''Many paths that are rendered by the same view
+
+    The paths are interned and the kwargs are stored column-wise:
+    columns maps each kwarg name to a sequence with a value for every
+    path. Filespecs are only created when needed.
+    '''
+
+    def __init__(self, view, paths, columns=None):
+        if not isinstance(view, collections.Callable):
+            raise TypeError('view must be callable')
+
+        self.view = view
+        self.paths = []
+        for path in paths:
+            if not isinstance(path, str):
+                raise TypeError('path must be a str, not %r' % path)
+            if path.startswith('/'):
+                raise ValueError('%r: path must not start with /' % path)
+            self.paths.append(sys.intern(path))
+
+        self.columns = {}
+        for name, values in (columns or {}).items():
+            values = list(values)
+            if len(values) != len(self.paths):
+                raise ValueError('%r: expected %d values, got %d' %
+                                 (name, len(self.paths), len(values)))
+            self.columns[name] = values
+
+        self._index = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.paths)
+
+    def _kwargs(self, row):
+        return {name: values[row] for name, values in self.columns.items()}
+
+    def __iter__(self):
+        # The paths, the view and the kwargs were verified up front
+        for row, path in enumerate(self.paths):
+            yield Filespec._make(
+                (self.prefix + path, self.view, self._kwargs(row)))
+
+    def _get(self, path):
+        if self._index is None:
+            with self._lock:
+                if self._index is None:
+                    index = {}
+                    for row, p in enumerate(self.paths):
+                        index.setdefault(p, row)
+                    self._index = index
+
+        row = self._index.get(path)
+        if row is None:
+            return None
+        return Filespec._make(
+            (self.prefix + path, self.view, self._kwargs(row)))
+
+    def __eq__(self, other):
+        return type(self) is type(other) and \
+            (self.prefix, self.view, self.paths, self.columns) == \
+            (other.prefix, other.view, other.paths, other.columns)
+
+
+def files_from_view(view, paths, columns=None):
+    return Files(ViewSource(view, paths, columns))
+
+
+def files_from_tar(basepath, tarname, strip=0, index_path=None, lazy=False):
+    archive = TarArchive(tarname, index_path)
+    if lazy:
+        return Files(TarSource(basepath, archive, strip))
+
     result = Files()
-    for member in tar.getmembers():
-        if not member.isfile():
-            continue
-        filename = _served_path(basepath, member.name, strip)
+    for member in archive.members:
+        filename = _served_path(basepath, member, strip)
         if filename:
             result.append((
                 filename,
                 file_from_tar,
-                {'tar': tar, 'member': member.name}
+                {'tar': archive, 'member': member}
             ))
     return result
 
 
-def files_from_dir(basepath, dir_, strip=0):
+def files_from_dir(basepath, dir_, strip=0, lazy=False):
+    if lazy:
+        return Files(DirSource(basepath, dir_, strip))
+
     result = Files()
     for dirpath, dirnames, filenames in os.walk(dir_):
         for filename in filenames:
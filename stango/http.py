@@ -1,19 +1,181 @@
+from email.utils import formatdate, mktime_tz, parsedate_tz
 from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+from stango import Stream, _close_result, _default_hook, is_file_result
+from stango.cache import ResponseCache
+from stango.compress import DYNAMIC_LEVELS, MAX_DYNAMIC_SIZE, MIN_SIZE, \
+    accepted_encoding, compress, is_compressible
+from stango.profile import view_name
+from stango.stats import RequestStats
+import hashlib
+import json
 import mimetypes
 import os
+import re
+import threading
+import time
+import traceback
 
-class StangoRequestHandler(BaseHTTPRequestHandler):
-    def start_response(self, code, headers={}):
-        if code == 200:
-            self.send_response(200)
-            for header, value in headers.items():
-                self.send_header(header, value)
-            self.end_headers()
-        else:
-            self.send_response(code)
+STATS_PATH = '_stango/stats'
+
+# The total size of the compressed responses that the server caches
+COMPRESSED_CACHE_SIZE = 16 * 1024 * 1024
+
+# Idle keep-alive connections are closed after this many seconds
+KEEPALIVE_TIMEOUT = 15
+
+
+def result_validators(result):
+    '''Return the Content-Length, ETag and Last-Modified headers of a result
+
+    Buffered results are identified by a hash of their content. Files
+    and other streamed results with a known size and mtime, like the
+    results of static_file and file_from_tar, are identified by those.
+    Other streamed results get no headers.
+    '''
+    if isinstance(result, (bytes, bytearray)):
+        return {
+            'Content-Length': str(len(result)),
+            'ETag': '"%s"' % hashlib.sha1(result).hexdigest(),
+        }
+
+    if is_file_result(result):
+        stat = os.fstat(result.fileno())
+        size = stat.st_size - result.tell()
+        mtime = stat.st_mtime
+    else:
+        size = result.size
+        mtime = result.mtime
+
+    headers = {}
+    if size is not None:
+        headers['Content-Length'] = str(size)
+        if mtime is not None:
+            headers['ETag'] = '"%x-%x"' % (int(mtime * 1000000), size)
+    if mtime is not None:
+        headers['Last-Modified'] = formatdate(mtime, usegmt=True)
+    return headers
+
+
+def _read_result(result):
+    if isinstance(result, (bytes, bytearray)):
+        return result
+    if is_file_result(result):
+        with result:
+            return result.read()
+    return b''.join(result)
+
+
+_RANGE_RE = re.compile(r'bytes=(\d*)-(\d*)$')
+
+def parse_range(value, size):
+    '''Return the (first, last) byte positions of a Range header value
+
+    Only a single byte range is supported. None is returned if there's
+    no Range header, if it's invalid or if it has many ranges, and the
+    whole content should be sent. If the range can't be satisfied,
+    first is size or greater.
+    '''
+    match = _RANGE_RE.match(value.replace(' ', '')) if value else None
+    if match is None:
+        return None
+
+    first, last = match.groups()
+    if not first:
+        if not last:
+            return None
+        # The last bytes of the content
+        suffix = int(last)
+        if suffix == 0:
+            return size, size
+        return max(size - suffix, 0), size - 1
+
+    first = int(first)
+    if not last:
+        return first, size - 1
+    last = int(last)
+    if last < first:
+        return None
+    return first, min(last, size - 1)
+
+
+def not_modified(request_headers, headers):
+    '''Return True if the response with headers is not modified'''
+    etag = headers.get('ETag')
+    if_none_match = request_headers.get('If-None-Match')
+    if if_none_match is not None:
+        # If-Modified-Since is ignored when If-None-Match is present
+        tags = [tag.strip() for tag in if_none_match.split(',')]
+        return etag is not None and \
+            ('*' in tags or etag in tags or 'W/' + etag in tags)
+
+    last_modified = headers.get('Last-Modified')
+    if_modified_since = request_headers.get('If-Modified-Since')
+    if last_modified is None or if_modified_since is None:
+        return False
+
+    try:
+        return _timestamp(last_modified) <= _timestamp(if_modified_since)
+    except (TypeError, ValueError, OverflowError):
+        return False
+
+
+def _timestamp(date):
+    # parsedate_to_datetime() would return a naive datetime for a date
+    # in the -0000 zone, which can't be compared to an aware one
+    parsed = parsedate_tz(date)
+    if parsed[9] is None:
+        # -0000 is UTC, not the local time
+        parsed = parsed[:9] + (0,)
+    return mktime_tz(parsed)
 
-    def do_GET(self):
-        manager = self.server.manager
+
+class Request(object):
+    '''The part of answering a request that doesn't depend on the server
+
+    prepare() finds the Filespec of the request, and finish() turns its
+    rendered result to the (status, headers, body) of the response.
+    Rendering and sending are left to the server, so that the
+    threading and asyncio engines share the rest. done() must be
+    called when the response has been sent.
+    '''
+
+    def __init__(self, server, method, path, headers):
+        self.server = server
+        self.manager = server.manager
+        self.path = path
+        self.headers = headers
+        self.filespec = None
+        self.realpath = None
+        self.response_headers = {}
+        self.start = time.perf_counter()
+
+        # See Stango.request_hook
+        self.record = {
+            'method': method,
+            'path': path,
+            'status': None,
+            'bytes': 0,
+            'latency': None,
+            'cache': None,
+            'view': None,
+        }
+
+    def response(self, status, headers, body):
+        self.record['status'] = status
+        return status, headers, body
+
+    def prepare(self):
+        '''Return the response, or None if self.filespec must be rendered'''
+        manager = self.manager
+        if manager.server_stats and self.path == '/' + STATS_PATH:
+            data = json.dumps(self.server.stats.snapshot(), indent=2,
+                              sort_keys=True).encode('utf-8')
+            return self.response(200, {
+                'Content-Type': 'application/json',
+                'Content-Length': str(len(data)),
+                'Cache-Control': 'no-cache',
+            }, data)
 
         # remove the leading /
         realpath = path = self.path[1:]
@@ -21,27 +183,394 @@ class StangoRequestHandler(BaseHTTPRequestHandler):
         if manager.index_file and (not path or path.endswith('/')):
             realpath = os.path.join(path, manager.index_file)
 
-        headers = {}
+        headers = self.response_headers
+        filespec = manager.files.find(realpath, manager.index_file)
+        if filespec is None and manager.fingerprint:
+            filespec = manager.assets.find(realpath)
+            if filespec is not None:
+                # The name changes whenever the content does
+                headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+
+        if filespec is None:
+            return self.response(404, {'Content-Length': '0'}, None)
+
         content_type, content_encoding = mimetypes.guess_type(realpath)
         if content_type:
             headers['Content-Type'] = content_type
         if content_encoding:
             headers['Content-Encoding'] = content_encoding
 
-        for filespec in manager.files:
-            if filespec.realpath(manager.index_file) == realpath:
-                self.start_response(200, headers)
-                self.wfile.write(manager.view(filespec, mode='serving'))
-                break
+        self.filespec = filespec
+        self.realpath = realpath
+        self.record['view'] = view_name(filespec.view)
+        return None
+
+    def head(self):
+        '''Return the response to a HEAD request without rendering
+
+        Views marked with stango.views.opens_file, like static_file and
+        file_from_tar, are called, and the file or stream they return is
+        closed without reading it, so that the same headers are sent as
+        for GET. For other views, the validators and length are only
+        sent if the response is cached.
+        '''
+        manager = self.manager
+        if getattr(self.filespec.view, 'opens_file', False) and \
+           manager.hooks['post_render_hook'] is _default_hook:
+            return self.finish(*manager._stream(self.filespec, 'serving'))
+
+        result = manager._cache_get(self.filespec, 'serving')
+        if result is not None:
+            return self.finish(result, 'hit')
+        return self.response(200, self.response_headers, None)
+
+    def finish(self, result, cache):
+        '''Return the response for the result of manager._stream()'''
+        self.record['cache'] = cache
+        headers = self.response_headers
+        headers.update(result_validators(result))
+
+        encoding = self.content_encoding(result, headers)
+        if encoding is not None:
+            headers['Content-Encoding'] = encoding
+            headers.pop('Content-Length', None)
+            if 'ETag' in headers:
+                # The compressed variant is a different representation
+                headers['ETag'] = headers['ETag'][:-1] + '-%s"' % encoding
+
+        if not_modified(self.headers, headers):
+            _close_result(result)
+            return self.response(304, {
+                header: value for header, value in headers.items()
+                if header in ('ETag', 'Last-Modified')
+            }, None)
+
+        if encoding is not None:
+            result = self.server.compress(result, encoding, self.realpath,
+                                          headers.get('ETag'))
+            headers['Content-Length'] = str(len(result))
+        else:
+            response = self.partial(result, headers)
+            if response is not None:
+                return response
+
+        return self.response(200, headers, result)
+
+    def partial(self, result, headers):
+        '''Return the 206 or 416 response to a Range request, or None
+
+        Buffered results, files and streams that can be seeked, like the
+        results of static_file and file_from_tar, support ranges. Only
+        the requested part of a file or a stream is read.
+        '''
+        if isinstance(result, (bytes, bytearray)) or is_file_result(result):
+            size = int(headers['Content-Length'])
+        elif isinstance(result, Stream) and result.seekable():
+            size = result.size
+        else:
+            return None
+
+        headers['Accept-Ranges'] = 'bytes'
+        byte_range = parse_range(self.headers.get('Range'), size)
+        if byte_range is None or not self.if_range(headers):
+            return None
+
+        first, last = byte_range
+        if first >= size:
+            _close_result(result)
+            return self.response(416, {
+                'Content-Range': 'bytes */%d' % size,
+                'Content-Length': '0',
+            }, None)
+
+        length = last - first + 1
+        if isinstance(result, (bytes, bytearray)):
+            result = result[first:last + 1]
+        elif is_file_result(result):
+            # The length of the body is its Content-Length
+            result.seek(first, os.SEEK_CUR)
         else:
-            self.start_response(404)
+            result = result.slice(first, length)
+
+        headers['Content-Range'] = 'bytes %d-%d/%d' % (first, last, size)
+        headers['Content-Length'] = str(length)
+        return self.response(206, headers, result)
+
+    def if_range(self, headers):
+        '''Return True if the range of a Range request should be sent'''
+        value = self.headers.get('If-Range')
+        if value is None:
+            return True
+        if value.startswith(('"', 'W/')):
+            # Only strong validators match
+            return value == headers.get('ETag')
+        return value == headers.get('Last-Modified')
+
+    def content_encoding(self, result, headers):
+        '''Return the encoding to compress the response with, or None
+
+        Streams are never compressed, nor are buffered results and files
+        larger than MAX_DYNAMIC_SIZE, as the whole body would have to be
+        read to memory.
+        '''
+        manager = self.manager
+        if not manager.precompress or not is_compressible(self.realpath):
+            return None
+
+        headers['Vary'] = 'Accept-Encoding'
+        length = headers.get('Content-Length')
+        if isinstance(result, Stream) or length is None or \
+           not MIN_SIZE <= int(length) <= MAX_DYNAMIC_SIZE:
+            return None
+
+        return accepted_encoding(self.headers.get('Accept-Encoding'),
+                                 manager.precompress)
+
+    def done(self, sent):
+        self.record['bytes'] = sent
+        self.record['latency'] = time.perf_counter() - self.start
+        if self.record['status'] is None:
+            # The view raised an exception
+            self.record['status'] = 500
+        self.server.record_request(self.manager, self.record)
+
+
+class StangoRequestHandler(BaseHTTPRequestHandler):
+    # Keep connections alive, see send_body()
+    protocol_version = 'HTTP/1.1'
+    timeout = KEEPALIVE_TIMEOUT
+
+    def start_response(self, code, headers={}):
+        self.send_response(code)
+        for header, value in headers.items():
+            self.send_header(header, value)
+        self.end_headers()
+
+    def handle(self):
+        # Like BaseHTTPRequestHandler.handle(), but the server may let
+        # other connections be served while this one waits idle
+        self.close_connection = True
+        self.handle_one_request()
+        while not self.close_connection:
+            if not self.server.wait_for_request(self.rfile):
+                break
+            self.handle_one_request()
+
+    def do_GET(self):
+        self.respond(head=False)
+
+    def do_HEAD(self):
+        self.respond(head=True)
+
+    def respond(self, head):
+        request = Request(self.server, self.command, self.path, self.headers)
+        sent = 0
+        try:
+            try:
+                response = request.prepare()
+                if response is None and head:
+                    response = request.head()
+                elif response is None:
+                    response = request.finish(
+                        *request.manager._stream(request.filespec, 'serving'))
+            except Exception:
+                # The view raised an exception. Answer like the asyncio
+                # engine does, instead of dropping the connection.
+                traceback.print_exc()
+                self.start_response(500, {
+                    'Content-Length': '0',
+                    'Connection': 'close',
+                })
+                return
+            status, headers, body = response
+            if head:
+                _close_result(body)
+                body = None
+            sent = self.send_body(status, headers, body)
+        finally:
+            request.done(sent)
+
+    def send_body(self, status, headers, body):
+        '''Send a response, return the number of body bytes sent
+
+        A body of unknown length is sent chunked to HTTP/1.1 clients.
+        For HTTP/1.0 clients, the connection is closed after it.
+        '''
+        if not self.server.keeps_alive():
+            headers['Connection'] = 'close'
+
+        chunked = False
+        if body is not None and 'Content-Length' not in headers:
+            if self.request_version == 'HTTP/1.1' and \
+               headers.get('Connection') != 'close':
+                headers['Transfer-Encoding'] = 'chunked'
+                chunked = True
+            else:
+                headers['Connection'] = 'close'
+        self.start_response(status, headers)
+
+        if body is None:
+            return 0
+        elif is_file_result(body):
+            # Uses os.sendfile() where available
+            with body:
+                return self.connection.sendfile(
+                    body, body.tell(), int(headers['Content-Length']))
+        elif isinstance(body, (bytes, bytearray)):
+            self.wfile.write(body)
+            return len(body)
+
+        sent = 0
+        try:
+            for chunk in body:
+                if not chunk:
+                    # An empty chunk would end a chunked body
+                    continue
+                if chunked:
+                    self.wfile.write(b'%x\r\n' % len(chunk))
+                    self.wfile.write(chunk)
+                    self.wfile.write(b'\r\n')
+                else:
+                    self.wfile.write(chunk)
+                sent += len(chunk)
+        finally:
+            _close_result(body)
+        if chunked:
+            self.wfile.write(b'0\r\n\r\n')
+        return sent
 
     def log_message(self, *args, **kwargs):
         if self.server.verbose:
             super(StangoRequestHandler, self).log_message(*args, **kwargs)
 
 
-class StangoHTTPServer(HTTPServer):
-    def __init__(self, server_address, manager):
+class ServerState(object):
+    '''The state shared by the requests of a server engine'''
+
+    def __init__(self, manager):
         self.manager = manager
+        self.verbose = False
+        self.stats = RequestStats()
+        self.compressed_cache = ResponseCache(COMPRESSED_CACHE_SIZE)
+
+    def set_manager(self, manager):
+        '''Serve with manager from now on, applying its server settings
+
+        Requests that are being served finish with the old manager.
+        '''
+        self.manager = manager
+
+    def compress(self, result, encoding, realpath, etag):
+        '''Return result compressed with encoding
+
+        Results with an ETag are cached by their realpath and ETag, so
+        e.g. static files are only compressed once per change. The ETag
+        alone is not unique, as files of the same size and mtime share
+        it.
+        '''
+        key = None if etag is None else '%s %s' % (realpath, etag)
+        if key is not None:
+            data = self.compressed_cache.get(key)
+            if data is not None:
+                _close_result(result)
+                return data
+
+        data = compress(_read_result(result), encoding, DYNAMIC_LEVELS)
+        if key is not None:
+            self.compressed_cache.put(key, data, ())
+        return data
+
+    def record_request(self, manager, record):
+        # manager is the one that served the request, self.manager may
+        # have been replaced by an in-process reload since
+        path = record['path'].partition('?')[0]
+        if manager.server_stats and path != '/' + STATS_PATH:
+            self.stats.record(record)
+        if manager.request_hook is not None:
+            manager.request_hook(record)
+
+
+class _Slots(object):
+    '''A semaphore whose limit can be changed while it's in use'''
+
+    def __init__(self, limit):
+        self.limit = limit
+        self._used = 0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            while self._used >= self.limit:
+                self._cond.wait()
+            self._used += 1
+
+    def release(self):
+        with self._cond:
+            self._used -= 1
+            self._cond.notify()
+
+    def set_limit(self, limit):
+        with self._cond:
+            self.limit = limit
+            self._cond.notify_all()
+
+
+class StangoHTTPServer(ServerState, ThreadingMixIn, HTTPServer):
+    # Handle each request in its own thread, but at most
+    # manager.server_threads at a time. When all the threads are busy,
+    # new connections wait in the listen queue. Keep-alive connections
+    # that wait idle for their next request don't count.
+    daemon_threads = True
+
+    def __init__(self, server_address, manager):
+        ServerState.__init__(self, manager)
+        self.threads = _Slots(max(manager.server_threads, 1))
+        self._local = threading.local()
         HTTPServer.__init__(self, server_address, StangoRequestHandler)
+
+    def set_manager(self, manager):
+        ServerState.set_manager(self, manager)
+        self.threads.set_limit(max(manager.server_threads, 1))
+
+    def process_request(self, request, client_address):
+        if self.manager.server_threads <= 1:
+            HTTPServer.process_request(self, request, client_address)
+            return
+
+        self.threads.acquire()
+        try:
+            ThreadingMixIn.process_request(self, request, client_address)
+        except:
+            self.threads.release()
+            raise
+
+    def process_request_thread(self, request, client_address):
+        self._local.threaded = True
+        try:
+            ThreadingMixIn.process_request_thread(self, request,
+                                                  client_address)
+        finally:
+            self.threads.release()
+
+    def keeps_alive(self):
+        '''Return True if the connection of this thread can be kept alive
+
+        Without threads, the next connection can't be accepted while a
+        connection is kept alive.
+        '''
+        return getattr(self._local, 'threaded', False)
+
+    def wait_for_request(self, rfile):
+        '''Wait for the next request of a keep-alive connection
+
+        The thread slot of the connection is released while waiting, so
+        that idle connections don't keep new ones from being served.
+        Return False if the connection was closed or it timed out.
+        '''
+        self.threads.release()
+        try:
+            return bool(rfile.peek(1))
+        except OSError:
+            return False
+        finally:
+            self.threads.acquire()
@@ -0,0 +1,81 @@
+import hashlib
+import jinja2
+import os
+import threading
+from stango.context import record_dependency
+
+
+class Environment(jinja2.Environment):
+    # get_template(), select_template() and the templates pulled in by
+    # {% extends %}, {% include %} and {% import %}, also with a list of
+    # names, all load through _load_template(), so this sees every
+    # template a page is rendered from.
+    def _load_template(self, *args, **kwargs):
+        template = super(Environment, self)._load_template(*args, **kwargs)
+        if template.filename:
+            record_dependency(template.filename)
+        return template
+
+
+class BytecodeCache(jinja2.FileSystemBytecodeCache):
+    '''A FileSystemBytecodeCache that keeps its size under max_size bytes
+
+    The cache keys include the Jinja version, so that upgrading Jinja
+    doesn't load code compiled by another version. Jinja itself checks
+    the source checksum of each cached template.
+    '''
+
+    def __init__(self, directory, max_size=None):
+        os.makedirs(directory, exist_ok=True)
+        super(BytecodeCache, self).__init__(directory, '__stango_%s.cache')
+        self.max_size = max_size
+        self._size = None
+        self._lock = threading.Lock()
+
+    def get_cache_key(self, name, filename=None):
+        key = super(BytecodeCache, self).get_cache_key(name, filename)
+        return hashlib.sha1(
+            ('%s|%s' % (key, jinja2.__version__)).encode('utf-8')
+        ).hexdigest()
+
+    def _cache_files(self):
+        prefix, suffix = self.pattern.split('%s')
+        for entry in os.listdir(self.directory):
+            if entry.startswith(prefix) and entry.endswith(suffix):
+                path = os.path.join(self.directory, entry)
+                try:
+                    yield path, os.stat(path)
+                except OSError:
+                    pass
+
+    def dump_bytecode(self, bucket):
+        super(BytecodeCache, self).dump_bytecode(bucket)
+        if self.max_size is None:
+            return
+
+        with self._lock:
+            if self._size is None:
+                self._size = sum(st.st_size for _, st in self._cache_files())
+            else:
+                filename = self._get_cache_filename(bucket)
+                try:
+                    self._size += os.path.getsize(filename)
+                except OSError:
+                    pass
+
+            if self._size > self.max_size:
+                self._prune()
+
+    def _prune(self):
+        # Remove the least recently written files until the cache fits
+        # in 3/4 of max_size, so that it isn't pruned on every write
+        files = sorted(self._cache_files(), key=lambda f: f[1].st_mtime)
+        self._size = sum(st.st_size for _, st in files)
+        for path, stat in files:
+            if self._size <= self.max_size * 3 // 4:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self._size -= stat.st_size
@@ -1,5 +1,10 @@
+import contextlib
+import getopt
+import importlib
 import os
 import sys
+import traceback
+import types
 
 from stango import Stango
 
@@ -68,18 +73,71 @@ usage: %s COMMAND [ARGS...]
 
 Available commands:
 
-    generate [OUTDIR]
+    generate [-i] [-u] [-j JOBS] [--precompress=ENCODINGS]
+             [--report] [--report-json=FILE] [--top=N]
+             [--profile=FILE] [OUTDIR]
 
         Generate the pages as flat files to directory OUTDIR
         (default: out). If OUTDIR doesn't exist, it is
         created, and if it already exists, it is cleared
         first.
 
+        -i, --incremental
+            Only re-render the pages whose inputs have
+            changed since the previous build, and remove
+            the pages that no longer exist. Can also be
+            enabled with incremental = True in conf.py.
+            Pages whose view kwargs have no stable repr()
+            are always re-rendered. The inputs are recorded
+            in the user's cache directory, not in OUTDIR.
+
+        -u, --skip-unchanged
+            Don't clear OUTDIR, but compare each page to the
+            existing file and only replace the files whose
+            content changed, keeping the mtimes of the others.
+            Files that are no longer generated are removed.
+            Can also be enabled with skip_unchanged = True in
+            conf.py.
+
+        -j JOBS, --jobs=JOBS
+            Render JOBS pages in parallel (default: the
+            generate_jobs setting of conf.py, or 1).
+
+        --precompress=ENCODINGS
+            Write compressed siblings (.gz, .br) of the text
+            pages, for web servers that serve precompressed
+            files. ENCODINGS is a comma separated list of
+            gzip and br (br requires the brotli module).
+            Can also be set with precompress = ['gzip'] in
+            conf.py, which also makes the development server
+            compress its responses.
+
+        --report
+            Print the N slowest pages and the totals per
+            view function, with the time spent in views,
+            templates, post_render_hook and writing.
+
+        --report-json=FILE
+            Write the timings of all pages as JSON to FILE.
+
+        --top=N
+            The number of slowest pages to report
+            (default: 10).
+
+        --profile=FILE
+            Run the generation under cProfile and write the
+            stats to FILE. Only the main process is profiled,
+            so use it with -j 1.
+
     runserver [[HOST:]PORT]
 
         Start the development server on http://HOST:PORT/
         (default: http://127.0.0.1:8000/).
 
+        With server_stats = True in conf.py, request latency
+        percentiles and per-path and per-view totals are
+        served as JSON at /_stango/stats.
+
     quickstart
 
         Initialize a boilerplate example project in the
@@ -90,51 +148,269 @@ Available commands:
 
 CONFIG_DEFAULTS = {
     'autoreload': [],
+    'autoreload_backend': 'auto',
+    'autoreload_inprocess': False,
+    'autoreload_interval': 1,
+    'fingerprint': [],
+    'generate_concurrency': 8,
+    'generate_jobs': 1,
+    'incremental': False,
     'index_file': None,
     'jinja_extensions': [],
     'post_render_hook': None,
+    'precompress': [],
+    'request_hook': None,
+    'response_cache_size': 0,
+    'server_engine': 'threading',
+    'server_stats': False,
+    'server_threads': 16,
+    'skip_unchanged': False,
+    'template_cache_dir': None,
+    'template_cache_size': 64 * 1024 * 1024,
 }
 
 
-def run():
-    if len(sys.argv) < 2:
-        print_help()
-    if sys.argv[1] not in ['runserver', 'generate', 'quickstart']:
-        print_help()
+class ConfigError(Exception):
+    pass
 
-    if sys.argv[1] == 'quickstart':
-        if len(sys.argv) != 2:
-            print_help()
-        sys.exit(quickstart())
-
-    if not os.path.exists('conf.py'):
-        print('conf.py not found', file=sys.stderr)
-        sys.exit(1)
 
+@contextlib.contextmanager
+def _project_path():
+    # Make the modules of the project importable
     try:
         backup = sys.path
         sys.path = [''] + sys.path
-        config = {}
-        exec(open('conf.py').read(), config)
+        yield
     finally:
         sys.path = backup
 
+
+def load_config():
+    with _project_path():
+        config = {}
+        # Compiled with its path, so that the functions of conf.py can
+        # be traced back to it (see stango.manifest.filespec_key)
+        filename = os.path.abspath('conf.py')
+        with open(filename) as fobj:
+            exec(compile(fobj.read(), filename, 'exec'), config)
+
     for k, v in list(CONFIG_DEFAULTS.items()):
         config.setdefault(k, v)
 
     if 'files' not in config:
-        print("conf.py doesn't define the 'files' variable", file=sys.stderr)
-        sys.exit(1)
+        raise ConfigError("conf.py doesn't define the 'files' variable")
+
+    return config
 
+
+def make_manager(config):
     manager = Stango()
     manager.files = config['files']
     manager.index_file = config['index_file']
     manager.jinja_extensions = config['jinja_extensions']
+    manager.generate_jobs = config['generate_jobs']
+    manager.generate_concurrency = config['generate_concurrency']
+    manager.incremental = config['incremental']
+    manager.skip_unchanged = config['skip_unchanged']
+    manager.precompress = config['precompress']
+    manager.fingerprint = config['fingerprint']
+    manager.server_engine = config['server_engine']
+    manager.server_threads = config['server_threads']
+    manager.server_stats = config['server_stats']
+    manager.request_hook = config['request_hook']
+    manager.response_cache_size = config['response_cache_size']
+    manager.template_cache_dir = config['template_cache_dir']
+    manager.template_cache_size = config['template_cache_size']
     manager.template_dirs.insert(0, 'templates')
 
     if config['post_render_hook']:
         manager.add_hook('post_render_hook', config['post_render_hook'])
 
+    return manager
+
+
+def configure_autoreload(config):
+    import stango.autoreload
+    stango.autoreload.BACKEND = config['autoreload_backend']
+    stango.autoreload.POLL_INTERVAL = config['autoreload_interval']
+
+
+def _static_files_added_or_removed(manager, changed):
+    # files_from_dir() lists the directory when conf.py is executed, so
+    # adding or removing a file needs a re-execution. Mounted Sources
+    # look files up by themselves, and only the Filespecs added one by
+    # one are checked.
+    from stango.views import static_file
+    paths = set(os.path.abspath(filespec.kwargs['path'])
+                for filespec in manager.files[:]
+                if filespec.view is static_file)
+    dirs = set(os.path.dirname(path) for path in paths)
+
+    for filename in changed:
+        if not os.path.exists(filename):
+            if filename in paths:
+                return True
+        elif filename not in paths:
+            dirname = os.path.dirname(filename)
+            while dirname not in dirs and os.path.dirname(dirname) != dirname:
+                dirname = os.path.dirname(dirname)
+            if dirname in dirs:
+                return True
+
+    return False
+
+
+def _project_modules():
+    # The modules loaded from the project directory, each one after the
+    # project modules it imports names or modules from
+    project = os.path.abspath('.') + os.sep
+    excluded = tuple(os.path.abspath(d) + os.sep for d in (
+        sys.prefix, sys.exec_prefix,
+        os.path.dirname(sys.modules[Stango.__module__].__file__)))
+    modules = {}
+    for name, module in list(sys.modules.items()):
+        filename = getattr(module, '__file__', None)
+        if filename:
+            filename = os.path.abspath(filename)
+            if filename.startswith(project) and \
+               not filename.startswith(excluded):
+                modules[name] = module
+
+    result = []
+    visited = set()
+    def visit(name):
+        if name in visited:
+            return
+        visited.add(name)
+        for value in list(vars(modules[name]).values()):
+            if isinstance(value, types.ModuleType):
+                dependency = value.__name__
+            else:
+                dependency = getattr(value, '__module__', None)
+            if dependency in modules:
+                visit(dependency)
+        result.append(modules[name])
+
+    for name in modules:
+        visit(name)
+    return result
+
+
+def reload(httpd, changed):
+    '''Apply changed files to a running server without a restart
+
+    Changes to conf.py or the modules it uses, and files added to or
+    removed from the directories of files_from_dir(), re-execute the
+    configuration. All the modules of the project are reloaded, so
+    that names imported from a changed module are updated too. The server switches to a new manager and its
+    settings, and the autoreload patterns of the new configuration are
+    watched. Template changes clear the template cache. Other changes
+    only invalidate the cached responses that depend on them.
+
+    Return False if the process has to be restarted instead.
+    '''
+    import stango.autoreload
+    from stango.compress import check_encodings
+
+    manager = httpd.manager
+    modules = stango.autoreload.changed_modules(changed)
+    for module in modules:
+        if module.__name__ == 'stango' or module.__name__.startswith('stango.'):
+            return False
+
+    if modules:
+        # The modules that imported names from a changed module would
+        # keep the old objects, so all the project modules are reloaded
+        project = _project_modules()
+        modules = [m for m in modules if m not in project] + project
+
+    if modules or os.path.abspath('conf.py') in changed or \
+       _static_files_added_or_removed(manager, changed):
+        try:
+            with _project_path():
+                for module in modules:
+                    importlib.reload(module)
+            config = load_config()
+            new_manager = make_manager(config)
+            check_encodings(new_manager.precompress)
+        except Exception:
+            traceback.print_exc()
+            print('Reloading conf.py failed, keeping the old configuration',
+                  file=sys.stderr)
+            return True
+
+        # These settings can't be changed in-process
+        if new_manager.server_engine != manager.server_engine or \
+           not config['autoreload_inprocess']:
+            return False
+
+        httpd.set_manager(new_manager)
+        _close_archives(manager)
+        configure_autoreload(config)
+        stango.autoreload.watch(config['autoreload'])
+        return True
+
+    template_dirs = [os.path.abspath(d) + os.sep for d in manager.template_dirs]
+    for filename in changed:
+        if any(filename.startswith(d) for d in template_dirs):
+            manager.clear_template_cache()
+            break
+
+    if manager.response_cache is not None:
+        manager.response_cache.invalidate_files(changed)
+
+    return True
+
+
+def _close_archives(manager):
+    # conf.py opens its tar archives again each time it's executed
+    from stango.files import TarSource
+    from stango.tar import TarArchive
+
+    archives = set()
+    for filespec in manager.files:
+        archives.add(filespec.kwargs.get('tar'))
+    for source in manager.files.mounts:
+        if isinstance(source, TarSource):
+            archives.add(source.archive)
+    for archive in archives:
+        if isinstance(archive, TarArchive):
+            archive.close()
+
+
+def check_precompress(manager):
+    from stango.compress import check_encodings
+    try:
+        check_encodings(manager.precompress)
+    except (ImportError, ValueError) as exc:
+        print('precompress: %s' % exc, file=sys.stderr)
+        sys.exit(1)
+
+
+def run():
+    if len(sys.argv) < 2:
+        print_help()
+    if sys.argv[1] not in ['runserver', 'generate', 'quickstart']:
+        print_help()
+
+    if sys.argv[1] == 'quickstart':
+        if len(sys.argv) != 2:
+            print_help()
+        sys.exit(quickstart())
+
+    if not os.path.exists('conf.py'):
+        print('conf.py not found', file=sys.stderr)
+        sys.exit(1)
+
+    try:
+        config = load_config()
+    except ConfigError as exc:
+        print(exc, file=sys.stderr)
+        sys.exit(1)
+
+    manager = make_manager(config)
+    check_precompress(manager)
+
     if sys.argv[1] == 'runserver':
         host = '127.0.0.1'
         port = 8000
@@ -150,24 +426,89 @@ def run():
         elif len(sys.argv) > 3:
             print_help()
 
+        servers = []
         def do_serve():
             print('Starting server at http://%s:%d/' % (host, port))
             httpd = manager.make_server(host, port, verbose=True)
+            servers.append(httpd)
             httpd.serve_forever()
 
+        def reload_handler(changed):
+            return bool(servers) and reload(servers[0], changed)
+
         import stango.autoreload
+        configure_autoreload(config)
+        if config['autoreload_inprocess']:
+            stango.autoreload.RELOAD_HANDLER = reload_handler
         stango.autoreload.main(do_serve, config['autoreload'])
 
     elif sys.argv[1] == 'generate':
-        if len(sys.argv) == 2:
+        try:
+            opts, args = getopt.getopt(
+                sys.argv[2:], 'iuj:',
+                ['incremental', 'skip-unchanged', 'jobs=', 'precompress=',
+                 'report', 'report-json=', 'top=', 'profile='])
+        except getopt.GetoptError:
+            print_help()
+
+        report = False
+        report_json = None
+        top = 10
+        profile = None
+        for opt, value in opts:
+            if opt in ('-i', '--incremental'):
+                manager.incremental = True
+            elif opt in ('-u', '--skip-unchanged'):
+                manager.skip_unchanged = True
+            elif opt in ('-j', '--jobs'):
+                try:
+                    manager.generate_jobs = int(value)
+                except ValueError:
+                    print_help()
+                if manager.generate_jobs < 1:
+                    print_help()
+            elif opt == '--precompress':
+                manager.precompress = [e for e in value.split(',') if e]
+                check_precompress(manager)
+            elif opt == '--report':
+                report = True
+            elif opt == '--report-json':
+                report_json = value
+            elif opt == '--top':
+                try:
+                    top = int(value)
+                except ValueError:
+                    print_help()
+            elif opt == '--profile':
+                profile = value
+
+        manager.profile = report or bool(report_json)
+
+        if not args:
             outdir = 'out'
-        elif len(sys.argv) == 3:
-            outdir = sys.argv[2]
+        elif len(args) == 1:
+            outdir = args[0]
         else:
             print_help()
 
         print('Generating to %s...' % outdir)
-        sys.exit(manager.generate(outdir) or 0)
+        if profile:
+            import cProfile
+            profiler = cProfile.Profile()
+            try:
+                status = profiler.runcall(manager.generate, outdir)
+            finally:
+                profiler.dump_stats(profile)
+        else:
+            status = manager.generate(outdir)
+
+        if report:
+            print(manager.build_report.format(top))
+        if report_json:
+            with open(report_json, 'w') as fobj:
+                manager.build_report.dump_json(fobj)
+
+        sys.exit(status or 0)
 
     else:
         print_help()
@@ -0,0 +1,178 @@
+import hashlib
+import json
+import os
+import re
+import sys
+from stango.compress import SUFFIXES
+from stango.tar import cache_dir
+
+MANIFEST_VERSION = 1
+
+# The default repr() of an object includes its address, which changes
+# from run to run
+_ADDRESS_REPR = re.compile(r' at 0x[0-9a-fA-F]+>')
+
+
+def file_signature(filename):
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        return None
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def cache_path(outdir, suffix):
+    '''Return the path of a file in cache_dir() that describes outdir
+
+    The files are named after the absolute path of outdir, so that
+    they're not deployed with the site.
+    '''
+    name = os.path.abspath(outdir)
+    digest = hashlib.sha1(name.encode('utf-8', 'surrogateescape'))
+    return os.path.join(cache_dir(), '%s-%s%s' % (
+        os.path.basename(name), digest.hexdigest()[:16], suffix))
+
+
+def _callable_id(func):
+    # Partials and callable objects may have no name. They're given no
+    # id, so their outputs are rendered on every build.
+    name = getattr(func, '__qualname__', None) or \
+        getattr(func, '__name__', None)
+    if name is None:
+        return None, None
+    module = sys.modules.get(getattr(func, '__module__', None))
+    filename = getattr(module, '__file__', None)
+    if filename is None:
+        # Functions defined in conf.py have no importable module, so
+        # they depend on the file their code comes from
+        code = getattr(func, '__code__', None)
+        if code is not None and os.path.isfile(code.co_filename):
+            filename = code.co_filename
+
+    # The values that a closure captured, and the defaults of the
+    # arguments, affect what the function returns
+    cells = []
+    for cell in getattr(func, '__closure__', None) or ():
+        try:
+            cells.append(cell.cell_contents)
+        except ValueError:
+            # An empty cell
+            cells.append(None)
+    kwdefaults = getattr(func, '__kwdefaults__', None) or {}
+    state = (cells, getattr(func, '__defaults__', None),
+             sorted(kwdefaults.items()))
+    return '%s.%s%r' % (func.__module__, name, state), filename
+
+
+def filespec_key(filespec, hook):
+    '''Hash the identity of a Filespec's view, its kwargs and the hook
+
+    Also return the source files of the view and hook, so that editing
+    them invalidates the output too.
+
+    The kwargs, the values captured by closures and the argument
+    defaults are identified by their repr(), so they should be plain
+    values, or objects whose repr() describes their value. If a repr()
+    includes an object address, the hash is None, and the output is
+    rendered on every build. The same goes for views and hooks that have
+    no name, like functools.partial objects.
+    '''
+    view_id, view_file = _callable_id(filespec.view)
+    hook_id, hook_file = _callable_id(hook)
+    key = repr((view_id, sorted(filespec.kwargs.items()), hook_id))
+    sources = [f for f in (view_file, hook_file) if f]
+    if view_id is None or hook_id is None or _ADDRESS_REPR.search(key):
+        return None, sources
+    return hashlib.sha1(key.encode('utf-8')).hexdigest(), sources
+
+
+class Manifest(object):
+    '''Record of the inputs each generated file was built from
+
+    The manifest is stored in cache_dir(), named after the absolute
+    path of outdir, so it's not deployed with the site. An output is
+    only considered fresh if it also exists in outdir.
+
+    settings is a JSON-serializable description of the settings that
+    affect every output. A manifest recorded with other settings is not
+    usable.
+    '''
+
+    def __init__(self, outdir, settings=None):
+        self.outdir = outdir
+        self.settings = settings
+        self.filename = cache_path(outdir, '.stango-manifest')
+        self.entries = {}
+        self._signatures = {}
+
+    def load(self):
+        '''Load the manifest, return False if there's no usable one'''
+        try:
+            with open(self.filename, 'r') as fobj:
+                data = json.load(fobj)
+        except (OSError, ValueError):
+            return False
+
+        if not isinstance(data, dict) or \
+           data.get('version') != MANIFEST_VERSION or \
+           data.get('settings') != self.settings:
+            return False
+
+        self.entries = data['files']
+        return True
+
+    def save(self):
+        tmpname = '%s.%d.tmp' % (self.filename, os.getpid())
+        os.makedirs(os.path.dirname(self.filename), exist_ok=True)
+        with open(tmpname, 'w') as fobj:
+            json.dump({
+                'version': MANIFEST_VERSION,
+                'settings': self.settings,
+                'files': self.entries,
+            }, fobj, sort_keys=True)
+        os.replace(tmpname, self.filename)
+
+    def signature(self, filename):
+        # Many pages share their templates, so stat each file only once
+        # per build
+        try:
+            return self._signatures[filename]
+        except KeyError:
+            result = self._signatures[filename] = file_signature(filename)
+            return result
+
+    def make_entry(self, key, dependencies):
+        return {
+            'key': key,
+            'deps': {f: self.signature(f) for f in dependencies},
+        }
+
+    def is_fresh(self, realpath, key):
+        entry = self.entries.get(realpath)
+        if key is None or entry is None or entry['key'] != key:
+            return False
+
+        for filename, signature in entry['deps'].items():
+            if self.signature(filename) != signature:
+                return False
+
+        return os.path.isfile(os.path.join(self.outdir, realpath))
+
+    def remove_stale(self, realpaths):
+        '''Delete outputs whose Filespec doesn't exist anymore'''
+        for realpath in set(self.entries) - set(realpaths):
+            path = os.path.join(self.outdir, realpath)
+            for filename in [path] + [path + s for s in SUFFIXES.values()]:
+                if os.path.isfile(filename):
+                    os.remove(filename)
+
+            # Remove directories left empty, but not outdir itself
+            dirname = os.path.dirname(realpath)
+            while dirname:
+                try:
+                    os.rmdir(os.path.join(self.outdir, dirname))
+                except OSError:
+                    break
+                dirname = os.path.dirname(dirname)
+
+            del self.entries[realpath]
@@ -0,0 +1,119 @@
+import json
+import time
+
+# The timed phases of rendering and writing a page, in report order
+PHASES = ['view', 'template', 'hook', 'write']
+
+
+def view_name(view):
+    name = getattr(view, '__qualname__', None) or \
+        getattr(view, '__name__', repr(view))
+    module = getattr(view, '__module__', None)
+    return '%s.%s' % (module, name) if module else name
+
+
+class Timer(object):
+    '''Accumulate the duration of a phase to a timings dict'''
+
+    def __init__(self, timings, phase):
+        self.timings = timings
+        self.phase = phase
+
+    def __enter__(self):
+        if self.timings is not None:
+            self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.timings is not None:
+            elapsed = time.perf_counter() - self.start
+            self.timings[self.phase] = self.timings.get(self.phase, 0) + elapsed
+
+
+class BuildReport(object):
+    '''Per-page timings of a generate run
+
+    Each page has the time spent in the view (including the templates
+    it renders), in rendering templates, in post_render_hook and in
+    writing the output, and the number of bytes written. Streamed
+    results are produced while writing, so for them most of the work
+    shows up as write time.
+    '''
+
+    def __init__(self):
+        self.pages = []
+        self.elapsed = None
+
+    def add(self, path, timings):
+        page = {'path': path, 'function': timings.get('function'),
+                'bytes': timings.get('bytes', 0)}
+        for phase in PHASES:
+            page[phase] = timings.get(phase, 0.0)
+        page['total'] = page['view'] + page['hook'] + page['write']
+        self.pages.append(page)
+
+    def slowest(self, count):
+        return sorted(self.pages, key=lambda page: page['total'],
+                      reverse=True)[:count]
+
+    def per_view(self):
+        '''Return the totals of each view function, slowest first'''
+        totals = {}
+        for page in self.pages:
+            total = totals.setdefault(page['function'], {
+                'function': page['function'], 'pages': 0, 'bytes': 0,
+                'total': 0.0,
+            })
+            total['pages'] += 1
+            total['bytes'] += page['bytes']
+            total['total'] += page['total']
+            for phase in PHASES:
+                total[phase] = total.get(phase, 0.0) + page[phase]
+        return sorted(totals.values(), key=lambda total: total['total'],
+                      reverse=True)
+
+    def as_dict(self, count=None):
+        return {
+            'elapsed': self.elapsed,
+            'pages': len(self.pages),
+            'bytes': sum(page['bytes'] for page in self.pages),
+            'slowest': self.slowest(count if count is not None
+                                    else len(self.pages)),
+            'views': self.per_view(),
+        }
+
+    def dump_json(self, fobj, count=None):
+        json.dump(self.as_dict(count), fobj, indent=2, sort_keys=True)
+        fobj.write('\n')
+
+    def format(self, count=10):
+        '''Return a human readable report of the slowest count pages'''
+        columns = '%10s %10s %10s %10s %10s %12s  %s'
+        row = '%10.2f %10.2f %10.2f %10.2f %10.2f %12d  %s'
+        header = columns % ('total ms', 'view ms', 'template', 'hook',
+                            'write', 'bytes', '%s')
+
+        def format_row(item, name):
+            return row % (item['total'] * 1000, item['view'] * 1000,
+                          item['template'] * 1000, item['hook'] * 1000,
+                          item['write'] * 1000, item['bytes'], name)
+
+        lines = []
+        if self.elapsed is not None:
+            lines.append('Generated %d pages in %.2f s' %
+                         (len(self.pages), self.elapsed))
+            lines.append('')
+
+        lines.append('Slowest pages:')
+        lines.append(header % 'path')
+        for page in self.slowest(count):
+            lines.append(format_row(page, page['path']))
+
+        lines.append('')
+        lines.append('Totals per view:')
+        lines.append(header % 'view (pages)')
+        for total in self.per_view():
+            lines.append(format_row(
+                total, '%s (%d)' % (total['function'], total['pages'])))
+
+        return '\n'.join(lines)
@@ -0,0 +1,111 @@
+import collections
+import threading
+
+
+# Requests to paths beyond the first MAX_PATHS distinct ones are totaled
+# under this key, so that e.g. a crawler can't grow the stats unbounded
+OTHER_PATHS = '(other)'
+
+
+def percentile(samples, p):
+    '''Return the p'th percentile of the sorted list samples, or None
+    if it's empty
+    '''
+    if not samples:
+        return None
+    index = (len(samples) - 1) * p / 100.0
+    lower = int(index)
+    upper = min(lower + 1, len(samples) - 1)
+    return samples[lower] + (samples[upper] - samples[lower]) * (index - lower)
+
+
+class _Totals(object):
+    __slots__ = ('requests', 'seconds', 'max', 'bytes')
+
+    def __init__(self):
+        self.requests = 0
+        self.seconds = 0.0
+        self.max = 0.0
+        self.bytes = 0
+
+    def add(self, record):
+        self.requests += 1
+        self.seconds += record['latency']
+        self.max = max(self.max, record['latency'])
+        self.bytes += record['bytes']
+
+    def as_dict(self, **extra):
+        result = {
+            'requests': self.requests,
+            'mean': self.seconds / self.requests,
+            'max': self.max,
+            'bytes': self.bytes,
+        }
+        result.update(extra)
+        return result
+
+
+class RequestStats(object):
+    '''Aggregated request records of the development server
+
+    Latency percentiles are computed over the last max_samples
+    requests. Totals are kept per path and per view function for all
+    requests. Paths are recorded without their query string, and the
+    requests to paths beyond the first max_paths ones are totaled under
+    OTHER_PATHS.
+    '''
+
+    def __init__(self, max_samples=10000, max_paths=1000):
+        self.latencies = collections.deque(maxlen=max_samples)
+        self.requests = 0
+        self.bytes = 0
+        self.status = collections.Counter()
+        self.cache = collections.Counter()
+        self.paths = collections.defaultdict(_Totals)
+        self.max_paths = max_paths
+        self.views = collections.defaultdict(_Totals)
+        self._lock = threading.Lock()
+
+    def record(self, record):
+        with self._lock:
+            self.requests += 1
+            self.bytes += record['bytes']
+            self.latencies.append(record['latency'])
+            self.status[str(record['status'])] += 1
+            if record['cache'] is not None:
+                self.cache[record['cache']] += 1
+            path = record['path'].partition('?')[0]
+            if path not in self.paths and len(self.paths) >= self.max_paths:
+                path = OTHER_PATHS
+            self.paths[path].add(record)
+            if record['view'] is not None:
+                self.views[record['view']].add(record)
+
+    def snapshot(self, slowest=20):
+        '''Return the statistics as a dict that can be dumped as JSON'''
+        with self._lock:
+            latencies = sorted(self.latencies)
+            paths = sorted(
+                (totals.as_dict(path=path)
+                 for path, totals in self.paths.items()),
+                key=lambda item: item['mean'], reverse=True)
+            views = sorted(
+                (totals.as_dict(view=view)
+                 for view, totals in self.views.items()),
+                key=lambda item: item['mean'] * item['requests'],
+                reverse=True)
+            return {
+                'requests': self.requests,
+                'bytes': self.bytes,
+                'status': dict(self.status),
+                'cache': dict(self.cache),
+                'latency': {
+                    'samples': len(latencies),
+                    'p50': percentile(latencies, 50),
+                    'p90': percentile(latencies, 90),
+                    'p99': percentile(latencies, 99),
+                    'max': latencies[-1] if latencies else None,
+                },
+                'slowest_paths': paths[:slowest],
+                'views': views,
+            }
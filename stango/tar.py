@@ -0,0 +1,315 @@
+import hashlib
+import json
+import os
+import tarfile
+import threading
+
+INDEX_VERSION = 1
+
+# The number of idle handles kept open for compressed archives
+POOL_SIZE = 4
+
+_COMPRESSED_MAGIC = [
+    b'\x1f\x8b',            # gzip
+    b'BZh',                 # bzip2
+    b'\xfd7zXZ\x00',        # xz
+]
+
+
+class TarArchive(object):
+    '''Shared read-only access to the regular files in a tar archive
+
+    The data offsets of the members are indexed once and persisted to
+    index_path (by default a file named after the archive path in the
+    user's cache directory, see cache_dir(); pass False to not
+    persist), so that later startups don't have to scan the archive.
+
+    Members of uncompressed archives are read directly with os.pread(),
+    so a single file descriptor is shared by all threads and forked
+    processes. Compressed archives can't be accessed randomly; each
+    open member holds a handle of a small pool of open archives.
+    '''
+
+    def __init__(self, tarname, index_path=None):
+        self.name = os.path.abspath(tarname)
+        if index_path is None:
+            index_path = default_index_path(self.name)
+        self.index_path = index_path
+
+        # member name -> [offset_data, size, mtime], offset_data is None
+        # for sparse files that must be read through tarfile
+        self.members = {}
+
+        with open(self.name, 'rb') as fobj:
+            magic = fobj.read(6)
+        self.compressed = any(magic.startswith(m) for m in _COMPRESSED_MAGIC)
+
+        if not self._load_index():
+            self._build_index()
+            self._save_index()
+
+        self._fd = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+        # The number of pread() calls in progress. close() leaves the
+        # descriptor open for them, and the last one closes it.
+        self._readers = 0
+        self._closing = False
+
+        # Idle TarFiles of compressed archives, and the process that
+        # opened them
+        self._pool = []
+        self._pool_pid = None
+
+    def __repr__(self):
+        return 'TarArchive(%r)' % self.name
+
+    def close(self):
+        '''Close the open files of the archive
+
+        Members that are being read can still be read to the end. The
+        archive is opened again if it's used after closing.
+        '''
+        with self._lock:
+            if self._pid == os.getpid():
+                if self._readers:
+                    self._closing = True
+                else:
+                    self._close_fd()
+            pool, self._pool = self._pool, []
+            self._pool_pid = None
+        for tar in pool:
+            tar.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __del__(self):
+        # Not set if __init__() failed
+        if hasattr(self, '_lock'):
+            self.close()
+
+    def _close_fd(self):
+        os.close(self._fd)
+        self._fd = None
+        self._pid = None
+        self._closing = False
+
+    def _stamp(self):
+        stat = os.stat(self.name)
+        return [stat.st_mtime_ns, stat.st_size]
+
+    def _load_index(self):
+        if not self.index_path:
+            return False
+        try:
+            with open(self.index_path, 'r') as fobj:
+                data = json.load(fobj)
+        except (OSError, ValueError):
+            return False
+
+        if not isinstance(data, dict) or \
+           data.get('version') != INDEX_VERSION or \
+           data.get('archive') != self._stamp():
+            return False
+
+        self.members = data['members']
+        return True
+
+    def _save_index(self):
+        if not self.index_path:
+            return
+        tmpname = '%s.%d.tmp' % (self.index_path, os.getpid())
+        try:
+            os.makedirs(os.path.dirname(self.index_path) or '.',
+                        exist_ok=True)
+            with open(tmpname, 'w') as fobj:
+                json.dump({
+                    'version': INDEX_VERSION,
+                    'archive': self._stamp(),
+                    'members': self.members,
+                }, fobj)
+            os.replace(tmpname, self.index_path)
+        except OSError:
+            # The index is just an optimization, e.g. the cache
+            # directory may not be writable
+            try:
+                os.remove(tmpname)
+            except OSError:
+                pass
+
+    def _build_index(self):
+        with tarfile.open(self.name, 'r') as tar:
+            for info in tar:
+                if not info.isfile():
+                    continue
+                offset = None if info.issparse() else info.offset_data
+                self.members[info.name] = [offset, info.size, info.mtime]
+
+    def _get_fd(self):
+        # Called with self._lock held. A forked child gets its own
+        # descriptor, even though pread() would be safe with the
+        # parent's one, so that closing the archive in one process
+        # doesn't affect the other
+        pid = os.getpid()
+        if self._pid != pid:
+            self._fd = os.open(self.name, os.O_RDONLY)
+            self._pid = pid
+        return self._fd
+
+    def _acquire_tarfile(self):
+        pid = os.getpid()
+        with self._lock:
+            if self._pool_pid != pid:
+                # The handles of the parent process share their file
+                # positions with it
+                self._pool = []
+                self._pool_pid = pid
+            if self._pool:
+                return self._pool.pop()
+        return tarfile.open(self.name, 'r')
+
+    def _release_tarfile(self, tar):
+        with self._lock:
+            if self._pool_pid == os.getpid() and len(self._pool) < POOL_SIZE:
+                self._pool.append(tar)
+                return
+        tar.close()
+
+    def pread(self, size, offset):
+        with self._lock:
+            fd = self._get_fd()
+            self._readers += 1
+            self._closing = False
+        try:
+            return os.pread(fd, size, offset)
+        finally:
+            with self._lock:
+                self._readers -= 1
+                if self._closing and not self._readers:
+                    self._close_fd()
+
+    def open(self, member):
+        '''Return a file-like object for reading member'''
+        offset, size, mtime = self.members[member]
+
+        if offset is not None and not self.compressed and \
+           hasattr(os, 'pread'):
+            return MemberReader(self, offset, size, mtime)
+
+        tar = self._acquire_tarfile()
+        try:
+            if offset is None:
+                info = tar.getmember(member)
+            else:
+                # Avoid scanning the archive for the TarInfo
+                info = tarfile.TarInfo(member)
+                info.size = size
+                info.mtime = mtime
+                info.offset_data = offset
+            fobj = tar.extractfile(info)
+        except:
+            self._release_tarfile(tar)
+            raise
+        return PooledMember(self, tar, fobj, size, mtime)
+
+
+def default_index_path(tarname):
+    '''Return the path of the offset index of tarname in cache_dir()'''
+    name = os.path.abspath(tarname)
+    digest = hashlib.sha1(name.encode('utf-8', 'surrogateescape'))
+    return os.path.join(cache_dir(), '%s-%s.stango-index' % (
+        os.path.basename(name), digest.hexdigest()[:16]))
+
+
+def cache_dir():
+    '''Return the directory for the offset indexes of tar archives
+
+    $XDG_CACHE_HOME/stango, or ~/.cache/stango by default.
+    '''
+    base = os.environ.get('XDG_CACHE_HOME') or \
+        os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'stango')
+
+
+class MemberReader(object):
+    '''A file-like object for a member of an uncompressed archive'''
+
+    def __init__(self, archive, offset, size, mtime):
+        self.archive = archive
+        self.offset = offset
+        self.size = size
+        self.mtime = mtime
+        self.position = 0
+
+    def read(self, size=-1):
+        remaining = self.size - self.position
+        if size is None or size < 0 or size > remaining:
+            size = remaining
+        if size <= 0:
+            return b''
+        data = self.archive.pread(size, self.offset + self.position)
+        self.position += len(data)
+        return data
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self.position
+        elif whence == os.SEEK_END:
+            offset += self.size
+        if offset < 0:
+            raise ValueError('negative seek position %d' % offset)
+        self.position = offset
+        return offset
+
+    def tell(self):
+        return self.position
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class PooledMember(object):
+    '''A file-like object for a member of a compressed archive
+
+    The handle of the archive is returned to the pool when the member
+    is closed.
+    '''
+
+    def __init__(self, archive, tar, fobj, size, mtime):
+        self.archive = archive
+        self.tar = tar
+        self.fobj = fobj
+        self.size = size
+        self.mtime = mtime
+
+    def read(self, size=-1):
+        return self.fobj.read(size)
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        return self.fobj.seek(offset, whence)
+
+    def tell(self):
+        return self.fobj.tell()
+
+    def close(self):
+        if self.tar is not None:
+            self.fobj.close()
+            self.archive._release_tarfile(self.tar)
+            self.tar = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -1,6 +1,33 @@
+from stango.tar import TarArchive
+
+def opens_file(view):
+    '''Mark a view that only opens a file or a stream and returns it
+
+    The development server calls such views to answer HEAD requests
+    with the length and validators of the content, without reading it.
+    Other views aren't rendered for HEAD requests.
+    '''
+    view.opens_file = True
+    return view
+
+@opens_file
 def file_from_tar(context, tar, member):
-    return tar.extractfile(member).read()
+    context.add_dependency(tar.name)
+    if isinstance(tar, TarArchive):
+        return tar.open(member)
+    # A plain tarfile.TarFile
+    return tar.extractfile(member)
 
+@opens_file
 def static_file(context, path):
-    with open(path, 'rb') as fobj:
-        return fobj.read()
+    context.add_dependency(path)
+    return open(path, 'rb')
+
+def io_bound(view):
+    '''Mark a view that spends its time waiting for I/O
+
+    When generating, io_bound views are rendered concurrently, like
+    async views. See Stango.generate_concurrency.
+    '''
+    view.io_bound = True
+    return view
@@ -37,10 +37,19 @@ class StangoTestCase(unittest.TestCase):
         dirpath = os.path.dirname(__file__)
         self.template_path = os.path.join(dirpath, 'templates')
         self.data_path = os.path.relpath(os.path.join(dirpath, 'data'))
+
+        # Keep the tar indexes etc. out of the user's cache directory
+        self.saved_cache_home = os.environ.get('XDG_CACHE_HOME')
+        os.environ['XDG_CACHE_HOME'] = os.path.abspath(
+            os.path.join('tmp', 'cache'))
         self.setup()
 
     def tearDown(self):
         self.teardown()
+        if self.saved_cache_home is None:
+            del os.environ['XDG_CACHE_HOME']
+        else:
+            os.environ['XDG_CACHE_HOME'] = self.saved_cache_home
 
 
 def view_value(value):
@@ -64,14 +73,22 @@ def make_suite(cls):
 
 def suite():
     from . import \
-        test_files, test_generate, test_main, test_manager, test_server, \
-        test_views
+        test_assets, test_autoreload, test_benchmarks, test_cache, \
+        test_compress, test_files, test_generate, test_jinja, test_main, \
+        test_manager, test_server, test_tar, test_views
     suite = unittest.TestSuite()
+    suite.addTest(test_assets.suite())
+    suite.addTest(test_autoreload.suite())
+    suite.addTest(test_benchmarks.suite())
+    suite.addTest(test_cache.suite())
+    suite.addTest(test_compress.suite())
     suite.addTest(test_files.suite())
     suite.addTest(test_generate.suite())
+    suite.addTest(test_jinja.suite())
     suite.addTest(test_main.suite())
     suite.addTest(test_manager.suite())
     suite.addTest(test_server.suite())
+    suite.addTest(test_tar.suite())
     suite.addTest(test_views.suite())
     return suite
 
@@ -0,0 +1,160 @@
+import functools
+import hashlib
+import os
+
+from stango import Stango
+from stango.assets import hashed_path
+from stango.files import Files
+from stango.views import static_file
+
+from . import StangoTestCase, make_suite
+
+
+class AssetsTestCase(StangoTestCase):
+    def setup(self):
+        self.tmp = self.tempdir()
+        self.outdir = os.path.join(self.tmp, 'out')
+
+        self.css = os.path.join(self.tmp, 'style.css')
+        self.write(self.css, 'body { color: red; }')
+
+        template_dir = os.path.join(self.tmp, 'templates')
+        os.mkdir(template_dir)
+        self.write(os.path.join(template_dir, 'page.html'),
+                   '<link href="/{{ asset("static/style.css") }}">'
+                   '<a href="/{{ asset("other.html") }}">')
+
+        self.hashed = []
+        def hashing_static_file(context, path):
+            self.hashed.append(context.path)
+            return static_file(context, path)
+
+        self.rendered = []
+        def page(context):
+            self.rendered.append(context.path)
+            return context.render_template('page.html')
+
+        self.manager = Stango()
+        self.manager.index_file = 'index.html'
+        self.manager.template_dirs.insert(0, template_dir)
+        self.manager.fingerprint = ['static/*.css']
+        self.manager.files = Files(
+            ('', page),
+            ('other.html', page),
+            ('static/style.css', hashing_static_file, {'path': self.css}),
+        )
+
+    def write(self, path, text):
+        with open(path, 'w') as fobj:
+            fobj.write(text)
+
+    def read(self, path):
+        with open(os.path.join(self.outdir, path)) as fobj:
+            return fobj.read()
+
+    def expected_name(self):
+        with open(self.css, 'rb') as fobj:
+            digest = hashlib.sha1(fobj.read()).hexdigest()
+        return 'static/style.%s.css' % digest[:8]
+
+    def test_hashed_path(self):
+        self.eq(hashed_path('a/b.css', '0123456789'), 'a/b.01234567.css')
+        self.eq(hashed_path('b.min.js', '0123456789'), 'b.min.01234567.js')
+        self.eq(hashed_path('a/b', '0123456789'), 'a/b.01234567')
+
+    def test_generate(self):
+        self.manager.generate(self.outdir)
+
+        name = self.expected_name()
+        self.eq(os.listdir(os.path.join(self.outdir, 'static')),
+                [os.path.basename(name)])
+        self.eq(self.read(name), 'body { color: red; }')
+        self.eq(self.read('index.html'),
+                '<link href="/%s"><a href="/other.html">' % name)
+        # The content that was hashed is written
+        self.eq(self.hashed, ['static/style.css'])
+
+        # The hashes are reused by the next build
+        del self.hashed[:]
+        self.manager.generate(self.outdir)
+        self.eq(self.hashed, ['static/style.css'])
+        self.eq(self.read(name), 'body { color: red; }')
+
+    def test_generate_unnamed_view(self):
+        def css(context, color):
+            return 'body { color: %s; }' % color
+
+        class Hook(object):
+            def __call__(self, context, data):
+                return data
+
+        self.manager.add_hook('post_render_hook', Hook())
+        self.manager.files[2] = ('static/style.css',
+                                 functools.partial(css, color='red'))
+        self.manager.generate(self.outdir)
+
+        name = self.expected_name()
+        self.eq(self.read(name), 'body { color: red; }')
+        self.eq(self.read('index.html'),
+                '<link href="/%s"><a href="/other.html">' % name)
+        # Nothing about the build is deployed with the site
+        self.eq(sorted(os.listdir(self.outdir)),
+                ['index.html', 'other.html', 'static'])
+
+        # Served under the hashed name, too
+        self.eq(self.manager.assets.lookup('static/style.css')['path'], name)
+
+    def test_generate_incremental(self):
+        self.manager.incremental = True
+        self.manager.generate(self.outdir)
+        old_name = self.expected_name()
+
+        del self.hashed[:], self.rendered[:]
+        self.manager.generate(self.outdir)
+        self.eq(self.hashed, [])
+        self.eq(self.rendered, [])
+
+        # Changing the asset renames it and re-renders the pages that
+        # refer to it
+        self.write(self.css, 'body { color: blue; }')
+        self.manager.generate(self.outdir)
+        name = self.expected_name()
+        assert name != old_name
+        self.eq(sorted(self.rendered), ['', 'other.html'])
+        self.eq(os.listdir(os.path.join(self.outdir, 'static')),
+                [os.path.basename(name)])
+        assert name in self.read('other.html')
+
+    def test_serving(self):
+        assets = self.manager.assets
+        name = self.expected_name()
+        self.eq(assets.lookup('static/style.css')['path'], name)
+        self.eq(assets.find(name), self.manager.files[2])
+        self.eq(assets.find('static/style.0000000.css'), None)
+        self.eq(assets.find('static/style.css'), None)
+        self.assert_raises(ValueError, assets.lookup, 'static/other.css')
+
+        # Changes are picked up while serving
+        self.write(self.css, 'body { color: blue; }')
+        self.eq(assets.find(name), None)
+        self.eq(assets.lookup('static/style.css')['path'],
+                self.expected_name())
+
+    def test_serving_without_dependencies(self):
+        self.calls = []
+        def generated(context):
+            self.calls.append(context.path)
+            return 'p { margin: 0; }'
+        self.manager.files.append(('static/generated.css', generated))
+
+        # Rendered once, both for hashing and serving
+        assets = self.manager.assets
+        name = assets.lookup('static/generated.css')['path']
+        self.eq(assets.lookup('static/generated.css')['path'], name)
+        filespec = assets.find(name)
+        self.eq(self.manager.view(filespec, 'serving'), b'p { margin: 0; }')
+        self.eq(self.calls, ['static/generated.css'])
+
+
+def suite():
+    return make_suite(AssetsTestCase)
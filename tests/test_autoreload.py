@@ -0,0 +1,135 @@
+import stango.autoreload
+from stango.autoreload import PollingWatcher, InotifyWatcher, _libc
+
+import ctypes
+import errno
+import io
+import os
+import sys
+import unittest
+
+from . import StangoTestCase, make_suite
+
+class AutoreloadTestCase(StangoTestCase):
+    def setup(self):
+        self.tmp = self.tempdir()
+        self.saved_interval = stango.autoreload.POLL_INTERVAL
+        stango.autoreload.POLL_INTERVAL = 0.01
+
+        os.makedirs(os.path.join(self.tmp, 'dir/sub'))
+        self.write('dir/sub/a.txt', 'a')
+        self.write('b.txt', 'b')
+        self.write('c.css', 'c')
+
+    def teardown(self):
+        stango.autoreload.POLL_INTERVAL = self.saved_interval
+
+    def path(self, name):
+        return os.path.abspath(os.path.join(self.tmp, name))
+
+    def write(self, name, contents):
+        with open(self.path(name), 'w') as fobj:
+            fobj.write(contents)
+        # Make sure the mtime changes even on coarse filesystems
+        os.utime(self.path(name), (0, hash(contents) % 100000))
+
+    def check_watcher(self, watcher):
+        try:
+            self.eq(watcher.wait(), set())
+
+            self.write('dir/sub/a.txt', 'aa')
+            self.write('c.css', 'cc')
+            self.write('unwatched.txt', 'x')
+            self.eq(watcher.wait(),
+                    {self.path('dir/sub/a.txt'), self.path('c.css')})
+
+            self.write('b.txt', 'bb')
+            self.eq(watcher.wait(), {self.path('b.txt')})
+
+            # Added and removed files
+            self.write('dir/new.txt', 'n')
+            self.eq(watcher.wait(), {self.path('dir/new.txt')})
+            os.remove(self.path('dir/sub/a.txt'))
+            self.eq(watcher.wait(), {self.path('dir/sub/a.txt')})
+        finally:
+            watcher.close()
+
+    def patterns(self):
+        return [
+            os.path.join(self.tmp, 'dir'),
+            os.path.join(self.tmp, 'b.txt'),
+            os.path.join(self.tmp, '*.css'),
+        ]
+
+    def test_polling_watcher(self):
+        self.check_watcher(PollingWatcher(self.patterns()))
+
+    def test_inotify_watcher(self):
+        libc = _libc()
+        if libc is None:
+            raise unittest.SkipTest('inotify is not available')
+        watcher = InotifyWatcher(self.patterns(), libc)
+        self.check_watcher(watcher)
+
+    def test_inotify_watcher_new_directory(self):
+        libc = _libc()
+        if libc is None:
+            raise unittest.SkipTest('inotify is not available')
+        watcher = InotifyWatcher(self.patterns(), libc)
+        try:
+            os.mkdir(self.path('dir/new'))
+            watcher.wait()
+            self.write('dir/new/d.txt', 'd')
+            self.eq(watcher.wait(), {self.path('dir/new/d.txt')})
+        finally:
+            watcher.close()
+
+    def test_inotify_watch_limit(self):
+        libc = _libc()
+        if libc is None:
+            raise unittest.SkipTest('inotify is not available')
+
+        class LimitedLibc(object):
+            # Like fs.inotify.max_user_watches was reached after a watch
+            def __init__(self):
+                self.inotify_init1 = libc.inotify_init1
+                self.watches = 1
+
+            def inotify_add_watch(self, fd, path, mask):
+                if self.watches == 0:
+                    ctypes.set_errno(errno.ENOSPC)
+                    return -1
+                self.watches -= 1
+                return libc.inotify_add_watch(fd, path, mask)
+
+        # Directories aren't left unwatched
+        exc = self.assert_raises(OSError, InotifyWatcher, self.patterns(),
+                                 LimitedLibc())
+        self.eq(exc.errno, errno.ENOSPC)
+
+        # make_watcher() falls back to polling
+        saved = stango.autoreload._libc, sys.stderr
+        stango.autoreload._libc = LimitedLibc
+        sys.stderr = io.StringIO()
+        try:
+            watcher = stango.autoreload.make_watcher(self.patterns())
+            assert sys.stderr.getvalue().startswith(
+                'Watching files with inotify failed')
+        finally:
+            stango.autoreload._libc, sys.stderr = saved
+        assert isinstance(watcher, PollingWatcher)
+
+        # So does a watcher that can't watch a new directory
+        limited = LimitedLibc()
+        limited.watches = 10000
+        watcher = InotifyWatcher(self.patterns(), limited)
+        try:
+            limited.watches = 0
+            os.mkdir(self.path('dir/new'))
+            self.assert_raises(OSError, watcher.wait)
+        finally:
+            watcher.close()
+
+
+def suite():
+    return make_suite(AutoreloadTestCase)
@@ -0,0 +1,46 @@
+import json
+import os
+
+import benchmarks
+import benchmarks.config
+from stango.tar import default_index_path
+
+from . import StangoTestCase, make_suite
+
+
+class BenchmarksTestCase(StangoTestCase):
+    def test_run(self):
+        options = benchmarks.Options(
+            pages=3, static_files=3, tar_members=3, file_size=100,
+            repeat=1, jobs=2, requests=3, concurrency=2,
+        )
+        workdir = self.tempdir()
+        result = benchmarks.run(benchmarks.BENCHMARKS, options, workdir)
+
+        # The results can be stored as JSON
+        result = json.loads(json.dumps(result))
+        self.eq(result['options']['pages'], 3)
+
+        results = result['results']
+        self.eq(sorted(results), ['config', 'generate', 'server'])
+        self.eq(results['config']['files'], 10)
+        self.eq(results['generate']['files'], 10)
+        self.eq(results['server']['throughput']['requests'], 3)
+
+        changes = list(benchmarks.compare(results, results))
+        assert ('generate.files', 10, 10) in changes
+
+        # The tar index is kept in the workdir, and the cold config
+        # load removes it
+        cache_home = os.path.abspath(os.path.join(workdir, 'cache'))
+        with benchmarks.environ('XDG_CACHE_HOME', cache_home), \
+             benchmarks.chdir(os.path.join(workdir, 'site')):
+            index_path = default_index_path('archive.tar')
+            assert index_path.startswith(cache_home + os.sep)
+            self.eq(os.path.exists(index_path), True)
+            benchmarks.config.remove_tar_index()
+            self.eq(os.path.exists(index_path), False)
+
+
+def suite():
+    return make_suite(BenchmarksTestCase)
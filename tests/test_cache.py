@@ -0,0 +1,103 @@
+from stango import Stango
+from stango.cache import ResponseCache
+from stango.files import Files
+
+import os
+
+from . import StangoTestCase, make_suite
+
+class CacheTestCase(StangoTestCase):
+    def setup(self):
+        self.tmp = self.tempdir()
+
+    def test_lru_eviction(self):
+        cache = ResponseCache(10)
+        cache.put('a', b'aaaa', [])
+        cache.put('b', b'bbbb', [])
+        self.eq(cache.get('a'), b'aaaa')
+
+        # 'b' is the least recently used entry
+        cache.put('c', b'cccc', [])
+        self.eq(cache.get('b'), None)
+        self.eq(cache.get('a'), b'aaaa')
+        self.eq(cache.get('c'), b'cccc')
+        self.eq(cache.size, 8)
+
+        # Too large to be cached at all
+        cache.put('d', b'd' * 11, [])
+        self.eq(cache.get('d'), None)
+        self.eq(len(cache), 2)
+
+    def test_invalidate_files(self):
+        cache = ResponseCache(100)
+        cache.put('a', b'a', ['foo.txt'])
+        cache.put('b', b'b', ['bar.txt', 'foo.txt'])
+        cache.put('c', b'c', [])
+
+        cache.invalidate_files([os.path.abspath('foo.txt')])
+        self.eq(cache.get('a'), None)
+        self.eq(cache.get('b'), None)
+        self.eq(cache.get('c'), b'c')
+
+    def test_dependency_invalidation(self):
+        data_file = os.path.join(self.tmp, 'data.txt')
+        with open(data_file, 'w') as fobj:
+            fobj.write('foo')
+        # Responses rendered from a file that was modified just now are
+        # not cached, see ResponseCache.put()
+        os.utime(data_file, (1000000000, 1000000000))
+
+        calls = []
+        def view(context):
+            calls.append(context.path)
+            context.add_dependency(data_file)
+            with open(data_file) as fobj:
+                return fobj.read()
+
+        manager = Stango()
+        manager.response_cache_size = 1024
+        manager.files = Files(('data.txt', view))
+        filespec = manager.files[0]
+
+        self.eq(manager.view(filespec, 'serving'), b'foo')
+        self.eq(manager.view(filespec, 'serving'), b'foo')
+        self.eq(len(calls), 1)
+
+        with open(data_file, 'w') as fobj:
+            fobj.write('quux')
+        self.eq(manager.view(filespec, 'serving'), b'quux')
+        self.eq(len(calls), 2)
+
+        # Generating is never cached
+        manager.view(filespec, 'generating')
+        self.eq(len(calls), 3)
+
+    def test_dependency_modified_while_rendering(self):
+        data_file = os.path.join(self.tmp, 'data.txt')
+        with open(data_file, 'w') as fobj:
+            fobj.write('foo')
+
+        calls = []
+        def view(context):
+            calls.append(context.path)
+            context.add_dependency(data_file)
+            with open(data_file) as fobj:
+                data = fobj.read()
+            # Modified after it was read
+            with open(data_file, 'w') as fobj:
+                fobj.write('quux')
+            return data
+
+        manager = Stango()
+        manager.response_cache_size = 1024
+        manager.files = Files(('data.txt', view))
+        filespec = manager.files[0]
+
+        self.eq(manager.view(filespec, 'serving'), b'foo')
+        self.eq(len(manager.response_cache), 0)
+        self.eq(manager.view(filespec, 'serving'), b'quux')
+        self.eq(len(calls), 2)
+
+
+def suite():
+    return make_suite(CacheTestCase)
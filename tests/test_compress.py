@@ -0,0 +1,48 @@
+import gzip
+import unittest
+
+from stango.compress import accepted_encoding, compress, is_compressible
+
+from . import StangoTestCase, make_suite
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+class CompressTestCase(StangoTestCase):
+    def test_is_compressible(self):
+        assert is_compressible('index.html')
+        assert is_compressible('style.css')
+        assert is_compressible('app.js')
+        assert is_compressible('feed.xml')
+        assert not is_compressible('image.png')
+        assert not is_compressible('archive.tar.gz')
+        assert not is_compressible('noextension')
+
+    def test_accepted_encoding(self):
+        self.eq(accepted_encoding(None, ['gzip']), None)
+        self.eq(accepted_encoding('gzip, deflate', ['gzip']), 'gzip')
+        self.eq(accepted_encoding('deflate', ['gzip']), None)
+        self.eq(accepted_encoding('GZIP;q=0.5', ['gzip']), 'gzip')
+        self.eq(accepted_encoding('gzip;q=0', ['gzip']), None)
+        self.eq(accepted_encoding('*', ['gzip']), 'gzip')
+        self.eq(accepted_encoding('*, gzip;q=0', ['gzip']), None)
+
+        # The order of the server's encodings is the preference
+        self.eq(accepted_encoding('gzip, br', ['br', 'gzip']), 'br')
+        self.eq(accepted_encoding('gzip', ['br', 'gzip']), 'gzip')
+
+    def test_compress_gzip(self):
+        data = b'foo bar baz ' * 100
+        self.eq(gzip.decompress(compress(data, 'gzip')), data)
+
+    @unittest.skipIf(brotli is None, 'brotli is not installed')
+    def test_compress_brotli(self):
+        data = b'foo bar baz ' * 100
+        self.eq(brotli.decompress(compress(data, 'br')), data)
+
+
+def suite():
+    return make_suite(CompressTestCase)
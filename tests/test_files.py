@@ -1,4 +1,5 @@
-from stango.files import Filespec, Files, files_from_dir, files_from_tar
+from stango.files import Filespec, Files, ViewSource, files_from_dir, \
+    files_from_tar, files_from_view
 from stango.views import file_from_tar, static_file
 
 import operator
@@ -149,6 +150,71 @@ class FilesTestCase(StangoTestCase):
         exc = self.assert_raises(TypeError, operator.setitem, files, 0, None)
         self.eq(str(exc), 'expected a Filespec object or tuple, got None')
 
+    def test_Files_duplicate_path(self):
+        exc = self.assert_raises(ValueError, Files,
+                                 ('foo', dummy_view), ('foo', dummy_view))
+        self.eq(str(exc), "'foo': duplicate path")
+
+        files = Files(('foo', dummy_view), ('bar', dummy_view))
+        exc = self.assert_raises(ValueError, operator.setitem,
+                                 files, 0, ('bar', dummy_view))
+        self.eq(str(exc), "'bar': duplicate path")
+
+        # Replacing a Filespec with one of the same path is fine
+        files[0] = ('foo', dummy_view, {'x': 1})
+        self.eq(files[0], Filespec('foo', dummy_view, {'x': 1}))
+
+        # Mounted paths are checked, too
+        files.mount(ViewSource(dummy_view, ['baz', 'quux']))
+        exc = self.assert_raises(ValueError, files.append,
+                                 ('baz', dummy_view))
+        self.eq(str(exc), "'baz': duplicate path")
+        exc = self.assert_raises(ValueError, files.mount,
+                                 ViewSource(dummy_view, ['bar']))
+        self.eq(str(exc), "'bar': duplicate path")
+
+        # Duplicates between Sources are found when iterating
+        files.mount(ViewSource(dummy_view, ['x', 'quux'], {'n': [1, 2]}))
+        exc = self.assert_raises(ValueError, list, files.iter_all())
+        self.eq(str(exc), "'quux': duplicate path")
+
+    def test_Files_find(self):
+        files = Files(
+            ('', dummy_view),
+            ('file', dummy_view),
+            ('dir/', dummy_view),
+        )
+        self.eq(files.find('file'), files[1])
+        self.eq(files.find('index.html', 'index.html'), files[0])
+        self.eq(files.find('dir/index.html', 'index.html'), files[2])
+        self.eq(files.find('dir/index.html'), None)
+        self.eq(files.find('dir/'), None)
+        self.eq(files.find('nonexistent', 'index.html'), None)
+        self.eq(files.find('xindex.html', 'index.html'), None)
+
+        # The index follows modifications
+        del files[1]
+        self.eq(files.find('file'), None)
+        files.append(('file', dummy_view, {'x': 1}))
+        self.eq(files.find('file'), Filespec('file', dummy_view, {'x': 1}))
+        files[0] = ('other', dummy_view)
+        self.eq(files.find('index.html', 'index.html'), None)
+        self.eq(files.find('other'), files[0])
+        files.clear()
+        self.eq(files.find('other'), None)
+
+    def test_Files_find_duplicate_realpath(self):
+        files = Files(
+            ('dir/', dummy_view),
+            ('dir/index.html', dummy_view),
+        )
+        exc = self.assert_raises(ValueError, files.find, 'dir/index.html',
+                                 'index.html')
+        self.eq(str(exc), "'dir/index.html': duplicate realpath")
+
+        # Without an index_file, the paths don't clash
+        self.eq(files.find('dir/index.html'), files[1])
+
     def test_files_from_dir(self):
         path = os.path.join(self.data_path, 'static')
         files = files_from_dir('foo', path)
@@ -241,6 +307,136 @@ class FilesTestCase(StangoTestCase):
             ],
         )
 
+    def assert_lazy_matches_eager(self, func, *args, **kwargs):
+        eager = func(*args, **kwargs)
+        lazy = func(*args, lazy=True, **kwargs)
+        self.eq(len(lazy), 0)
+        self.eq(lazy.len_all(), len(eager))
+        # A tar archive is opened separately for both
+        def key(filespec):
+            kwargs = filespec.kwargs
+            return filespec.path, kwargs.get('path'), kwargs.get('member')
+
+        self.eq(
+            sorted(key(x) for x in lazy.iter_all()),
+            sorted(key(x) for x in eager),
+        )
+        for filespec in eager:
+            self.eq(key(lazy.find(filespec.path)), key(filespec))
+        return lazy
+
+    def test_files_from_dir_lazy(self):
+        path = os.path.join(self.data_path, 'static')
+        for basepath in ['', 'foo']:
+            for strip in range(path.count('/') + 2):
+                self.assert_lazy_matches_eager(
+                    files_from_dir, basepath, path, strip=strip)
+
+        # Stripping components inside the directory
+        tmp = self.tempdir()
+        os.makedirs(os.path.join(tmp, 'a', 'b'))
+        for name in ['a/b/file.txt', 'a/other.txt']:
+            with open(os.path.join(tmp, name), 'w') as fobj:
+                fobj.write(name)
+        self.assert_lazy_matches_eager(
+            files_from_dir, 'foo', tmp, strip=tmp.count('/') + 2)
+
+        files = files_from_dir('foo', path, lazy=True)
+        static = os.path.join('foo', self.data_path, 'static')
+        self.eq(files.find(static + '/nonexistent.txt'), None)
+        self.eq(files.find(static + '/../static/file.txt'), None)
+        self.eq(files.find(static), None)
+        self.eq(files.find('bar/file.txt'), None)
+
+    def test_files_from_tar_lazy(self):
+        tar = os.path.join(self.data_path, 'test.tar')
+        for basepath in ['', 'foo']:
+            for strip in range(3):
+                self.assert_lazy_matches_eager(
+                    files_from_tar, basepath, tar, strip=strip)
+
+        files = files_from_tar('foo', tar, lazy=True)
+        self.eq(files.find('foo/static/nonexistent.txt'), None)
+
+    def test_Files_mounts(self):
+        path = os.path.join(self.data_path, 'static')
+        files = Files(('index.html', dummy_view))
+        files += files_from_dir('', path, strip=path.count('/') + 1,
+                                lazy=True)
+        self.eq(len(files), 1)
+        self.eq(files.len_all(), 3)
+        self.eq(len(files.mounts), 1)
+        self.eq(
+            sorted(x.path for x in files.iter_all()),
+            ['file.txt', 'index.html', 'other.txt'],
+        )
+        self.eq(files.get('file.txt').kwargs,
+                {'path': os.path.join(path, 'file.txt')})
+
+        # The sequence methods only address the explicit Filespecs
+        self.eq(list(files), [Filespec('index.html', dummy_view)])
+        assert files.get('file.txt') not in files
+        self.assert_raises(ValueError, files.index, files.get('file.txt'))
+        files.append(('a.html', dummy_view))
+        files.reverse()
+        self.eq([x.path for x in files], ['a.html', 'index.html'])
+        self.eq(files.index(Filespec('index.html', dummy_view)), 1)
+        self.eq(files.pop().path, 'index.html')
+        files.remove(Filespec('a.html', dummy_view))
+        self.eq(files.len_all(), 2)
+        files.append(('index.html', dummy_view))
+
+        prefixed = files.add_prefix('x/')
+        self.eq(
+            sorted(x.path for x in prefixed.iter_all()),
+            ['x/file.txt', 'x/index.html', 'x/other.txt'],
+        )
+        self.eq(prefixed.find('x/other.txt').path, 'x/other.txt')
+        self.eq(prefixed.find('other.txt'), None)
+
+        assert files == Files(files)
+        assert files != prefixed.add_prefix('')
+
+    def test_files_from_view(self):
+        files = files_from_view(
+            dummy_view,
+            ['a.html', 'b/', 'c.html'],
+            {'n': range(3), 'title': ['A', 'B', 'C']},
+        )
+        self.eq(len(files), 0)
+        self.eq(files.len_all(), 3)
+        self.eq(list(files.iter_all()), [
+            Filespec('a.html', dummy_view, {'n': 0, 'title': 'A'}),
+            Filespec('b/', dummy_view, {'n': 1, 'title': 'B'}),
+            Filespec('c.html', dummy_view, {'n': 2, 'title': 'C'}),
+        ])
+        self.eq(files.find('c.html'),
+                Filespec('c.html', dummy_view, {'n': 2, 'title': 'C'}))
+        self.eq(files.find('b/'), None)
+        self.eq(files.find('d.html'), None)
+
+        prefixed = files.add_prefix('x/')
+        self.eq([f.path for f in prefixed.iter_all()],
+                ['x/a.html', 'x/b/', 'x/c.html'])
+        self.eq(prefixed.find('x/a.html').kwargs, {'n': 0, 'title': 'A'})
+
+        # Values are verified up front
+        self.assert_raises(TypeError, files_from_view, 1, ['a'])
+        self.assert_raises(ValueError, files_from_view, dummy_view, ['/a'])
+        exc = self.assert_raises(ValueError, files_from_view, dummy_view,
+                                 ['a', 'b'], {'n': [1]})
+        self.eq(str(exc), "'n': expected 2 values, got 1")
+
+    def test_Files_add_prefix(self):
+        files = Files(('', dummy_view), ('a.html', dummy_view, {'x': 1}))
+        self.eq(files.add_prefix('foo/'), Files(
+            ('foo/', dummy_view),
+            ('foo/a.html', dummy_view, {'x': 1}),
+        ))
+        self.eq(files.add_prefix('foo/').find('foo/a.html').kwargs, {'x': 1})
+        self.assert_raises(ValueError, files.add_prefix, '/foo')
+        self.assert_raises(TypeError, files.add_prefix, None)
+
 
 def suite():
     return make_suite(FilesTestCase)
@@ -1,14 +1,31 @@
+import asyncio
+import functools
+import gc
+import gzip
 import io
 import os
+import threading
+import time
 import unittest
+import warnings
 
-from stango import Stango
-from stango.files import Files
+from stango import GenerateError, Stango
+from stango.files import Files, files_from_dir, files_from_tar
+from stango.manifest import Manifest
+from stango.tar import cache_dir
+from stango.views import io_bound
 
 from . import StangoTestCase, make_suite, view_value, view_template
 
 dummy_view = view_value('')
 
+
+class Unpicklable(Exception):
+    # Can't be rebuilt from its args
+    def __init__(self, a, b):
+        super(Unpicklable, self).__init__('%s %s' % (a, b))
+
+
 class GenerateTestCase(StangoTestCase):
     def setup(self):
         self.tmp = self.tempdir()
@@ -114,6 +131,59 @@ class GenerateTestCase(StangoTestCase):
         with open(os.path.join(self.tmp, 'index.html'), 'r') as fobj:
             self.eq(fobj.read(), 'barfoo')
 
+    def test_view_returns_an_iterable(self):
+        def view(context):
+            yield 'foo'
+            yield b'bar'
+            yield bytearray(b'baz')
+
+        self.manager.files = Files(
+            ('', view),
+            ('list.txt', view_value(['a', b'b'])),
+            ('empty.txt', view_value(iter([]))),
+        )
+        self.manager.generate(self.tmp)
+
+        with open(os.path.join(self.tmp, 'index.html'), 'rb') as fobj:
+            self.eq(fobj.read(), b'foobarbaz')
+        with open(os.path.join(self.tmp, 'list.txt'), 'rb') as fobj:
+            self.eq(fobj.read(), b'ab')
+        with open(os.path.join(self.tmp, 'empty.txt'), 'rb') as fobj:
+            self.eq(fobj.read(), b'')
+
+    def test_async_view(self):
+        async def view(context):
+            await asyncio.sleep(0)
+            return 'async ' + context.path
+
+        self.manager.files = Files(
+            ('async.txt', view),
+        )
+        self.manager.generate(self.tmp)
+
+        with open(os.path.join(self.tmp, 'async.txt')) as fobj:
+            self.eq(fobj.read(), 'async async.txt')
+
+    def test_view_returns_a_large_filelike_object(self):
+        data = bytes(range(256)) * 1024
+        self.manager.files = Files(
+            ('big.bin', view_value(io.BytesIO(data))),
+        )
+        self.manager.generate(self.tmp)
+
+        with open(os.path.join(self.tmp, 'big.bin'), 'rb') as fobj:
+            self.eq(fobj.read(), data)
+
+    def test_view_returns_an_iterable_with_invalid_chunks(self):
+        self.manager.files = Files(
+            ('foo.txt', view_value(['foo', 42])),
+        )
+        exc = self.assert_raises(ValueError, self.manager.generate, self.tmp)
+        self.eq(str(exc), "A chunk of the iterable, returned by view 'value_returner' for path 'foo.txt', is not a str, bytes or bytearray instance")
+
+        # The partially written file is removed
+        self.eq(os.listdir(self.tmp), [])
+
     def test_view_renders_a_template(self):
         self.manager.template_dirs.insert(0, self.template_path)
         self.manager.files = Files(
@@ -173,6 +243,38 @@ class GenerateTestCase(StangoTestCase):
         with open(os.path.join(self.tmp, 'index.html'), 'rb') as fobj:
             self.eq(fobj.read(), b'foobar hurr durr')
 
+    def test_post_render_hook_streamed_result(self):
+        def post_render_hook(context, data):
+            return data.upper()
+
+        self.manager.add_hook('post_render_hook', post_render_hook)
+        self.manager.files = Files(
+            ('', view_value(iter(['foo', 'bar']))),
+        )
+        self.manager.generate(self.tmp)
+
+        with open(os.path.join(self.tmp, 'index.html'), 'rb') as fobj:
+            self.eq(fobj.read(), b'FOOBAR')
+
+    def test_streaming_post_render_hook(self):
+        def post_render_hook(context, data):
+            if isinstance(data, bytes):
+                return data
+            return (chunk.upper() for chunk in data)
+        post_render_hook.streaming = True
+
+        self.manager.add_hook('post_render_hook', post_render_hook)
+        self.manager.files = Files(
+            ('', view_value(iter(['foo', 'bar']))),
+            ('bytes.txt', view_value('baz')),
+        )
+        self.manager.generate(self.tmp)
+
+        with open(os.path.join(self.tmp, 'index.html'), 'rb') as fobj:
+            self.eq(fobj.read(), b'FOOBAR')
+        with open(os.path.join(self.tmp, 'bytes.txt'), 'rb') as fobj:
+            self.eq(fobj.read(), b'baz')
+
     def test_post_render_hook_returns_None(self):
         self.manager.add_hook('post_render_hook', lambda x, y: None)
         self.manager.files = Files(
@@ -181,6 +283,463 @@ class GenerateTestCase(StangoTestCase):
         exc = self.assert_raises(ValueError, self.manager.generate, self.tmp)
         self.eq(str(exc), 'The result of post_render_hook is not a bytes or bytearray instance for index.html')
 
+    def test_generate_parallel(self):
+        self.manager.template_dirs.insert(0, self.template_path)
+        self.manager.files = Files(
+            ('', view_value('foobar')),
+            ('bytes.bin', view_value(b'\xde\xad\xbe\xef')),
+            [('dir%d/' % i, view_template('value.txt'), {'value': i})
+             for i in range(20)],
+        )
+
+        serial = os.path.join(self.tmp, 'serial')
+        self.manager.generate(serial)
+        parallel = os.path.join(self.tmp, 'parallel')
+        self.manager.generate_jobs = 4
+        self.manager.generate(parallel)
+
+        for filespec in self.manager.files:
+            realpath = filespec.realpath(self.manager.index_file)
+            with open(os.path.join(serial, realpath), 'rb') as fobj:
+                expected = fobj.read()
+            with open(os.path.join(parallel, realpath), 'rb') as fobj:
+                self.eq(fobj.read(), expected)
+
+    def test_generate_parallel_error(self):
+        self.manager.generate_jobs = 2
+        self.manager.files = Files(
+            [('file%d.txt' % i, view_value('foo')) for i in range(10)],
+            ('bad.txt', view_value(None)),
+        )
+        exc = self.assert_raises(ValueError, self.manager.generate, self.tmp)
+        self.eq(str(exc), "The result of view 'value_returner' for path 'bad.txt' is not a str, bytes or bytearray instance or a file-like object")
+
+    def test_generate_parallel_unpicklable_error(self):
+        def boom(context):
+            raise Unpicklable('foo', 'bar')
+
+        self.manager.generate_jobs = 2
+        self.manager.files = Files(
+            [('file%d.txt' % i, view_value('foo')) for i in range(10)],
+            ('bad.txt', boom),
+            ('other.txt', boom),
+        )
+        exc = self.assert_raises(GenerateError, self.manager.generate,
+                                 self.tmp)
+        self.eq(exc.path, 'bad.txt')
+        assert 'Unpicklable: foo bar' in exc.traceback, exc.traceback
+
+        # The serial error is the original one
+        self.manager.generate_jobs = 1
+        self.assert_raises(Unpicklable, self.manager.generate, self.tmp)
+
+    def test_generate_concurrent(self):
+        # Each view waits until the others have started, too
+        barrier = threading.Barrier(3, timeout=5)
+
+        @io_bound
+        def io_view(context, value):
+            barrier.wait()
+            return value
+
+        async def async_view(context, value):
+            barrier.wait()
+            return value
+
+        self.manager.generate_concurrency = 3
+        self.manager.files = Files(
+            ('a.txt', io_view, {'value': 'a'}),
+            ('b.txt', view_value('b')),
+            ('c.txt', async_view, {'value': 'c'}),
+            ('d.txt', io_view, {'value': 'd'}),
+        )
+        self.manager.generate(self.tmp)
+
+        for name in 'abcd':
+            with open(os.path.join(self.tmp, name + '.txt')) as fobj:
+                self.eq(fobj.read(), name)
+
+    def test_generate_concurrent_closes_loops(self):
+        async def async_view(context, value):
+            return value
+
+        self.manager.generate_concurrency = 3
+        self.manager.files = Files(
+            [('file%d.txt' % i, async_view, {'value': 'x'})
+             for i in range(10)],
+        )
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always', ResourceWarning)
+            for i in range(3):
+                self.manager.generate(self.tmp)
+            gc.collect()
+        self.eq([str(w.message) for w in caught
+                 if issubclass(w.category, ResourceWarning)], [])
+
+    def test_generate_concurrent_error(self):
+        @io_bound
+        def bad_view(context, i):
+            time.sleep(0.01 * (5 - i))
+            raise ValueError('file%d.txt' % i)
+
+        self.manager.files = Files(
+            [('file%d.txt' % i, bad_view, {'i': i}) for i in range(5)],
+        )
+        exc = self.assert_raises(ValueError, self.manager.generate, self.tmp)
+        self.eq(str(exc), 'file0.txt')
+
+    def test_generate_lazy_sources(self):
+        static = os.path.join(self.data_path, 'static')
+        strip = static.count('/') + 1
+        self.manager.files = Files(('', view_value('foobar')))
+        self.manager.files += files_from_dir('static', static, strip=strip,
+                                             lazy=True)
+        self.manager.files += files_from_tar(
+            'tar', os.path.join(self.data_path, 'test.tar'), strip=1,
+            lazy=True)
+
+        for jobs in [1, 2]:
+            self.manager.generate_jobs = jobs
+            outdir = os.path.join(self.tmp, str(jobs))
+            self.manager.generate(outdir)
+            for name in ['static/file.txt', 'tar/file.txt']:
+                with open(os.path.join(outdir, name), 'rb') as fobj:
+                    self.eq(fobj.read(), b'This is a test file\n')
+            self.eq(sorted(os.listdir(outdir)), ['index.html', 'static', 'tar'])
+
+    def test_generate_profile(self):
+        self.manager.template_dirs.insert(0, self.template_path)
+        self.manager.add_hook('post_render_hook',
+                              lambda context, data: data + b'!')
+        self.manager.files = Files(
+            ('', view_value('foobar')),
+            [('dir%d/' % i, view_template('value.txt'), {'value': i})
+             for i in range(3)],
+        )
+        self.manager.generate(self.tmp)
+        self.eq(self.manager.build_report, None)
+
+        self.manager.profile = True
+        for jobs in [1, 2]:
+            self.manager.generate_jobs = jobs
+            self.manager.generate(self.tmp)
+            report = self.manager.build_report
+
+            self.eq(sorted(page['path'] for page in report.pages),
+                    ['', 'dir0/', 'dir1/', 'dir2/'])
+            for page in report.pages:
+                assert page['view'] > 0 and page['hook'] > 0
+                assert page['write'] > 0
+                self.eq(page['total'],
+                        page['view'] + page['hook'] + page['write'])
+                if page['path']:
+                    assert 0 < page['template'] <= page['view']
+                    self.eq(page['bytes'], len(b'value is: 0!'))
+                else:
+                    self.eq(page['template'], 0)
+                    self.eq(page['bytes'], 7)
+
+            views = report.per_view()
+            self.eq(sorted((v['function'].split('.')[-1], v['pages'])
+                           for v in views),
+                    [('template_renderer', 3), ('value_returner', 1)])
+            self.eq(len(report.slowest(2)), 2)
+
+            text = report.format(2)
+            assert 'Slowest pages:' in text
+            assert 'Totals per view:' in text
+
+    def test_generate_skip_unchanged(self):
+        static = os.path.join(self.data_path, 'static')
+        values = {'': 'foo', 'stream': 'bar'}
+        def value(context, name):
+            return values[name]
+        def stream(context, name):
+            return iter([values[name], '!'])
+        def static_file(context):
+            return open(os.path.join(static, 'file.txt'), 'rb')
+
+        self.manager.skip_unchanged = True
+        self.manager.files = Files(
+            ('', value, {'name': ''}),
+            ('stream.txt', stream, {'name': 'stream'}),
+            ('stale.txt', value, {'name': ''}),
+            ('file.txt', static_file),
+        )
+        self.manager.generate(self.tmp)
+
+        def mtimes():
+            result = {}
+            for dirpath, dirnames, filenames in os.walk(self.tmp):
+                for filename in filenames:
+                    path = os.path.join(dirpath, filename)
+                    name = os.path.relpath(path, self.tmp)
+                    result[name] = os.stat(path).st_mtime
+            return result
+
+        # Backdate the outputs to see which ones are rewritten
+        for name in mtimes():
+            os.utime(os.path.join(self.tmp, name), (1000, 1000))
+
+        values['stream'] = 'baz'
+        del self.manager.files[2]
+        self.manager.files.append(('stale.txt/', value, {'name': ''}))
+        self.manager.generate_jobs = 2
+        self.manager.generate(self.tmp)
+
+        result = mtimes()
+        self.eq(sorted(result), ['file.txt', 'index.html',
+                                 'stale.txt/index.html', 'stream.txt'])
+        self.eq(result['index.html'], 1000)
+        self.eq(result['file.txt'], 1000)
+        assert result['stream.txt'] > 1000
+        with open(os.path.join(self.tmp, 'stream.txt'), 'rb') as fobj:
+            self.eq(fobj.read(), b'baz!')
+
+        # A file in place of a directory is replaced, too
+        self.manager.files[-1] = ('stale.txt', value, {'name': ''})
+        self.manager.generate(self.tmp)
+        self.eq(sorted(mtimes()), ['file.txt', 'index.html', 'stale.txt',
+                                   'stream.txt'])
+
+    def test_generate_precompress(self):
+        static = os.path.join(self.data_path, 'static')
+        page = 'Lorem ipsum dolor sit amet. ' * 100
+        def static_file(context):
+            return open(os.path.join(static, 'file.txt'), 'rb')
+
+        self.manager.precompress = ['gzip']
+        self.manager.skip_unchanged = True
+        self.manager.files = Files(
+            ('', view_value(page)),
+            ('streamed.css', view_value(iter([page, page]))),
+            ('small.txt', view_value('foo')),
+            ('binary.bin', view_value(page)),
+            ('static.txt', static_file),
+        )
+        self.manager.generate(self.tmp)
+
+        self.eq(sorted(os.listdir(self.tmp)), [
+            'binary.bin', 'index.html', 'index.html.gz', 'small.txt',
+            'static.txt', 'streamed.css', 'streamed.css.gz',
+        ])
+        for name, expected in [('index.html', page),
+                               ('streamed.css', page + page)]:
+            with gzip.open(os.path.join(self.tmp, name + '.gz')) as fobj:
+                self.eq(fobj.read(), expected.encode('utf-8'))
+
+        # Turning precompression off removes the siblings
+        self.manager.precompress = []
+        self.manager.files[1] = ('streamed.css', view_value(page))
+        self.manager.generate(self.tmp)
+        self.eq(sorted(os.listdir(self.tmp)), [
+            'binary.bin', 'index.html', 'small.txt', 'static.txt',
+            'streamed.css',
+        ])
+
+        self.manager.precompress = ['deflate']
+        exc = self.assert_raises(ValueError, self.manager.generate, self.tmp)
+        self.eq(str(exc), "Unsupported precompress encoding 'deflate'")
+
+    def test_generate_precompress_static_file(self):
+        static = os.path.join(self.tmp, 'static')
+        os.mkdir(static)
+        data = b'body { color: red; }\n' * 100
+        with open(os.path.join(static, 'style.css'), 'wb') as fobj:
+            fobj.write(data)
+
+        self.manager.precompress = ['gzip']
+        self.manager.files = files_from_dir('', static,
+                                            strip=static.count('/') + 1)
+        outdir = os.path.join(self.tmp, 'out')
+        self.manager.generate(outdir)
+
+        with gzip.open(os.path.join(outdir, 'style.css.gz')) as fobj:
+            self.eq(fobj.read(), data)
+
+    def test_generate_duplicate_realpath(self):
+        self.manager.files = Files(
+            ('a/', view_value('dir')),
+            ('a/index.html', view_value('file')),
+        )
+        for incremental in [False, True]:
+            self.manager.incremental = incremental
+            exc = self.assert_raises(ValueError, self.manager.generate,
+                                     self.tmp)
+            self.eq(str(exc), "'a/index.html': duplicate realpath")
+
+    def test_generate_incremental(self):
+        template_dir = os.path.join(self.tmp, 'templates')
+        os.mkdir(template_dir)
+        with open(os.path.join(template_dir, 'page.txt'), 'w') as fobj:
+            fobj.write('page {{ value }}')
+
+        # Recorded to self, as the values captured by a closure are a
+        # part of its identity
+        self.rendered = []
+        def view(context, value):
+            self.rendered.append(context.path)
+            return context.render_template('page.txt', value=value)
+
+        outdir = os.path.join(self.tmp, 'out')
+        self.manager.template_dirs.insert(0, template_dir)
+        self.manager.incremental = True
+        self.manager.files = Files(
+            ('', view, {'value': 1}),
+            ('a/', view, {'value': 2}),
+            ('b.txt', view_value('b')),
+        )
+        self.manager.generate(outdir)
+        self.eq(sorted(self.rendered), ['', 'a/'])
+
+        # Nothing changed
+        del self.rendered[:]
+        self.manager.generate(outdir)
+        self.eq(self.rendered, [])
+
+        # Changed kwargs and a removed Filespec
+        self.manager.files = Files(
+            ('', view, {'value': 1}),
+            ('a/', view, {'value': 3}),
+        )
+        self.manager.generate(outdir)
+        self.eq(self.rendered, ['a/'])
+        self.eq(sorted(os.listdir(outdir)),
+                ['a', 'index.html'])
+        with open(os.path.join(outdir, 'a/index.html')) as fobj:
+            self.eq(fobj.read(), 'page 3')
+
+        # Changed template
+        del self.rendered[:]
+        with open(os.path.join(template_dir, 'page.txt'), 'w') as fobj:
+            fobj.write('new page {{ value }}')
+        self.manager.generate(outdir)
+        self.eq(sorted(self.rendered), ['', 'a/'])
+        with open(os.path.join(outdir, 'index.html')) as fobj:
+            self.eq(fobj.read(), 'new page 1')
+
+        # kwargs without a stable repr() are never considered fresh
+        del self.rendered[:]
+        self.manager.files = Files(
+            ('', view, {'value': 1}),
+            ('a/', view, {'value': object()}),
+        )
+        self.manager.generate(outdir)
+        self.manager.generate(outdir)
+        self.eq(self.rendered, ['a/', 'a/'])
+
+    def test_generate_incremental_settings_changed(self):
+        page = 'Lorem ipsum dolor sit amet. ' * 100
+        rendered = []
+        def view(context):
+            rendered.append(context.path)
+            return page
+
+        outdir = os.path.join(self.tmp, 'out')
+        self.manager.incremental = True
+        self.manager.files = Files(('page.txt', view))
+        self.manager.generate(outdir)
+
+        # Enabling precompress rebuilds everything
+        self.manager.precompress = ['gzip']
+        self.manager.generate(outdir)
+        self.eq(rendered, ['page.txt', 'page.txt'])
+        self.eq(sorted(os.listdir(outdir)),
+                ['page.txt', 'page.txt.gz'])
+
+        # Disabling it removes the compressed files
+        self.manager.precompress = []
+        self.manager.generate(outdir)
+        self.eq(len(rendered), 3)
+        self.eq(sorted(os.listdir(outdir)), ['page.txt'])
+
+    def test_generate_incremental_closure_changed(self):
+        outdir = os.path.join(self.tmp, 'out')
+        self.manager.incremental = True
+        self.manager.files = Files(('a.txt', view_value('one')))
+        self.manager.generate(outdir)
+
+        # The values captured by a closure are a part of its identity
+        self.manager.files = Files(('a.txt', view_value('two')))
+        self.manager.generate(outdir)
+        with open(os.path.join(outdir, 'a.txt')) as fobj:
+            self.eq(fobj.read(), 'two')
+
+    def test_generate_incremental_templates_changed(self):
+        # Recorded to self, as the values captured by a closure are a
+        # part of its identity
+        self.rendered = []
+        def view(context):
+            self.rendered.append(context.path)
+            return 'page'
+
+        outdir = os.path.join(self.tmp, 'out')
+        self.manager.incremental = True
+        self.manager.files = Files(('page.txt', view))
+        self.manager.generate(outdir)
+        self.manager.generate(outdir)
+        self.eq(self.rendered, ['page.txt'])
+
+        # Template settings affect every page
+        self.manager.template_dirs.insert(0, self.tmp)
+        self.manager.generate(outdir)
+        self.manager.jinja_extensions.append('jinja2.ext.do')
+        self.manager.generate(outdir)
+        self.eq(self.rendered, ['page.txt'] * 3)
+
+    def test_generate_incremental_removes_stale_dirs(self):
+        outdir = os.path.join(self.tmp, 'out')
+        self.manager.incremental = True
+        self.manager.files = Files(
+            ('', view_value('foo')),
+            ('path/to/file.txt', view_value('bar')),
+        )
+        self.manager.generate(outdir)
+
+        # Unrelated files are kept
+        with open(os.path.join(outdir, 'extra.txt'), 'w') as fobj:
+            fobj.write('extra')
+
+        self.manager.files = Files(('', view_value('foo')))
+        self.manager.generate(outdir)
+        self.eq(sorted(os.listdir(outdir)),
+                ['extra.txt', 'index.html'])
+
+    def test_generate_incremental_manifest_location(self):
+        outdir = os.path.join(self.tmp, 'out')
+        self.manager.incremental = True
+        self.manager.files = Files(('', view_value('foo')))
+        self.manager.generate(outdir)
+
+        # The manifest isn't deployed with the site
+        self.eq(os.listdir(outdir), ['index.html'])
+        self.eq(os.path.isfile(Manifest(outdir).filename), True)
+        self.eq(os.path.dirname(Manifest(outdir).filename), cache_dir())
+
+    def test_generate_incremental_unnamed_callables(self):
+        rendered = []
+        def view(context, value):
+            rendered.append(context.path)
+            return value
+
+        class Hook(object):
+            def __call__(self, context, data):
+                return data.upper()
+
+        outdir = os.path.join(self.tmp, 'out')
+        self.manager.incremental = True
+        self.manager.add_hook('post_render_hook', Hook())
+        self.manager.files = Files(
+            ('a.txt', functools.partial(view, value='a')),
+        )
+
+        # Unnamed views and hooks have no key, so they're always rendered
+        self.manager.generate(outdir)
+        self.manager.generate(outdir)
+        self.eq(rendered, ['a.txt', 'a.txt'])
+        with open(os.path.join(outdir, 'a.txt')) as fobj:
+            self.eq(fobj.read(), 'A')
+
 
 def suite():
     return make_suite(GenerateTestCase)
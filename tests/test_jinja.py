@@ -0,0 +1,112 @@
+from stango import Stango
+from stango.files import Files, files_from_dir
+
+import os
+
+from . import StangoTestCase, make_suite
+
+class JinjaTestCase(StangoTestCase):
+    def setup(self):
+        self.tmp = self.tempdir()
+        self.cache_dir = os.path.join(self.tmp, 'cache')
+        self.templates = os.path.join(self.tmp, 'templates')
+        os.mkdir(self.templates)
+
+    def make_manager(self, **settings):
+        manager = Stango()
+        manager.template_dirs.insert(0, self.templates)
+        manager.template_cache_dir = self.cache_dir
+        for name, value in settings.items():
+            setattr(manager, name, value)
+        return manager
+
+    def write_template(self, name, contents):
+        with open(os.path.join(self.templates, name), 'w') as fobj:
+            fobj.write(contents)
+
+    def test_bytecode_cache(self):
+        self.write_template('page.txt', 'page {{ value }}')
+        manager = self.make_manager()
+        manager.jinja_env.get_template('page.txt')
+        self.eq(len(os.listdir(self.cache_dir)), 1)
+
+        # A new environment loads the template from the cache
+        manager = self.make_manager()
+        compiled = []
+        def compile(*args, **kwargs):
+            compiled.append(args)
+            raise AssertionError('template was compiled')
+        manager.jinja_env.compile = compile
+        template = manager.jinja_env.get_template('page.txt')
+        self.eq(template.render(value=1), 'page 1')
+        self.eq(compiled, [])
+
+    def test_compile_templates(self):
+        self.write_template('a.txt', 'a {{ value }}')
+        self.write_template('b.txt', '{% include "a.txt" %} b')
+        self.write_template('broken.txt', '{% if %}')
+        manager = self.make_manager()
+        self.eq(manager.compile_templates(), 2)
+        self.eq(len(os.listdir(self.cache_dir)), 2)
+
+        # The templates are not compiled again when rendering
+        def compile(*args, **kwargs):
+            raise AssertionError('template was compiled')
+        manager.jinja_env.compile = compile
+        template = manager.jinja_env.get_template('b.txt')
+        self.eq(template.render(value=1), 'a 1 b')
+
+    def test_compile_templates_cache_size(self):
+        for i in range(5):
+            self.write_template('page%d.txt' % i, 'page %d' % i)
+        manager = self.make_manager()
+        manager.jinja_env.cache.capacity = 2
+        self.eq(manager.compile_templates(), 5)
+        self.eq(len(manager.jinja_env.cache), 5)
+
+    def test_template_dependencies(self):
+        self.write_template('a.txt', 'a')
+        self.write_template('b.txt', 'b')
+        self.write_template('page.txt',
+                            '{% include ["missing.txt", "a.txt"] %}')
+        def view(context):
+            return context.render_template('page.txt')
+
+        manager = self.make_manager()
+        manager.files = Files(('page.txt', view))
+        context, result = manager.render(manager.files[0], 'generating')
+        self.eq(result, b'a')
+        self.eq(sorted(os.path.basename(f) for f in context.dependencies),
+                ['a.txt', 'page.txt'])
+
+    def test_environment_is_lazy(self):
+        os.rmdir(self.templates)
+        for jobs in [1, 2]:
+            manager = self.make_manager(generate_jobs=jobs)
+            manager.files = files_from_dir('static', self.data_path, strip=2)
+            manager.generate(os.path.join(self.tmp, 'out'))
+            assert 'jinja_env' not in manager.__dict__
+
+    def test_bytecode_cache_size_limit(self):
+        for i in range(20):
+            self.write_template('page%d.txt' % i, 'page %d {{ value }}' % i)
+
+        manager = self.make_manager()
+        manager.jinja_env.get_template('page0.txt')
+        size = os.path.getsize(os.path.join(
+            self.cache_dir, os.listdir(self.cache_dir)[0]))
+
+        manager = self.make_manager(template_cache_size=size * 5)
+        for i in range(20):
+            manager.jinja_env.get_template('page%d.txt' % i)
+
+        total = sum(
+            os.path.getsize(os.path.join(self.cache_dir, f))
+            for f in os.listdir(self.cache_dir)
+        )
+        self.eq(total <= size * 5, True)
+        self.eq(len(os.listdir(self.cache_dir)) > 0, True)
+
+
+def suite():
+    return make_suite(JinjaTestCase)
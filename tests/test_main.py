@@ -1,10 +1,13 @@
 from io import StringIO
+import json
 import os
 import sys
+import tarfile
 
 import stango.autoreload
 import stango.main
 from stango import Stango
+from stango.http import ServerState
 
 from . import StangoTestCase, make_suite
 
@@ -111,6 +114,78 @@ files = Files(('', lambda x: 'foo'))
         self.eq(manager.index_file, 'index.html')
         self.eq(manager.hooks['post_render_hook'](None, 'foo'), 'foobar')
 
+    def test_generate_jobs(self):
+        self.write_config('''\
+from stango import Files
+generate_jobs = 2
+files = Files()
+''')
+
+        def fake_generate(mgr, outdir):
+            return mgr
+        self.monkey_patch(Stango, 'generate', fake_generate)
+
+        self.set_argv('stango', 'generate')
+        exc = self.assert_raises(SystemExit, stango.main.run)
+        self.eq(exc.args[0].generate_jobs, 2)
+
+        self.set_argv('stango', 'generate', '-j', '4', 'quux')
+        exc = self.assert_raises(SystemExit, stango.main.run)
+        self.eq(exc.args[0].generate_jobs, 4)
+
+        self.set_argv('stango', 'generate', '-j', '0')
+        exc = self.assert_raises(SystemExit, stango.main.run)
+        self.eq(exc.args[0], 2)
+
+    def test_generate_incremental_conf_view(self):
+        conf = '''\
+from stango import Files
+def view(context):
+    return %r
+files = Files(('page.txt', view))
+'''
+        self.write_config(conf % 'v1!')
+        self.set_argv('stango', 'generate', '-i')
+        self.eq(self.assert_raises(SystemExit, stango.main.run).args[0], 0)
+
+        # Editing a view of conf.py invalidates its outputs
+        self.write_config(conf % 'v2!!')
+        self.eq(self.assert_raises(SystemExit, stango.main.run).args[0], 0)
+        with open(os.path.join('out', 'page.txt')) as fobj:
+            self.eq(fobj.read(), 'v2!!')
+
+    def test_generate_report(self):
+        self.write_config('''\
+from stango import Files
+index_file = 'index.html'
+def page(context):
+    return 'foo'
+files = Files(('', page), ('other.html', page))
+''')
+        self.set_argv('stango', 'generate', '--report', '--top=1',
+                      '--report-json=report.json', '--profile=profile.out')
+        exc = self.assert_raises(SystemExit, stango.main.run)
+        self.eq(exc.args[0], 0)
+
+        output = sys.stdout.getvalue()
+        assert 'Generated 2 pages' in output
+        assert 'Totals per view:' in output
+        slowest = output.split('Slowest pages:\n')[1].split('\n\n')[0]
+        self.eq(len(slowest.splitlines()), 2)
+
+        with open('report.json') as fobj:
+            report = json.load(fobj)
+        self.eq(report['pages'], 2)
+        self.eq(report['bytes'], 6)
+        self.eq(sorted(page['path'] for page in report['slowest']),
+                ['', 'other.html'])
+        self.eq([(v['function'], v['pages']) for v in report['views']],
+                [('page', 2)])
+
+        import pstats
+        stats = pstats.Stats('profile.out')
+        assert any(func[2] == 'generate' for func in stats.stats)
+
     def test_quickstart(self):
         self.set_argv('stango', 'quickstart')
         self.assert_raises(SystemExit, stango.main.run)
@@ -124,6 +199,145 @@ files = Files(('', lambda x: 'foo'))
 
         self.eq(sorted(os.listdir('out')), ['greeting.html', 'index.html'])
 
+    def test_reload(self):
+        self.write_config('''\
+from stango import Files
+import reload_views
+autoreload_inprocess = True
+files = Files(('', reload_views.view))
+''')
+        with open('reload_views.py', 'w') as fobj:
+            fobj.write('def view(context):\n    return "foo"\n')
+
+        httpd = ServerState(
+            stango.main.make_manager(stango.main.load_config()))
+        try:
+            old_manager = httpd.manager
+            self.eq(old_manager.files[0].view(None), 'foo')
+
+            # A non-code change keeps the manager
+            assert stango.main.reload(httpd, {os.path.abspath('x.css')})
+            assert httpd.manager is old_manager
+
+            # A change to a view module re-executes conf.py
+            with open('reload_views.py', 'w') as fobj:
+                fobj.write('def view(context):\n    return "barbar"\n')
+            changed = {os.path.abspath('reload_views.py')}
+            assert stango.main.reload(httpd, changed)
+            assert httpd.manager is not old_manager
+            self.eq(httpd.manager.files[0].view(None), 'barbar')
+
+            # A broken conf.py keeps the old configuration
+            self.write_config('files = (')
+            manager = httpd.manager
+            changed = {os.path.abspath('conf.py')}
+            assert stango.main.reload(httpd, changed)
+            assert httpd.manager is manager
+            assert sys.stderr.getvalue().endswith(
+                'Reloading conf.py failed, keeping the old configuration\n')
+
+            # Stango itself can't be reloaded in-process
+            changed = {os.path.abspath(stango.main.__file__)}
+            self.eq(stango.main.reload(httpd, changed), False)
+        finally:
+            sys.modules.pop('reload_views', None)
+
+    def test_reload_imported_names(self):
+        self.write_config('''\
+from stango import Files
+import reload_views
+autoreload_inprocess = True
+files = Files(('', reload_views.view))
+''')
+        with open('reload_views.py', 'w') as fobj:
+            fobj.write('from reload_helpers import greet\n'
+                       'def view(context):\n    return greet()\n')
+        with open('reload_helpers.py', 'w') as fobj:
+            fobj.write('def greet():\n    return "old"\n')
+
+        try:
+            httpd = ServerState(
+                stango.main.make_manager(stango.main.load_config()))
+            self.eq(httpd.manager.files[0].view(None), 'old')
+
+            # The module that imported greet is reloaded too
+            with open('reload_helpers.py', 'w') as fobj:
+                fobj.write('def greet():\n    return "newer"\n')
+            changed = {os.path.abspath('reload_helpers.py')}
+            assert stango.main.reload(httpd, changed)
+            self.eq(httpd.manager.files[0].view(None), 'newer')
+        finally:
+            sys.modules.pop('reload_views', None)
+            sys.modules.pop('reload_helpers', None)
+
+    def test_reload_settings(self):
+        conf = '''\
+from stango.files import files_from_dir
+autoreload = %r
+autoreload_inprocess = True
+server_threads = %d
+files = files_from_dir('', 'static', strip=1)
+'''
+        os.mkdir('static')
+        with open(os.path.join('static', 'a.txt'), 'w') as fobj:
+            fobj.write('a')
+        self.write_config(conf % (['static'], 4))
+        self.monkey_patch(stango.autoreload, 'BACKEND', 'auto')
+        self.monkey_patch(stango.autoreload, '_new_filepatterns', None)
+
+        manager = stango.main.make_manager(stango.main.load_config())
+        httpd = manager.make_server('127.0.0.1', 0)
+        try:
+            # Changing a file keeps the manager
+            changed = {os.path.abspath('static/a.txt')}
+            assert stango.main.reload(httpd, changed)
+            assert httpd.manager is manager
+
+            # Adding a file re-executes conf.py
+            with open(os.path.join('static', 'b.txt'), 'w') as fobj:
+                fobj.write('b')
+            changed = {os.path.abspath('static/b.txt')}
+            assert stango.main.reload(httpd, changed)
+            self.eq(sorted(f.path for f in httpd.manager.files),
+                    ['a.txt', 'b.txt'])
+
+            # So does removing one
+            os.remove(os.path.join('static', 'a.txt'))
+            changed = {os.path.abspath('static/a.txt')}
+            assert stango.main.reload(httpd, changed)
+            self.eq([f.path for f in httpd.manager.files], ['b.txt'])
+
+            # The new settings are applied
+            self.write_config(conf % (['static', 'other'], 2))
+            assert stango.main.reload(httpd, {os.path.abspath('conf.py')})
+            self.eq(httpd.threads.limit, 2)
+            self.eq(stango.autoreload._new_filepatterns, ['static', 'other'])
+
+            # The tar archives of the old configuration are closed
+            with tarfile.open('test.tar', 'w') as tar:
+                tar.add(os.path.join('static', 'b.txt'), 'c.txt')
+            with open('conf.py', 'a') as fobj:
+                fobj.write('from stango.files import files_from_tar\n')
+                fobj.write("files += files_from_tar('t', 'test.tar')\n")
+                fobj.write("files += files_from_tar('l', 'test.tar', "
+                           "lazy=True)\n")
+            assert stango.main.reload(httpd, {os.path.abspath('conf.py')})
+            archives = [httpd.manager.files.get('t/c.txt').kwargs['tar'],
+                        httpd.manager.files.get('l/c.txt').kwargs['tar']]
+            for archive in archives:
+                with archive.open('c.txt') as fobj:
+                    self.eq(fobj.read(), b'b')
+            assert stango.main.reload(httpd, {os.path.abspath('conf.py')})
+            self.eq([archive._fd for archive in archives], [None, None])
+
+            # The server engine can't be changed in-process
+            with open('conf.py', 'a') as fobj:
+                fobj.write("server_engine = 'asyncio'\n")
+            self.eq(stango.main.reload(httpd, {os.path.abspath('conf.py')}),
+                    False)
+        finally:
+            httpd.server_close()
+
     def test_runserver(self):
         self.set_argv('stango', 'runserver')
         self.write_config('''\
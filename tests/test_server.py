@@ -1,8 +1,19 @@
 from stango import Stango
-from stango.files import Files
+from stango.files import Files, Source, files_from_dir, files_from_tar
+from stango.http import not_modified, parse_range
+from stango.stats import RequestStats
 
+import asyncio
 import functools
-from threading import Thread
+import gzip
+import io
+import json
+import os
+import socket
+import sys
+import time
+from http.client import HTTPConnection
+from threading import Event, Thread
 from urllib.request import urlopen
 from urllib.error import HTTPError
 
@@ -30,7 +41,7 @@ class ServerTestCase(StangoTestCase):
             finally:
                 httpd.shutdown()
                 server_thread.join()
-                httpd.socket.close()
+                httpd.server_close()
 
         return wrapper
 
@@ -57,6 +68,232 @@ class ServerTestCase(StangoTestCase):
         self.eq(data.read(), b'bazbuzz')
         self.eq(data.info()['Content-Type'], 'text/html')
 
+    @serve
+    def test_streamed(self):
+        def view(context):
+            for i in range(3):
+                yield 'chunk%d ' % i
+
+        self.manager.files = Files(
+            ('stream.txt', view),
+        )
+        yield self.manager.make_server('127.0.0.1', 8080)
+
+        data = urlopen('http://127.0.0.1:8080/stream.txt')
+        self.eq(data.read(), b'chunk0 chunk1 chunk2 ')
+
+    @serve
+    def test_static_file(self):
+        self.manager.files = files_from_dir('static', self.data_path, strip=2)
+        yield self.manager.make_server('127.0.0.1', 8080)
+
+        data = urlopen('http://127.0.0.1:8080/static/static/file.txt')
+        self.eq(data.read(), b'This is a test file\n')
+        self.eq(data.info()['Content-Type'], 'text/plain')
+
+    @serve
+    def test_lazy_static_files(self):
+        self.manager.files = files_from_dir('static', self.data_path, strip=2,
+                                            lazy=True)
+        yield self.manager.make_server('127.0.0.1', 8080)
+
+        data = urlopen('http://127.0.0.1:8080/static/static/file.txt')
+        self.eq(data.read(), b'This is a test file\n')
+
+        exc = self.assert_raises(
+            HTTPError, urlopen, 'http://127.0.0.1:8080/static/../conf.py')
+        self.eq(exc.code, 404)
+
+    def request(self, path, headers={}):
+        conn = HTTPConnection('127.0.0.1', 8080)
+        try:
+            conn.request('GET', path, headers=headers)
+            response = conn.getresponse()
+            return response.status, response.getheaders(), response.read()
+        finally:
+            conn.close()
+
+    @serve
+    def test_request_hook_and_stats(self):
+        records = []
+        self.manager.request_hook = records.append
+        self.manager.server_stats = True
+        self.manager.response_cache_size = 1024
+        self.manager.files = Files(
+            ('', view_value('foobar')),
+        )
+        yield self.manager.make_server('127.0.0.1', 8080)
+
+        for i in range(2):
+            self.eq(self.request('/')[0], 200)
+        self.eq(self.request('/missing')[0], 404)
+
+        # The hook is called after the response has been sent
+        deadline = time.time() + 5
+        while len(records) < 3 and time.time() < deadline:
+            time.sleep(0.01)
+
+        # The records of consecutive requests may arrive in any order
+        records.sort(key=lambda r: (r['path'], r['cache']))
+        self.eq([(r['path'], r['status'], r['bytes'], r['cache'])
+                 for r in records], [
+            ('/', 200, 6, 'hit'),
+            ('/', 200, 6, 'miss'),
+            ('/missing', 404, 0, None),
+        ])
+        self.eq(records[0]['view'].split('.')[-1], 'value_returner')
+        self.eq(records[2]['view'], None)
+        assert all(r['latency'] > 0 for r in records)
+
+        status, headers, body = self.request('/_stango/stats')
+        self.eq(status, 200)
+        self.eq(dict(headers)['Content-Type'], 'application/json')
+        stats = json.loads(body.decode('utf-8'))
+        self.eq(stats['requests'], 3)
+        self.eq(stats['bytes'], 12)
+        self.eq(stats['status'], {'200': 2, '404': 1})
+        self.eq(stats['cache'], {'hit': 1, 'miss': 1})
+        self.eq(stats['latency']['samples'], 3)
+        assert stats['latency']['p50'] <= stats['latency']['p99']
+        self.eq(sorted(p['path'] for p in stats['slowest_paths']),
+                ['/', '/missing'])
+        self.eq([v['requests'] for v in stats['views']], [2])
+
+        # The stats endpoint is only enabled by server_stats
+        self.manager.server_stats = False
+        self.eq(self.request('/_stango/stats')[0], 404)
+
+    @serve
+    def test_fingerprinted_asset(self):
+        self.manager.fingerprint = ['static/*.txt']
+        self.manager.files = files_from_dir('static', self.data_path, strip=2)
+        name = self.manager.assets.lookup('static/static/file.txt')['path']
+        yield self.manager.make_server('127.0.0.1', 8080)
+
+        status, headers, body = self.request('/' + name)
+        self.eq(status, 200)
+        self.eq(body, b'This is a test file\n')
+        self.eq(dict(headers)['Cache-Control'],
+                'public, max-age=31536000, immutable')
+
+        # The logical name is served, too, but not cached for long
+        status, headers, body = self.request('/static/static/file.txt')
+        self.eq(body, b'This is a test file\n')
+        assert 'Cache-Control' not in dict(headers)
+
+    @serve
+    def test_compressed_response(self):
+        page = 'Lorem ipsum dolor sit amet. ' * 100
+        self.manager.precompress = ['gzip']
+        self.manager.files = Files(
+            ('', view_value(page)),
+            ('small.txt', view_value('foo')),
+            ('large.txt', view_value('x' * (3 * 1024 * 1024))),
+            ('stream.txt', lambda context: (page for i in range(2))),
+        )
+        yield self.manager.make_server('127.0.0.1', 8080)
+
+        status, headers, body = self.request('/')
+        headers = dict(headers)
+        self.eq(body, page.encode('utf-8'))
+        assert 'Content-Encoding' not in headers
+        self.eq(headers['Vary'], 'Accept-Encoding')
+        etag = headers['ETag']
+
+        for i in range(2):
+            status, headers, body = self.request(
+                '/', {'Accept-Encoding': 'gzip, deflate'})
+            headers = dict(headers)
+            self.eq(status, 200)
+            self.eq(headers['Content-Encoding'], 'gzip')
+            self.eq(headers['Content-Length'], str(len(body)))
+            self.eq(headers['ETag'], etag[:-1] + '-gzip"')
+            self.eq(gzip.decompress(body), page.encode('utf-8'))
+
+        status, headers, body = self.request('/', {
+            'Accept-Encoding': 'gzip',
+            'If-None-Match': etag[:-1] + '-gzip"',
+        })
+        self.eq(status, 304)
+
+        status, headers, body = self.request(
+            '/small.txt', {'Accept-Encoding': 'gzip'})
+        self.eq(body, b'foo')
+        assert 'Content-Encoding' not in dict(headers)
+
+        # Large and streamed responses would have to be read to memory
+        # to be compressed
+        for path in ['/large.txt', '/stream.txt']:
+            status, headers, body = self.request(
+                path, {'Accept-Encoding': 'gzip'})
+            self.eq(status, 200)
+            assert 'Content-Encoding' not in dict(headers)
+
+    @serve
+    def test_compressed_files_with_same_etag(self):
+        # Files of the same size and mtime get the same ETag
+        static = os.path.join(self.tempdir(), 'static')
+        os.mkdir(static)
+        for name in ['a', 'b']:
+            filename = os.path.join(static, name + '.css')
+            with open(filename, 'w') as fobj:
+                fobj.write(name * 1000)
+            os.utime(filename, (1000000000, 1000000000))
+
+        self.manager.precompress = ['gzip']
+        self.manager.files = files_from_dir('static', static,
+                                            strip=static.count('/') + 1)
+        yield self.manager.make_server('127.0.0.1', 8080)
+
+        for name in ['a', 'b']:
+            status, headers, body = self.request(
+                '/static/%s.css' % name, {'Accept-Encoding': 'gzip'})
+            self.eq(dict(headers)['Content-Encoding'], 'gzip')
+            self.eq(gzip.decompress(body), name.encode('ascii') * 1000)
+
+    @serve
+    def test_conditional_get_etag(self):
+        self.manager.files = Files(
+            ('', view_value('foobar')),
+        )
+        yield self.manager.make_server('127.0.0.1', 8080)
+
+        status, headers, body = self.request('/')
+        headers = dict(headers)
+        self.eq(status, 200)
+        self.eq(headers['Content-Length'], '6')
+        etag = headers['ETag']
+
+        status, headers, body = self.request('/', {'If-None-Match': etag})
+        self.eq(status, 304)
+        self.eq(dict(headers)['ETag'], etag)
+        self.eq(body, b'')
+
+        status, headers, body = self.request('/', {'If-None-Match': '"x"'})
+        self.eq(status, 200)
+        self.eq(body, b'foobar')
+
+    @serve
+    def test_conditional_get_last_modified(self):
+        self.manager.files = files_from_dir('static', self.data_path, strip=2)
+        yield self.manager.make_server('127.0.0.1', 8080)
+
+        status, headers, body = self.request('/static/static/file.txt')
+        headers = dict(headers)
+        self.eq(status, 200)
+        self.eq(headers['Content-Length'], str(len(body)))
+        last_modified = headers['Last-Modified']
+
+        status, headers, body = self.request(
+            '/static/static/file.txt', {'If-Modified-Since': last_modified})
+        self.eq(status, 304)
+        self.eq(body, b'')
+
+        status, headers, body = self.request(
+            '/static/static/file.txt',
+            {'If-Modified-Since': 'Thu, 01 Jan 1970 00:00:00 GMT'})
+        self.eq(status, 200)
+
     @serve
     def test_404(self):
         self.manager.files = Files(
@@ -68,6 +305,403 @@ class ServerTestCase(StangoTestCase):
         exc = self.assert_raises(HTTPError, urlopen, url)
         self.eq(exc.code, 404)
 
+    @serve
+    def test_view_error(self):
+        def broken(context):
+            raise RuntimeError('broken view')
+        self.manager.files = Files(
+            ('', view_value('foobar')),
+            ('broken', broken),
+        )
+        yield self.manager.make_server('127.0.0.1', 8080)
+
+        saved_stderr = sys.stderr
+        sys.stderr = io.StringIO()
+        conn = HTTPConnection('127.0.0.1', 8080)
+        try:
+            # Both engines answer with a 500 and close the connection
+            conn.request('GET', '/broken')
+            response = conn.getresponse()
+            self.eq(response.status, 500)
+            self.eq(response.getheader('Content-Length'), '0')
+            self.eq(response.getheader('Connection'), 'close')
+            self.eq(response.read(), b'')
+            assert 'RuntimeError: broken view' in sys.stderr.getvalue()
+        finally:
+            conn.close()
+            sys.stderr = saved_stderr
+
+        self.eq(self.request('/')[2], b'foobar')
+
+    @serve
+    def test_concurrent_requests(self):
+        release = Event()
+        def slow_view(context):
+            release.wait(10)
+            return 'slow'
+
+        self.manager.files = Files(
+            ('slow.txt', slow_view),
+            ('fast.txt', view_value('fast')),
+        )
+        yield self.manager.make_server('127.0.0.1', 8080)
+
+        results = []
+        def fetch_slow():
+            results.append(urlopen('http://127.0.0.1:8080/slow.txt').read())
+        slow_thread = Thread(target=fetch_slow)
+        slow_thread.start()
+
+        # The slow view doesn't block other requests
+        data = urlopen('http://127.0.0.1:8080/fast.txt', timeout=5)
+        self.eq(data.read(), b'fast')
+        self.eq(results, [])
+
+        release.set()
+        slow_thread.join()
+        self.eq(results, [b'slow'])
+
+    @serve
+    def test_async_view(self):
+        async def view(context):
+            await asyncio.sleep(0)
+            return 'async ' + context.path
+
+        self.manager.files = Files(
+            ('async.txt', view),
+        )
+        yield self.manager.make_server('127.0.0.1', 8080)
+
+        data = urlopen('http://127.0.0.1:8080/async.txt')
+        self.eq(data.read(), b'async async.txt')
+
+    @serve
+    def test_keep_alive_and_pipelining(self):
+        self.manager.files = Files(
+            ('a.txt', view_value('aaa')),
+            ('b.txt', view_value('bb')),
+        )
+        yield self.manager.make_server('127.0.0.1', 8080)
+
+        sock = socket.create_connection(('127.0.0.1', 8080), timeout=5)
+        try:
+            # All three requests are sent before reading the responses
+            sock.sendall(
+                b'GET /a.txt HTTP/1.1\r\nHost: x\r\n\r\n'
+                b'GET /b.txt HTTP/1.1\r\nHost: x\r\n\r\n'
+                b'GET /c.txt HTTP/1.1\r\nHost: x\r\n'
+                b'Connection: close\r\n\r\n')
+
+            data = b''
+            while True:
+                chunk = sock.recv(4096)
+                if not chunk:
+                    break
+                data += chunk
+        finally:
+            sock.close()
+
+        responses = data.split(b'HTTP/1.1 ')[1:]
+        self.eq([r.split(b'\r\n', 1)[0] for r in responses],
+                [b'200 OK', b'200 OK', b'404 Not Found'])
+        assert responses[0].endswith(b'\r\n\r\naaa')
+        assert responses[1].endswith(b'\r\n\r\nbb')
+
+    @serve
+    def test_chunked_response(self):
+        def view(context):
+            for i in range(3):
+                yield 'chunk%d ' % i
+
+        self.manager.files = Files(
+            ('stream.txt', view),
+        )
+        yield self.manager.make_server('127.0.0.1', 8080)
+
+        conn = HTTPConnection('127.0.0.1', 8080)
+        try:
+            for i in range(2):
+                conn.request('GET', '/stream.txt')
+                response = conn.getresponse()
+                self.eq(response.getheader('Transfer-Encoding'), 'chunked')
+                self.eq(response.read(), b'chunk0 chunk1 chunk2 ')
+        finally:
+            conn.close()
+
+        conn = HTTPConnection('127.0.0.1', 8080)
+        conn._http_vsn, conn._http_vsn_str = 10, 'HTTP/1.0'
+        try:
+            conn.request('GET', '/stream.txt')
+            response = conn.getresponse()
+            self.eq(response.getheader('Connection'), 'close')
+            self.eq(response.read(), b'chunk0 chunk1 chunk2 ')
+        finally:
+            conn.close()
+
+    @serve
+    def test_idle_keep_alive_connections(self):
+        self.manager.server_threads = 2
+        self.manager.files = Files(
+            ('', view_value('foobar')),
+        )
+        yield self.manager.make_server('127.0.0.1', 8080)
+
+        # Idle keep-alive connections don't keep others from being served
+        idle = [HTTPConnection('127.0.0.1', 8080) for i in range(3)]
+        try:
+            for conn in idle:
+                conn.request('GET', '/')
+                self.eq(conn.getresponse().read(), b'foobar')
+
+            start = time.time()
+            data = urlopen('http://127.0.0.1:8080/', timeout=5)
+            self.eq(data.read(), b'foobar')
+            assert time.time() - start < 1
+
+            # Reused after waiting idle
+            idle[0].request('GET', '/')
+            self.eq(idle[0].getresponse().read(), b'foobar')
+        finally:
+            for conn in idle:
+                conn.close()
+
+    @serve
+    def test_keep_alive_without_threads(self):
+        self.manager.server_threads = 1
+        self.manager.files = Files(
+            ('', view_value('foobar')),
+        )
+        yield self.manager.make_server('127.0.0.1', 8080)
+
+        conn = HTTPConnection('127.0.0.1', 8080)
+        try:
+            conn.request('GET', '/')
+            self.eq(conn.getresponse().read(), b'foobar')
+            data = urlopen('http://127.0.0.1:8080/', timeout=5)
+            self.eq(data.read(), b'foobar')
+        finally:
+            conn.close()
+
+    @serve
+    def test_head(self):
+        self.manager.response_cache_size = 1024
+        self.manager.files = Files(
+            ('', view_value('foobar')),
+        )
+        yield self.manager.make_server('127.0.0.1', 8080)
+
+        conn = HTTPConnection('127.0.0.1', 8080)
+        try:
+            # The body is not rendered for HEAD...
+            conn.request('HEAD', '/')
+            response = conn.getresponse()
+            self.eq(response.status, 200)
+            self.eq(response.getheader('Content-Type'), 'text/html')
+            self.eq(response.read(), b'')
+            self.eq(len(self.manager.response_cache), 0)
+
+            conn.request('GET', '/')
+            self.eq(conn.getresponse().read(), b'foobar')
+
+            # ...unless it's cached
+            conn.request('HEAD', '/')
+            response = conn.getresponse()
+            self.eq(response.getheader('Content-Length'), '6')
+            self.eq(response.read(), b'')
+
+            conn.request('HEAD', '/missing')
+            self.eq(conn.getresponse().status, 404)
+        finally:
+            conn.close()
+
+    @serve
+    def test_head_files(self):
+        self.manager.files = Files(
+            files_from_dir('static', self.data_path, strip=2),
+            files_from_tar('tar', os.path.join(self.data_path, 'test.tar'),
+                           strip=1, lazy=True),
+        )
+        yield self.manager.make_server('127.0.0.1', 8080)
+
+        conn = HTTPConnection('127.0.0.1', 8080)
+        try:
+            for path in ['/static/static/file.txt', '/tar/file.txt']:
+                # Files are opened, but not read, to send the same
+                # headers as for GET
+                status, get_headers, body = self.request(path)
+                conn.request('HEAD', path)
+                response = conn.getresponse()
+                self.eq(response.status, 200)
+                self.eq(response.read(), b'')
+                headers = dict(response.getheaders())
+                self.eq(headers['Content-Length'], '20')
+                self.eq(headers['Accept-Ranges'], 'bytes')
+                self.eq(headers['ETag'], dict(get_headers)['ETag'])
+                self.eq(headers['Last-Modified'],
+                        dict(get_headers)['Last-Modified'])
+
+                conn.request('HEAD', path,
+                             headers={'If-None-Match': headers['ETag']})
+                response = conn.getresponse()
+                self.eq(response.status, 304)
+                response.read()
+        finally:
+            conn.close()
+
+
+    @serve
+    def test_range(self):
+        self.manager.files = Files(
+            ('page.txt', view_value('foobar')),
+            files_from_dir('static', self.data_path, strip=2),
+            files_from_tar('tar', os.path.join(self.data_path, 'test.tar'),
+                           strip=1, lazy=True),
+        )
+        yield self.manager.make_server('127.0.0.1', 8080)
+
+        for path in ['/static/static/file.txt', '/tar/file.txt']:
+            status, headers, body = self.request(path, {'Range': 'bytes=5-6'})
+            headers = dict(headers)
+            self.eq(status, 206)
+            self.eq(body, b'is')
+            self.eq(headers['Content-Range'], 'bytes 5-6/20')
+            self.eq(headers['Content-Length'], '2')
+            self.eq(headers['Accept-Ranges'], 'bytes')
+
+            status, headers, body = self.request(path, {'Range': 'bytes=15-'})
+            self.eq((status, body), (206, b'file\n'))
+            status, headers, body = self.request(path, {'Range': 'bytes=-3'})
+            self.eq((status, body), (206, b'le\n'))
+
+            status, headers, body = self.request(path, {'Range': 'bytes=20-'})
+            self.eq(status, 416)
+            self.eq(dict(headers)['Content-Range'], 'bytes */20')
+
+            # Multiple ranges aren't supported, the whole file is sent
+            status, headers, body = self.request(
+                path, {'Range': 'bytes=0-1,5-6'})
+            self.eq((status, body), (200, b'This is a test file\n'))
+
+        status, headers, body = self.request('/page.txt', {'Range': 'bytes=3-'})
+        self.eq((status, body), (206, b'bar'))
+        etag = dict(headers)['ETag']
+
+        # The range is only sent if the content hasn't changed
+        status, headers, body = self.request(
+            '/page.txt', {'Range': 'bytes=3-', 'If-Range': etag})
+        self.eq((status, body), (206, b'bar'))
+        status, headers, body = self.request(
+            '/page.txt', {'Range': 'bytes=3-', 'If-Range': '"x"'})
+        self.eq((status, body), (200, b'foobar'))
+
+    def test_parse_range(self):
+        self.eq(parse_range('bytes=0-9', 100), (0, 9))
+        self.eq(parse_range('bytes=90-200', 100), (90, 99))
+        self.eq(parse_range('bytes=90-', 100), (90, 99))
+        self.eq(parse_range('bytes=-10', 100), (90, 99))
+        self.eq(parse_range('bytes=-200', 100), (0, 99))
+        self.eq(parse_range('bytes=100-', 100), (100, 99))
+        self.eq(parse_range('bytes=-0', 100), (100, 100))
+        for value in [None, '', 'bytes=-', 'bytes=5-1', 'items=0-1',
+                      'bytes=0-1,3-4', 'bytes=a-b']:
+            self.eq(parse_range(value, 100), None)
+
+    def test_request_stats_paths(self):
+        stats = RequestStats(max_paths=2)
+        for path in ['/a?x=1', '/a?x=2', '/b', '/c', '/d?e']:
+            stats.record({'path': path, 'status': 200, 'bytes': 1,
+                          'latency': 0.1, 'cache': None, 'view': None})
+        self.eq(sorted((p['path'], p['requests'])
+                       for p in stats.snapshot()['slowest_paths']),
+                [('(other)', 2), ('/a', 2), ('/b', 1)])
+
+    def test_not_modified(self):
+        headers = {'Last-Modified': 'Sun, 09 Sep 2001 01:46:40 GMT'}
+        for since, expected in [
+                ('Sun, 09 Sep 2001 01:46:40 GMT', True),
+                ('Sun, 09 Sep 2001 01:46:40 -0000', True),
+                ('Sun, 09 Sep 2001 03:46:40 +0200', True),
+                ('Sun, 09 Sep 2001 01:46:39 -0000', False),
+                ('Sun, 09 Sep 2001 02:46:40 +0200', False),
+                ('garbage', False)]:
+            self.eq(not_modified({'If-Modified-Since': since}, headers),
+                    expected)
+
+
+class AsyncServerTestCase(ServerTestCase):
+    # Run all the server tests against the asyncio engine, too
+    def setup(self):
+        ServerTestCase.setup(self)
+        self.manager.server_engine = 'asyncio'
+
+    def test_shutdown(self):
+        started = Event()
+        async def slow(context):
+            started.set()
+            try:
+                await asyncio.sleep(10)
+            finally:
+                # Takes a while to finish when the server shuts down
+                await asyncio.sleep(0.1)
+            return 'slow'
+
+        self.manager.files = Files(
+            ('slow.txt', slow),
+        )
+        httpd = self.manager.make_server('127.0.0.1', 8080)
+        server_thread = Thread(target=httpd.serve_forever)
+        server_thread.start()
+        conn = HTTPConnection('127.0.0.1', 8080)
+        try:
+            conn.request('GET', '/slow.txt')
+            started.wait(5)
+        finally:
+            # serve_forever() has returned when shutdown() returns, so
+            # the server can be closed right away
+            httpd.shutdown()
+            httpd.server_close()
+            server_thread.join()
+            conn.close()
+
+    @ServerTestCase.serve
+    def test_blocking_lookup(self):
+        release = Event()
+        class SlowSource(Source):
+            def _entries(self):
+                return iter([])
+
+            def _get(self, path):
+                if path == 'slow.txt':
+                    release.wait(10)
+                return None
+
+        self.manager.files = Files(
+            ('fast.txt', view_value('fast')),
+            SlowSource(),
+        )
+        yield self.manager.make_server('127.0.0.1', 8080)
+
+        results = []
+        def fetch_slow():
+            try:
+                urlopen('http://127.0.0.1:8080/slow.txt')
+            except HTTPError as exc:
+                results.append(exc.code)
+        slow_thread = Thread(target=fetch_slow)
+        slow_thread.start()
+
+        # A slow lookup doesn't block the event loop
+        try:
+            data = urlopen('http://127.0.0.1:8080/fast.txt', timeout=5)
+            self.eq(data.read(), b'fast')
+            self.eq(results, [])
+        finally:
+            release.set()
+            slow_thread.join()
+        self.eq(results, [404])
+
 
 def suite():
-    return make_suite(ServerTestCase)
+    suite = make_suite(ServerTestCase)
+    suite.addTest(make_suite(AsyncServerTestCase))
+    return suite
@@ -0,0 +1,185 @@
+from stango.tar import TarArchive, MemberReader, POOL_SIZE, cache_dir
+
+import gc
+import io
+import os
+import tarfile
+from threading import Thread
+
+from . import StangoTestCase, make_suite
+
+class TarTestCase(StangoTestCase):
+    def setup(self):
+        self.tmp = self.tempdir()
+        self.contents = {
+            'a.txt': b'This is a\n',
+            'dir/b.bin': bytes(range(256)) * 100,
+        }
+
+    def make_tar(self, name, mode='w'):
+        path = os.path.join(self.tmp, name)
+        with tarfile.open(path, mode) as tar:
+            for member, data in sorted(self.contents.items()):
+                info = tarfile.TarInfo(member)
+                info.size = len(data)
+                info.mtime = 1234567890
+                tar.addfile(info, io.BytesIO(data))
+        return path
+
+    def read_all(self, archive):
+        result = {}
+        for member in archive.members:
+            fobj = archive.open(member)
+            try:
+                result[member] = fobj.read()
+            finally:
+                fobj.close()
+        return result
+
+    def test_uncompressed(self):
+        archive = TarArchive(self.make_tar('test.tar'))
+        self.eq(archive.compressed, False)
+        self.eq(self.read_all(archive), self.contents)
+
+        fobj = archive.open('dir/b.bin')
+        self.eq(isinstance(fobj, MemberReader), True)
+        self.eq((fobj.size, fobj.mtime), (25600, 1234567890))
+        fobj.seek(256)
+        self.eq(fobj.read(3), b'\x00\x01\x02')
+        self.eq(fobj.tell(), 259)
+        fobj.seek(-2, os.SEEK_END)
+        self.eq(fobj.read(), b'\xfe\xff')
+        self.eq(fobj.read(), b'')
+
+    def test_compressed(self):
+        archive = TarArchive(self.make_tar('test.tar.gz', 'w:gz'))
+        self.eq(archive.compressed, True)
+        self.eq(self.read_all(archive), self.contents)
+
+        fobj = archive.open('a.txt')
+        self.eq((fobj.size, fobj.mtime), (10, 1234567890))
+
+    def test_persisted_index(self):
+        path = self.make_tar('test.tar')
+        archive = TarArchive(path)
+        self.eq(os.path.dirname(archive.index_path), cache_dir())
+        self.eq(os.path.exists(archive.index_path), True)
+        self.eq(os.listdir(self.tmp), ['test.tar'])
+
+        # Archives with the same name have separate indexes
+        other = os.path.join(self.tmp, 'other')
+        os.mkdir(other)
+        with tarfile.open(os.path.join(other, 'test.tar'), 'w'):
+            pass
+        assert TarArchive(os.path.join(other, 'test.tar')).index_path != \
+            archive.index_path
+
+        # The index is used instead of scanning the archive
+        saved_open = tarfile.open
+        def fail_open(*args, **kwargs):
+            raise AssertionError('archive was scanned')
+        tarfile.open = fail_open
+        try:
+            archive = TarArchive(path)
+        finally:
+            tarfile.open = saved_open
+        self.eq(self.read_all(archive), self.contents)
+
+        # A changed archive is indexed again
+        self.contents['new.txt'] = b'new'
+        os.remove(path)
+        self.make_tar('test.tar')
+        os.utime(path, (0, 0))
+        archive = TarArchive(path)
+        self.eq(self.read_all(archive), self.contents)
+
+    def test_no_persisted_index(self):
+        path = self.make_tar('test.tar')
+        archive = TarArchive(path, index_path=False)
+        self.eq(os.listdir(self.tmp), ['test.tar'])
+        self.eq(self.read_all(archive), self.contents)
+
+    def test_compressed_pool(self):
+        archive = TarArchive(self.make_tar('test.tar.gz', 'w:gz'))
+
+        # Open members hold distinct handles, which are reused when the
+        # members are closed
+        members = [archive.open('a.txt') for i in range(POOL_SIZE + 2)]
+        self.eq(len(set(id(fobj.tar) for fobj in members)), POOL_SIZE + 2)
+        self.eq([fobj.read() for fobj in members],
+                [self.contents['a.txt']] * (POOL_SIZE + 2))
+        tars = [fobj.tar for fobj in members]
+        for fobj in members:
+            fobj.close()
+        self.eq(archive._pool, tars[:POOL_SIZE])
+        self.eq([tar.closed for tar in tars],
+                [False] * POOL_SIZE + [True, True])
+
+        with archive.open('dir/b.bin') as fobj:
+            assert fobj.tar in tars
+            self.eq(fobj.read(), self.contents['dir/b.bin'])
+        self.eq(len(archive._pool), POOL_SIZE)
+
+    def test_close(self):
+        archive = TarArchive(self.make_tar('test.tar'))
+        fobj = archive.open('dir/b.bin')
+        self.eq(fobj.read(3), b'\x00\x01\x02')
+        fd = archive._fd
+        archive.close()
+        self.assert_raises(OSError, os.fstat, fd)
+
+        # Members can still be read, the archive is opened again
+        self.eq(fobj.read(3), b'\x03\x04\x05')
+        self.eq(self.read_all(archive), self.contents)
+
+        # Closing while reading leaves the descriptor open for the read
+        saved_pread = os.pread
+        def closing_pread(fd, size, offset):
+            archive.close()
+            os.fstat(fd)
+            return saved_pread(fd, size, offset)
+        os.pread = closing_pread
+        try:
+            self.eq(fobj.read(3), b'\x06\x07\x08')
+        finally:
+            os.pread = saved_pread
+        self.eq(archive._fd, None)
+
+        # An archive that isn't referenced anymore is closed
+        self.eq(fobj.read(3), b'\x09\x0a\x0b')
+        fd = archive._fd
+        del archive, fobj
+        gc.collect()
+        self.assert_raises(OSError, os.fstat, fd)
+
+    def test_close_compressed(self):
+        with TarArchive(self.make_tar('test.tar.gz', 'w:gz')) as archive:
+            fobj = archive.open('a.txt')
+            self.eq(self.read_all(archive), self.contents)
+            tars = list(archive._pool)
+        self.eq(archive._pool, [])
+        self.eq([tar.closed for tar in tars], [True] * len(tars))
+
+        # A member that was open is closed when it's done
+        tar = fobj.tar
+        self.eq(fobj.read(), self.contents['a.txt'])
+        fobj.close()
+        self.eq((tar.closed, archive._pool), (True, []))
+
+    def test_threads(self):
+        for name, mode in [('test.tar', 'w'), ('test.tar.gz', 'w:gz')]:
+            archive = TarArchive(self.make_tar(name, mode))
+            results = []
+            def reader():
+                for i in range(20):
+                    results.append(self.read_all(archive) == self.contents)
+            threads = [Thread(target=reader) for i in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.eq(results, [True] * 80)
+
+
+def suite():
+    return make_suite(TarTestCase)
@@ -1,7 +1,9 @@
 from stango import Stango
 from stango.files import files_from_dir, files_from_tar
+from stango.views import file_from_tar
 
 import os
+import tarfile
 
 from . import StangoTestCase, make_suite
 
@@ -36,6 +38,28 @@ class ViewsTestCase(StangoTestCase):
         with open(os.path.join(self.tmp, 'foo/other.txt')) as fobj:
             self.eq(fobj.read(), 'This is also a test file\n')
 
+    def test_static_file_large(self):
+        data = bytes(range(256)) * 1024
+        path = os.path.join(self.tmp, 'src')
+        os.mkdir(path)
+        with open(os.path.join(path, 'big.bin'), 'wb') as fobj:
+            fobj.write(data)
+
+        self.manager.files += files_from_dir('', path, strip=3)
+        self.manager.generate(os.path.join(self.tmp, 'out'))
+        with open(os.path.join(self.tmp, 'out/big.bin'), 'rb') as fobj:
+            self.eq(fobj.read(), data)
+
+    def test_static_file_post_render_hook(self):
+        self.manager.add_hook('post_render_hook',
+                              lambda context, data: data.upper())
+        strip = self.data_path.count('/') + 2
+        path = os.path.join(self.data_path, 'static')
+        self.manager.files += files_from_dir('foo', path, strip=strip)
+        self.manager.generate(self.tmp)
+        with open(os.path.join(self.tmp, 'foo/file.txt')) as fobj:
+            self.eq(fobj.read(), 'THIS IS A TEST FILE\n')
+
     def test_file_from_tar(self):
         # stango.files.files_from_dir uses the stango.views.file_from_tar view
         tar = os.path.join(self.data_path, 'test.tar')
@@ -53,5 +77,27 @@ class ViewsTestCase(StangoTestCase):
         with open(os.path.join(self.tmp, 'foo/static/other.txt')) as fobj:
             self.eq(fobj.read(), 'This is also a test file\n')
 
+    def test_file_from_tar_tarfile(self):
+        # A plain TarFile works, too
+        tar = tarfile.open(os.path.join(self.data_path, 'test.tar'))
+        self.addCleanup(tar.close)
+        self.manager.files += [
+            ('file.txt', file_from_tar,
+             {'tar': tar, 'member': 'static/file.txt'}),
+        ]
+        self.manager.generate(self.tmp)
+        with open(os.path.join(self.tmp, 'file.txt')) as fobj:
+            self.eq(fobj.read(), 'This is a test file\n')
+
+    def test_file_from_tar_parallel(self):
+        tar = os.path.join(self.data_path, 'test.tar')
+        self.manager.files += files_from_tar('foo', tar)
+        self.manager.generate_jobs = 2
+        self.manager.generate(self.tmp)
+        with open(os.path.join(self.tmp, 'foo/static/file.txt')) as fobj:
+            self.eq(fobj.read(), 'This is a test file\n')
+        with open(os.path.join(self.tmp, 'foo/static/other.txt')) as fobj:
+            self.eq(fobj.read(), 'This is also a test file\n')
+
 def suite():
     return make_suite(ViewsTestCase)